@@ -0,0 +1,197 @@
+import asyncio
+import glob
+import gzip
+import json
+import logging
+import os
+import sys
+import time as clock
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models
+from .database import AsyncSessionLocal, async_engine
+from .timeutil import KST, to_db_time
+
+logger = logging.getLogger("studyflow.archive")
+
+ARCHIVE_DIR = os.environ.get("STUDYFLOW_ARCHIVE_DIR", "./archive")
+EVENTLOG_HOT_MONTHS = int(os.environ.get("STUDYFLOW_EVENTLOG_HOT_MONTHS", 1))  # months kept in event_logs, incl. the current one
+
+# Cold store for closed months of event_logs. One month = one gzip file of JSONL rows in which every student's
+# rows are a separate gzip member, plus a JSON index of each member's byte offset and length. A student's month
+# is read by seeking to its member and decompressing only that; gzip.open() still reads the file as a whole.
+#
+#   archive/event_logs-2024-05.index.json   {"month": "2024-05", "file": "event_logs-2024-05.r1.jsonl.gz", "rows": 1234,
+#                                            "students": {"S1": [offset, length, rows], ...}}
+#   archive/event_logs-2024-05.r1.jsonl.gz
+#
+# Re-archiving a month writes a new revision of the data file; replacing the index is the commit point.
+
+def _index_path(month: str) -> str:
+    return os.path.join(ARCHIVE_DIR, f"event_logs-{month}.index.json")
+
+def _data_path(index: dict) -> str:
+    return os.path.join(ARCHIVE_DIR, index["file"])
+
+def month_bounds(month: str) -> Tuple[datetime, datetime]:
+    # event_logs.timestamp is stored as naive server-local time, like every other DateTime column
+    year, mon = map(int, month.split("-"))
+    start = datetime(year, mon, 1)
+    return start, datetime(year + mon // 12, mon % 12 + 1, 1)
+
+def month_of(ts: datetime) -> str:
+    return ts.strftime("%Y-%m")
+
+def shift_month(month: str, months: int) -> str:
+    year, mon = map(int, month.split("-"))
+    n = year * 12 + mon - 1 + months
+    return f"{n // 12:04d}-{n % 12 + 1:02d}"
+
+def archived_months() -> List[str]:
+    return sorted(os.path.basename(p)[len("event_logs-"):-len(".index.json")]
+                  for p in glob.glob(os.path.join(glob.escape(ARCHIVE_DIR), "event_logs-*.index.json")))
+
+def load_index(month: str) -> Optional[dict]:
+    try:
+        with open(_index_path(month), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _row(ev: models.EventLog) -> dict:
+    return {"id": ev.id, "student_id": ev.student_id, "type": ev.type, "timestamp": ev.timestamp, "payload": ev.payload}
+
+def _decode(line: bytes) -> dict:
+    row = json.loads(line)
+    row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+    return row
+
+def _read_member(path: str, offset: int, length: int) -> List[dict]:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return [_decode(line) for line in gzip.decompress(f.read(length)).splitlines()]
+
+def read_student_month(month: str, student_id: str) -> List[dict]:
+    index = load_index(month)
+    entry = index and index["students"].get(student_id)
+    if not entry:
+        return []
+    return _read_member(_data_path(index), entry[0], entry[1])
+
+def iter_month(month: str) -> Iterator[dict]:
+    # every row of an archived month, grouped by student, in id order within a student
+    with gzip.open(_data_path(load_index(month)), "rb") as f:
+        for line in f:
+            yield _decode(line)
+
+def _write_month(month: str, by_student: Dict[str, List[dict]], previous: Optional[dict]) -> dict:
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    revision = previous["revision"] + 1 if previous else 1
+    index = {"month": month, "revision": revision, "file": f"event_logs-{month}.r{revision}.jsonl.gz", "rows": 0, "students": {}}
+    index_path = _index_path(month)
+    with open(_data_path(index), "wb") as f:
+        for student_id in sorted(by_student):
+            rows = sorted(by_student[student_id], key=lambda r: r["id"])
+            member = gzip.compress("".join(json.dumps({**r, "timestamp": r["timestamp"].isoformat()}, ensure_ascii=False) + "\n"
+                                           for r in rows).encode("utf-8"), mtime=0)
+            index["students"][student_id] = [f.tell(), len(member), len(rows)]
+            index["rows"] += len(rows)
+            f.write(member)
+        f.flush()
+        os.fsync(f.fileno())
+    with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(index_path + ".tmp", index_path)
+    if previous:
+        os.remove(_data_path(previous))
+    return index
+
+async def archive_month(db: AsyncSession, month: str) -> dict:
+    # Moves every event_logs row of month into its archive file, merging with what an earlier run archived
+    # (rows can arrive late, e.g. from the write-behind spool). Files are durable before the rows are deleted;
+    # a crash in between only means the next run rewrites the same rows.
+    start, end = month_bounds(month)
+    hot = (await db.scalars(select(models.EventLog).where(models.EventLog.timestamp >= start, models.EventLog.timestamp < end)
+                            .order_by(models.EventLog.id))).all()
+    if not hot:
+        return {"month": month, "archived": 0}
+    by_student: Dict[str, List[dict]] = {}
+    previous = load_index(month)
+    if previous:
+        for row in await asyncio.to_thread(lambda: list(iter_month(month))):
+            by_student.setdefault(row["student_id"], []).append(row)
+    seen = {r["id"] for rows in by_student.values() for r in rows}
+    for ev in hot:
+        if ev.id not in seen:
+            by_student.setdefault(ev.student_id, []).append(_row(ev))
+    index = await asyncio.to_thread(_write_month, month, by_student, previous)
+    # rows inserted after the select above have larger ids and stay hot until the next run
+    await db.execute(delete(models.EventLog).where(models.EventLog.timestamp >= start, models.EventLog.timestamp < end,
+                                                   models.EventLog.id <= hot[-1].id))
+    await db.commit()
+    return {"month": month, "archived": len(hot), "rows": index["rows"], "students": len(index["students"])}
+
+async def archive_closed_months(now: Optional[datetime] = None) -> dict:
+    started = clock.perf_counter()
+    now = now or datetime.now(KST)
+    cutoff, _ = month_bounds(shift_month(month_of(now), -(EVENTLOG_HOT_MONTHS - 1)))
+    async with AsyncSessionLocal() as db:
+        oldest = await db.scalar(select(func.min(models.EventLog.timestamp)).where(models.EventLog.timestamp < cutoff))
+        months = []
+        if oldest is not None:
+            month = month_of(oldest)
+            while month_bounds(month)[0] < cutoff:
+                months.append(await archive_month(db, month))
+                month = shift_month(month, 1)
+    stats = {"months": [m for m in months if m["archived"]], "elapsed_ms": round((clock.perf_counter() - started) * 1000, 2)}
+    logger.info("event log archival %s", stats)
+    return stats
+
+async def read_events(db: AsyncSession, student_id: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                      types: Optional[List[str]] = None) -> List[dict]:
+    # one student's events across archived months and the hot table, oldest first
+    since, until = to_db_time(since), to_db_time(until)
+    rows = []
+    for month in archived_months():
+        start, end = month_bounds(month)
+        if (since and end <= since) or (until and start >= until):
+            continue
+        rows.extend(await asyncio.to_thread(read_student_month, month, student_id))
+    stmt = select(models.EventLog).where(models.EventLog.student_id == student_id)
+    if since:
+        stmt = stmt.where(models.EventLog.timestamp >= since)
+    if until:
+        stmt = stmt.where(models.EventLog.timestamp < until)
+    if types:
+        stmt = stmt.where(models.EventLog.type.in_(types))
+    archived_ids = {r["id"] for r in rows}
+    rows.extend(_row(ev) for ev in await db.scalars(stmt) if ev.id not in archived_ids)
+    rows = [r for r in rows if (not since or r["timestamp"] >= since) and (not until or r["timestamp"] < until)
+            and (not types or r["type"] in types)]
+    rows.sort(key=lambda r: (r["timestamp"], r["id"]))
+    return rows
+
+if __name__ == "__main__":
+    # python -m app.archive [run|list|read <student_id>]
+    logging.basicConfig(level=logging.INFO)
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "run"
+    async def _main():
+        try:
+            if cmd == "read":
+                async with AsyncSessionLocal() as db:
+                    for row in await read_events(db, sys.argv[2]):
+                        print(json.dumps({**row, "timestamp": row["timestamp"].isoformat()}, ensure_ascii=False))
+            else:
+                print(await archive_closed_months())
+        finally:
+            await async_engine.dispose()
+    if cmd == "list":
+        for month in archived_months():
+            index = load_index(month)
+            print(f"{month}: {index['rows']} rows, {len(index['students'])} students, {os.path.getsize(_data_path(index))} bytes")
+    else:
+        asyncio.run(_main())
@@ -0,0 +1,244 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Callable, Dict, List, Optional, Set
+from urllib.parse import urlparse
+
+logger = logging.getLogger("studyflow.broker")
+
+# empty = single process; redis://host:port or unix:///path/to/broker.sock to fan out across workers
+BROKER_URL = os.environ.get("STUDYFLOW_BROKER_URL", "")
+BROKER_CHANNEL = os.environ.get("STUDYFLOW_BROKER_CHANNEL", "studyflow:ws")
+RECONNECT_MAX_SECONDS = 5
+
+Deliver = Callable[[dict], None]
+
+# A broker carries WebSocket envelopes between workers. Each worker delivers an envelope to its own sockets
+# right away and publishes it; every other worker receives it from the broker and delivers it to its sockets.
+# Envelopes carry the publishing worker's id so a worker never delivers its own envelope twice.
+class Broker:
+    shared = False  # True when other workers are listening, i.e. state worth sending them
+
+    async def start(self, deliver: Deliver):
+        pass
+
+    async def publish(self, envelope: dict):
+        pass
+
+    async def stop(self):
+        pass
+
+# one process: local delivery already reached every socket there is
+class LocalBroker(Broker):
+    pass
+
+# Redis pub/sub over RESP. Works against Redis/Valkey or the stand-in from `python -m app.broker serve`,
+# which speaks just enough of the protocol (SUBSCRIBE, PUBLISH, PING) for this.
+class RedisBroker(Broker):
+    shared = True
+
+    def __init__(self, url: str, channel: str = BROKER_CHANNEL):
+        self.url = url
+        self.channel = channel
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._deliver: Optional[Deliver] = None
+        self._subscriber: Optional[asyncio.Task] = None
+        self._publisher: Optional[tuple] = None  # (reader, writer)
+        self._lock = asyncio.Lock()
+        self.stats = {"published": 0, "received": 0, "publish_failures": 0, "reconnects": 0}
+
+    async def _connect(self):
+        url = urlparse(self.url)
+        if url.scheme == "unix":
+            return await asyncio.open_unix_connection(url.path)
+        return await asyncio.open_connection(url.hostname or "127.0.0.1", url.port or 6379)
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+        if self._subscriber is None:
+            self._subscriber = asyncio.get_running_loop().create_task(self._subscribe())
+
+    async def stop(self):
+        if self._subscriber is not None:
+            self._subscriber.cancel()
+            try:
+                await self._subscriber
+            except asyncio.CancelledError:
+                pass
+            self._subscriber = None
+        self._close_publisher()
+
+    def _close_publisher(self):
+        if self._publisher is not None:
+            self._publisher[1].close()
+            self._publisher = None
+
+    async def publish(self, envelope: dict):
+        payload = json.dumps({**envelope, "origin": self.worker_id}, ensure_ascii=False, separators=(",", ":"))
+        async with self._lock:
+            try:
+                if self._publisher is None:
+                    self._publisher = await self._connect()
+                reader, writer = self._publisher
+                writer.write(encode_command("PUBLISH", self.channel, payload))
+                await writer.drain()
+                reply = await read_reply(reader)
+                if isinstance(reply, RespError):
+                    raise reply
+                self.stats["published"] += 1
+            except Exception:
+                # other workers miss this envelope; this worker's sockets already have it
+                self.stats["publish_failures"] += 1
+                self._close_publisher()
+                logger.exception("broker publish to %s failed", self.url)
+
+    async def _subscribe(self):
+        delay, lost = 0.1, False
+        while True:
+            try:
+                reader, writer = await self._connect()
+                try:
+                    writer.write(encode_command("SUBSCRIBE", self.channel))
+                    await writer.drain()
+                    delay = 0.1
+                    if lost:
+                        # whatever the other workers published meanwhile never arrived here
+                        lost = False
+                        self._deliver_local({"op": "resync"})
+                    while True:
+                        reply = await read_reply(reader)
+                        if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                            self._on_message(reply[2])
+                finally:
+                    writer.close()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                lost = True
+                self.stats["reconnects"] += 1
+                logger.warning("broker subscription to %s lost (%s); retrying in %.1fs", self.url, e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+
+    def _on_message(self, payload: bytes):
+        try:
+            envelope = json.loads(payload)
+        except ValueError:
+            logger.warning("dropping undecodable broker message")
+            return
+        if envelope.pop("origin", None) == self.worker_id:
+            return
+        self.stats["received"] += 1
+        self._deliver_local(envelope)
+
+    def _deliver_local(self, envelope: dict):
+        try:
+            self._deliver(envelope)
+        except Exception:
+            logger.exception("delivering broker envelope %s failed", envelope.get("op"))
+
+def make_broker(url: str = BROKER_URL) -> Broker:
+    if not url:
+        return LocalBroker()
+    if urlparse(url).scheme not in ("redis", "unix"):
+        raise ValueError(f"unsupported STUDYFLOW_BROKER_URL {url!r}; use redis://host:port or unix:///path")
+    return RedisBroker(url)
+
+# --- RESP (REdis Serialization Protocol), the subset pub/sub needs ---
+
+class RespError(Exception):
+    pass
+
+def encode_command(*args: str) -> bytes:
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        data = arg.encode() if isinstance(arg, str) else arg
+        out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(out)
+
+async def read_reply(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("broker connection closed")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest
+    if kind == b"-":
+        return RespError(rest.decode(errors="replace"))
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        size = int(rest)
+        if size < 0:
+            return None
+        data = await reader.readexactly(size + 2)
+        return data[:-2]
+    if kind == b"*":
+        size = int(rest)
+        return None if size < 0 else [await read_reply(reader) for _ in range(size)]
+    raise ConnectionError(f"unexpected RESP reply {line[:20]!r}")
+
+# --- local stand-in server ---
+
+class _StandIn:
+    def __init__(self):
+        self.channels: Dict[bytes, Set[asyncio.StreamWriter]] = {}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        subscribed: List[bytes] = []
+        try:
+            while True:
+                command = await read_reply(reader)
+                if not isinstance(command, list) or not command:
+                    writer.write(b"-ERR expected a command array\r\n")
+                    continue
+                name = command[0].upper()
+                if name == b"SUBSCRIBE":
+                    for channel in command[1:]:
+                        self.channels.setdefault(channel, set()).add(writer)
+                        subscribed.append(channel)
+                        writer.write(b"*3\r\n$9\r\nsubscribe\r\n$%d\r\n%s\r\n:%d\r\n" % (len(channel), channel, len(subscribed)))
+                elif name == b"PUBLISH" and len(command) == 3:
+                    channel, payload = command[1], command[2]
+                    message = b"*3\r\n$7\r\nmessage\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n" % (len(channel), channel, len(payload), payload)
+                    subscribers = self.channels.get(channel, ())
+                    for subscriber in subscribers:
+                        subscriber.write(message)
+                    writer.write(b":%d\r\n" % len(subscribers))
+                elif name == b"PING":
+                    writer.write(b"+PONG\r\n")
+                else:
+                    writer.write(b"-ERR unsupported command\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in subscribed:
+                self.channels.get(channel, set()).discard(writer)
+            writer.close()
+
+async def serve(unix_path: Optional[str] = None, host: str = "127.0.0.1", port: int = 6379):
+    stand_in = _StandIn()
+    if unix_path:
+        if os.path.exists(unix_path):
+            os.remove(unix_path)  # stale socket from a previous run
+        server = await asyncio.start_unix_server(stand_in.handle, unix_path)
+    else:
+        server = await asyncio.start_server(stand_in.handle, host, port)
+    logger.info("broker stand-in listening on %s", unix_path or f"{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    # python -m app.broker serve [--unix /tmp/studyflow-broker.sock | --host 127.0.0.1 --port 6379]
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(prog="python -m app.broker")
+    parser.add_argument("command", choices=["serve"])
+    parser.add_argument("--unix")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    asyncio.run(serve(args.unix, args.host, args.port))
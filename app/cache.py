@@ -0,0 +1,78 @@
+from datetime import datetime, time
+from typing import Dict, Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models
+from .timeutil import KST, today_kst_str, parse_time_str, combine_today_time
+
+# Read-only snapshot of a Student row with its expected times parsed once and today's
+# deadlines resolved to absolute KST instants. The instants are recomputed (no re-parsing)
+# the first time they are asked for on a new KST date.
+class CachedStudent:
+    __slots__ = ("id", "name", "grade", "classroom", "expected_check_in", "expected_check_out", "ended",
+                 "check_in_time", "check_out_time", "date", "_check_in_deadline", "_check_out_deadline")
+
+    def __init__(self, s: models.Student, now: Optional[datetime] = None):
+        self.id = s.id
+        self.name = s.name
+        self.grade = s.grade
+        self.classroom = s.classroom
+        self.expected_check_in = s.expected_check_in
+        self.expected_check_out = s.expected_check_out
+        self.ended = bool(s.ended)
+        self.check_in_time: time = parse_time_str(s.expected_check_in)
+        self.check_out_time: time = parse_time_str(s.expected_check_out)
+        self.roll_over(now)
+
+    def roll_over(self, now: Optional[datetime] = None):
+        now = now or datetime.now(KST)
+        self.date = today_kst_str(now)
+        self._check_in_deadline = combine_today_time(self.check_in_time, now)
+        self._check_out_deadline = combine_today_time(self.check_out_time, now)
+
+    def check_in_deadline(self, now: Optional[datetime] = None) -> datetime:
+        now = now or datetime.now(KST)
+        if today_kst_str(now) != self.date:
+            return combine_today_time(self.check_in_time, now)
+        return self._check_in_deadline
+
+    def check_out_deadline(self, now: Optional[datetime] = None) -> datetime:
+        now = now or datetime.now(KST)
+        if today_kst_str(now) != self.date:
+            return combine_today_time(self.check_out_time, now)
+        return self._check_out_deadline
+
+class StudentCache:
+    def __init__(self):
+        self._students: Dict[str, CachedStudent] = {}
+
+    def __len__(self):
+        return len(self._students)
+
+    async def get(self, db: AsyncSession, student_id: str) -> Optional[CachedStudent]:
+        cached = self._students.get(student_id)
+        if cached is not None:
+            return cached
+        s = await db.scalar(select(models.Student).where(models.Student.id == student_id,
+            models.Student.ended == False
+        ))
+        if not s:
+            return None  # unknown ids are not cached; a later upsert must be visible immediately
+        cached = self._students[student_id] = CachedStudent(s)
+        return cached
+
+    def peek(self, student_id: str) -> Optional[CachedStudent]:
+        return self._students.get(student_id)
+
+    def invalidate(self, student_id: str):
+        self._students.pop(student_id, None)
+
+    def clear(self):
+        self._students.clear()
+
+    # called at KST midnight so the first lookups of the day don't pay for the recompute
+    def roll_over(self, now: Optional[datetime] = None):
+        for cached in list(self._students.values()):
+            cached.roll_over(now)
+
+student_cache = StudentCache()
@@ -1,52 +1,109 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects import postgresql, sqlite
 from . import models, schemas
+from .cache import student_cache, CachedStudent
+from .eventlog import event_log
+from .uow import after_commit, bump_versions
+from .timeutil import to_db_time
+from .versions import STUDENT
 from datetime import datetime
 from zoneinfo import ZoneInfo
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
 KST = ZoneInfo("Asia/Seoul")
 
-def upsert_student(db: Session, data: schemas.StudentCreate) -> models.Student:
-    student = db.query(models.Student).filter(models.Student.id == data.id).first()
-    if student:
-        student.name = data.name
-        student.grade = data.grade
-        student.classroom = data.classroom
-        student.expected_check_in = data.expected_check_in or student.expected_check_in
-        student.expected_check_out = data.expected_check_out or student.expected_check_out
-        student.updated_at = datetime.now(tz=KST).astimezone(None)
-    else:
-        student = models.Student(
-            id=data.id, name=data.name, grade=data.grade, classroom=data.classroom,
-            expected_check_in=data.expected_check_in or "09:00:00",
-            expected_check_out=data.expected_check_out or "18:00:00"
-        )
-        db.add(student)
-    db.commit()
-    db.refresh(student)
+async def upsert_student(db: AsyncSession, data: schemas.StudentCreate) -> models.Student:
+    # one INSERT .. ON CONFLICT DO UPDATE .. RETURNING; omitted expected times keep their stored value
+    stmt = dialect_insert(db, models.Student).values(
+        id=data.id, name=data.name, grade=data.grade, classroom=data.classroom,
+        expected_check_in=data.expected_check_in or "09:00:00",
+        expected_check_out=data.expected_check_out or "18:00:00"
+    )
+    stmt = stmt.on_conflict_do_update(index_elements=["id"], set_={
+        "name": stmt.excluded.name, "grade": stmt.excluded.grade, "classroom": stmt.excluded.classroom,
+        "expected_check_in": data.expected_check_in or models.Student.expected_check_in,
+        "expected_check_out": data.expected_check_out or models.Student.expected_check_out,
+        "updated_at": to_db_time(datetime.now(KST)),
+    })
+    student = await db.scalar(stmt.returning(models.Student).execution_options(populate_existing=True))
+    after_commit(db, lambda: student_cache.invalidate(student.id))
+    bump_versions(db, STUDENT, [student.id])
     return student
 
-def record_event(db: Session, student_id: str, type: str, timestamp: Optional[datetime] = None, payload: Optional[dict] = None) -> models.EventLog:
+def record_event(db: AsyncSession, student_id: str, type: str, timestamp: Optional[datetime] = None, payload: Optional[dict] = None):
+    # handed to the write-behind event_log once the request commits; never on the request's latency path
     ts = timestamp or datetime.now(tz=KST)
-    ev = models.EventLog(student_id=student_id, type=type, timestamp=ts.astimezone(None), payload=payload or {})
-    db.add(ev)
-    db.commit()
-    db.refresh(ev)
-    return ev
-
-def get_student(db: Session, student_id: str) -> Optional[models.Student]:
-    return db.query(models.Student).filter(models.Student.id == student_id,
-        models.Student.ended == False  # ← 이 줄 추가
-    ).first()
-
-def get_today_attendance(db: Session, student_id: str, date_str: str) -> Optional[models.AttendanceRecord]:
-    return db.query(models.AttendanceRecord).filter(
+    after_commit(db, lambda: event_log.record(student_id, type, to_db_time(ts), payload))
+
+async def get_student(db: AsyncSession, student_id: str) -> Optional[CachedStudent]:
+    # served from student_cache; ended students are never returned
+    return await student_cache.get(db, student_id)
+
+async def get_today_attendance(db: AsyncSession, student_id: str, date_str: str) -> Optional[models.AttendanceRecord]:
+    return await db.scalar(select(models.AttendanceRecord).where(
         models.AttendanceRecord.student_id == student_id,
         models.AttendanceRecord.date == date_str
-    ).first()
+    ))
+
+# today's attendance row upserted in one statement; the first check-in of the day wins, the last check-out wins
+async def check_in(db: AsyncSession, student_id: str, date_str: str, at: datetime) -> models.AttendanceRecord:
+    stmt = dialect_insert(db, models.AttendanceRecord).values(student_id=student_id, date=date_str, status="present", check_in_time=at)
+    stmt = stmt.on_conflict_do_update(index_elements=["student_id", "date"], set_={
+        "check_in_time": func.coalesce(models.AttendanceRecord.check_in_time, stmt.excluded.check_in_time)})
+    return await db.scalar(stmt.returning(models.AttendanceRecord).execution_options(populate_existing=True))
+
+async def check_out(db: AsyncSession, student_id: str, date_str: str, at: datetime) -> models.AttendanceRecord:
+    stmt = dialect_insert(db, models.AttendanceRecord).values(student_id=student_id, date=date_str, status="present", check_out_time=at)
+    stmt = stmt.on_conflict_do_update(index_elements=["student_id", "date"], set_={"check_out_time": stmt.excluded.check_out_time})
+    return await db.scalar(stmt.returning(models.AttendanceRecord).execution_options(populate_existing=True))
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Keyset pagination on id, newest first: pass the last id of a page as `before` to get the next one.
+# Returns (items, next_cursor); next_cursor is None on the last page.
+async def _page(db: AsyncSession, stmt, model, before: Optional[int], limit: int) -> Tuple[list, Optional[int]]:
+    if before is not None:
+        stmt = stmt.where(model.id < before)
+    items = (await db.scalars(stmt.order_by(model.id.desc()).limit(limit + 1))).all()
+    if len(items) > limit:
+        return items[:limit], items[limit - 1].id
+    return items, None
+
+async def list_notices(db: AsyncSession, student_id: Optional[str] = None, before: Optional[int] = None, limit: int = PAGE_SIZE,
+                       since: Optional[datetime] = None, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                       severity: Optional[int] = None) -> Tuple[List[models.Notice], Optional[int]]:
+    # student_id=None lists every student's notices (admin)
+    stmt = select(models.Notice)
+    if student_id is not None:
+        stmt = stmt.where(models.Notice.student_id == student_id)
+    if since is not None:
+        stmt = stmt.where(models.Notice.created_at >= since)
+    if date_from:
+        stmt = stmt.where(models.Notice.date >= date_from)
+    if date_to:
+        stmt = stmt.where(models.Notice.date <= date_to)
+    if severity is not None:
+        stmt = stmt.where(models.Notice.severity == severity)
+    return await _page(db, stmt, models.Notice, before, limit)
+
+async def list_notifications(db: AsyncSession, student_id: str, before: Optional[int] = None, limit: int = PAGE_SIZE,
+                             since: Optional[datetime] = None, category: Optional[str] = None,
+                             acknowledged: Optional[bool] = None) -> Tuple[List[models.Notification], Optional[int]]:
+    stmt = select(models.Notification).where(models.Notification.student_id == student_id)
+    if since is not None:
+        stmt = stmt.where(models.Notification.created_at >= since)
+    if category:
+        stmt = stmt.where(models.Notification.category == category)
+    if acknowledged is not None:
+        stmt = stmt.where(models.Notification.acknowledged == acknowledged)
+    return await _page(db, stmt, models.Notification, before, limit)
 
-def list_notices(db: Session, student_id: str):
-    return db.query(models.Notice).filter(models.Notice.student_id == student_id).order_by(models.Notice.id.desc()).all()
+# dialect-specific INSERT so callers can use ON CONFLICT; the caller adds .values()/.returning()
+def dialect_insert(db: AsyncSession, model):
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(model)
 
-def list_notifications(db: Session, student_id: str):
-    return db.query(models.Notification).filter(models.Notification.student_id == student_id).order_by(models.Notification.id.desc()).all()
+def insert_ignore(db: AsyncSession, model):
+    return dialect_insert(db, model).on_conflict_do_nothing()
@@ -1,11 +1,80 @@
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./studyflow.db"
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+SQLALCHEMY_DATABASE_URL = os.environ.get("STUDYFLOW_DATABASE_URL", "sqlite:///./studyflow.db")
+
+# connection pool (server databases, and the per-thread connections of file-backed SQLite)
+DB_POOL_SIZE = _env_int("STUDYFLOW_DB_POOL_SIZE", 10)
+DB_MAX_OVERFLOW = _env_int("STUDYFLOW_DB_MAX_OVERFLOW", 20)
+DB_POOL_RECYCLE = _env_int("STUDYFLOW_DB_POOL_RECYCLE", 1800)  # seconds, -1 disables
+DB_POOL_TIMEOUT = _env_int("STUDYFLOW_DB_POOL_TIMEOUT", 30)
+
+# SQLite tuning, applied to every new connection
+SQLITE_WAL = os.environ.get("STUDYFLOW_SQLITE_WAL", "1") != "0"
+SQLITE_BUSY_TIMEOUT_MS = _env_int("STUDYFLOW_SQLITE_BUSY_TIMEOUT_MS", 5000)
+SQLITE_MMAP_SIZE = _env_int("STUDYFLOW_SQLITE_MMAP_SIZE", 256 * 1024 * 1024)
+SQLITE_CACHE_SIZE_KB = _env_int("STUDYFLOW_SQLITE_CACHE_SIZE_KB", 64 * 1024)
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    if SQLITE_WAL:
+        # WAL lets readers run alongside the single writer; NORMAL only fsyncs at checkpoints, which is durable in WAL mode
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")  # negative = KiB
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+def _engine_kwargs(url: str) -> dict:
+    if url.startswith("sqlite"):
+        kwargs = {"connect_args": {"check_same_thread": False}}
+        if ":memory:" not in url and make_url(url).database:
+            kwargs.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+        return kwargs
+    return dict(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT,
+                pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=True)
+
+def make_engine(url: str = SQLALCHEMY_DATABASE_URL, sqlite_tuning: bool = True) -> Engine:
+    eng = create_engine(url, **_engine_kwargs(url))
+    if url.startswith("sqlite") and sqlite_tuning:
+        event.listen(eng, "connect", _apply_sqlite_pragmas)
+    return eng
+
+# the sync engine keeps the URL's default driver (psycopg2 for postgresql://); both need installing
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+# same database as the sync URL, reached through the asyncio driver for its backend
+def async_database_url(url: str) -> str:
+    u = make_url(url)
+    driver = ASYNC_DRIVERS.get(u.get_backend_name())
+    if driver:
+        u = u.set(drivername=driver)
+    return u.render_as_string(hide_password=False)
+
+def make_async_engine(url: str = SQLALCHEMY_DATABASE_URL, sqlite_tuning: bool = True) -> AsyncEngine:
+    kwargs = _engine_kwargs(url)
+    if "pool_size" in kwargs:
+        kwargs["poolclass"] = AsyncAdaptedQueuePool
+    eng = create_async_engine(async_database_url(url), **kwargs)
+    if url.startswith("sqlite") and sqlite_tuning:
+        event.listen(eng.sync_engine, "connect", _apply_sqlite_pragmas)
+    return eng
+
+# sync engine: schema creation, maintenance scripts and benchmarks
+engine = make_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# async engine: everything on the request path and the background tasks
+async_engine = make_async_engine()
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
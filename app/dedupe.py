@@ -0,0 +1,55 @@
+from collections import OrderedDict
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from typing import Hashable, Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models
+from .timeutil import to_db_time
+
+KST = ZoneInfo("Asia/Seoul")
+DEDUPE_INDEX_SIZE = 100_000
+
+# Bounded LRU set of keys that are known to exist in the DB. A hit means "already sent" and skips the
+# lookup query; a miss says nothing, so callers fall back to the DB (insert-or-ignore / lookup).
+class DedupeIndex:
+    def __init__(self, maxsize: int = DEDUPE_INDEX_SIZE):
+        self.maxsize = maxsize
+        self._keys: "OrderedDict[Hashable, None]" = OrderedDict()
+
+    def __contains__(self, key: Hashable) -> bool:
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return True
+        return False
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key: Hashable):
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        while len(self._keys) > self.maxsize:
+            self._keys.popitem(last=False)
+
+    def clear(self):
+        self._keys.clear()
+
+def notice_key(student_id: str, date_str: str, reason: str, severity: int) -> tuple:
+    return (student_id, date_str, reason, severity)
+
+notification_index = DedupeIndex()
+notice_index = DedupeIndex()
+
+async def warm(db: AsyncSession, now: Optional[datetime] = None):
+    now = now or datetime.now(KST)
+    date_str = now.date().isoformat()
+    midnight = to_db_time(datetime(now.year, now.month, now.day, tzinfo=KST))
+    for key in await db.scalars(select(models.Notification.dedupe_key).where(
+        models.Notification.created_at >= midnight, models.Notification.dedupe_key != None
+    ).order_by(models.Notification.id.asc())):
+        notification_index.add(key)
+    for student_id, reason, severity in await db.execute(select(models.Notice.student_id, models.Notice.reason, models.Notice.severity).where(
+        models.Notice.date == date_str
+    ).order_by(models.Notice.id.asc())):
+        notice_index.add(notice_key(student_id, date_str, reason, severity))
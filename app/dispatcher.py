@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+logger = logging.getLogger("studyflow.dispatcher")
+
+BROADCAST_WORKERS = int(os.environ.get("STUDYFLOW_BROADCAST_WORKERS", 4))
+BROADCAST_MAX_QUEUED = int(os.environ.get("STUDYFLOW_BROADCAST_MAX_QUEUED", 10_000))
+BROADCAST_OVERFLOW = os.environ.get("STUDYFLOW_BROADCAST_OVERFLOW", "drop_oldest")  # drop_oldest | drop_new
+BROADCAST_DRAIN_SECONDS = float(os.environ.get("STUDYFLOW_BROADCAST_DRAIN_SECONDS", 5))
+
+Job = Callable[[], Awaitable[None]]
+
+# Runs WebSocket broadcasts after commit on a fixed set of worker coroutines instead of one untracked task per
+# broadcast. Jobs are zero-argument callables (the coroutine is only created when a worker runs it, so a dropped
+# job leaves no un-awaited coroutine behind) taken in submission order; since ws_manager delivers to local
+# sockets before its first await, broadcasts reach sockets in the order they were submitted.
+#
+# The queue is bounded. When it is full, drop_oldest discards the oldest waiting broadcast to make room and
+# drop_new discards the incoming one. A dropped broadcast never gets a sequence number, so clients could not see
+# the gap: after one or more drops the next worker first runs the on_overflow job given to start() (for the
+# WebSocket manager, a resync_required to every stream). stop() waits up to drain_seconds for queued broadcasts.
+class BroadcastDispatcher:
+    def __init__(self, workers: int = BROADCAST_WORKERS, max_queued: int = BROADCAST_MAX_QUEUED,
+                 overflow: str = BROADCAST_OVERFLOW, drain_seconds: float = BROADCAST_DRAIN_SECONDS):
+        if overflow not in ("drop_oldest", "drop_new"):
+            raise ValueError(f"unknown broadcast overflow policy {overflow!r}")
+        self.workers = workers
+        self.max_queued = max_queued
+        self.overflow = overflow
+        self.drain_seconds = drain_seconds
+        self._jobs: "asyncio.Queue[Tuple[float, Job]]" = asyncio.Queue(max_queued)
+        self._tasks: List[asyncio.Task] = []
+        self._running = 0
+        self._on_overflow: Optional[Job] = None
+        self._overflowed = False
+        self.stats = {"queued": 0, "sent": 0, "dropped": 0, "failed": 0, "overflows": 0, "latency_ms_total": 0.0, "latency_ms_max": 0.0}
+
+    def __len__(self):
+        return self._jobs.qsize()
+
+    def submit(self, job: Job) -> bool:
+        # returns False when the job was dropped
+        if self._jobs.full():
+            self._drop()
+            if self.overflow == "drop_new":
+                return False
+            self._jobs.get_nowait()
+            self._jobs.task_done()
+        self._jobs.put_nowait((time.perf_counter(), job))
+        self.stats["queued"] += 1
+        return True
+
+    def _drop(self):
+        self.stats["dropped"] += 1
+        self._overflowed = True
+        if self.stats["dropped"] % 1000 == 1:
+            logger.warning("broadcast queue full (%d jobs, %s), %d broadcasts dropped",
+                           self._jobs.qsize(), self.overflow, self.stats["dropped"])
+
+    async def start(self, on_overflow: Optional[Job] = None):
+        self._on_overflow = on_overflow
+        if not self._tasks:
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+
+    async def _work(self):
+        while True:
+            queued_at, job = await self._jobs.get()
+            self._running += 1
+            try:
+                if self._overflowed:
+                    await self._overflow()
+                await job()
+                self.stats["sent"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.stats["failed"] += 1
+                logger.exception("broadcast failed")
+            finally:
+                self._running -= 1
+                self._jobs.task_done()
+                latency = (time.perf_counter() - queued_at) * 1000
+                self.stats["latency_ms_total"] += latency
+                self.stats["latency_ms_max"] = max(self.stats["latency_ms_max"], latency)
+
+    async def _overflow(self):
+        # drops since the last run collapse into one call
+        self._overflowed = False
+        self.stats["overflows"] += 1
+        if self._on_overflow is not None:
+            try:
+                await self._on_overflow()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("broadcast overflow handler failed")
+
+    def snapshot(self) -> dict:
+        done = self.stats["sent"] + self.stats["failed"]
+        return {**self.stats, "pending": self._jobs.qsize(), "running": self._running, "overflow": self.overflow,
+                "latency_ms_avg": round(self.stats["latency_ms_total"] / done, 3) if done else None}
+
+    async def stop(self):
+        if self._tasks:
+            try:
+                await asyncio.wait_for(self._jobs.join(), self.drain_seconds)
+            except asyncio.TimeoutError:
+                pass
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        if self._jobs.qsize():
+            logger.error("%d broadcasts not sent at shutdown", self._jobs.qsize())
+            while not self._jobs.empty():
+                self._jobs.get_nowait()
+                self._jobs.task_done()
+                self.stats["dropped"] += 1
+
+dispatcher = BroadcastDispatcher()
@@ -0,0 +1,207 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+from datetime import datetime
+from typing import IO, List, Optional, Tuple
+from sqlalchemy import insert
+from . import models
+from .database import AsyncSessionLocal
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, so no spool (start() refuses one); the buffer works without it
+    fcntl = None
+
+logger = logging.getLogger("studyflow.eventlog")
+
+EVENTLOG_BATCH_SIZE = int(os.environ.get("STUDYFLOW_EVENTLOG_BATCH_SIZE", 500))  # rows per executemany
+EVENTLOG_FLUSH_MS = int(os.environ.get("STUDYFLOW_EVENTLOG_FLUSH_MS", 1000))     # max age of a buffered row
+EVENTLOG_MAX_QUEUED = int(os.environ.get("STUDYFLOW_EVENTLOG_MAX_QUEUED", 50_000))
+EVENTLOG_SPOOL = os.environ.get("STUDYFLOW_EVENTLOG_SPOOL", "")  # e.g. ./eventlog.spool.jsonl, empty = no spool
+
+# Write-behind writer for the append-only event_logs table. Requests only append a row to an in-memory buffer;
+# a background task writes the buffer with executemany once it holds batch_size rows or every flush_ms.
+#
+# With a spool path every row is also appended to a local JSONL file before it is buffered. Each flush rotates
+# the active file to a numbered segment and deletes the segments once the rows are committed, so after a crash
+# the remaining spool files hold exactly the rows that never reached the database; start() replays them.
+#
+# Workers share the spool path, so each process spools to its own files (<path>.<pid>, segments <path>.<pid>.<n>)
+# and holds an flock on every one of them until it deletes it. start() only replays files it can lock, i.e. the
+# leftovers of processes that are gone, never the files another worker is still writing.
+class EventLogWriter:
+    def __init__(self, batch_size: int = EVENTLOG_BATCH_SIZE, flush_ms: int = EVENTLOG_FLUSH_MS,
+                 max_queued: int = EVENTLOG_MAX_QUEUED, spool_path: str = EVENTLOG_SPOOL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.max_queued = max_queued
+        self.spool_path = spool_path
+        self._rows: List[dict] = []
+        self._segments: List[Tuple[str, IO]] = []  # rotated spool files whose rows are not committed yet, still locked
+        self._active = f"{spool_path}.{os.getpid()}"
+        self._spool = None
+        self._seq = 0
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"written": 0, "dropped": 0, "flushes": 0, "failures": 0, "replayed": 0}
+
+    def __len__(self):
+        return len(self._rows)
+
+    def record(self, student_id: str, type: str, timestamp: datetime, payload: Optional[dict] = None):
+        if len(self._rows) >= self.max_queued:
+            # the database is not keeping up; shed the newest rows rather than grow without bound
+            self.stats["dropped"] += 1
+            if self.stats["dropped"] % 1000 == 1:
+                logger.warning("event log buffer full (%d rows), %d events dropped", len(self._rows), self.stats["dropped"])
+            return
+        row = dict(student_id=student_id, type=type, timestamp=timestamp, payload=payload or {})
+        if self._spool:
+            self._spool.write(json.dumps({**row, "timestamp": timestamp.isoformat()}, ensure_ascii=False) + "\n")
+            self._spool.flush()
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self._wakeup.set()
+
+    def _open_spool(self) -> IO:
+        # a replayer in another worker may lock and delete the new file before we lock it; then start over
+        while True:
+            f = open(self._active, "a", encoding="utf-8")
+            fcntl.flock(f, fcntl.LOCK_EX)
+            if _same_file(f, self._active):
+                return f
+            f.close()
+
+    def _rotate_spool(self):
+        # the renamed file keeps its descriptor, and with it the lock, until flush() deletes it
+        self._spool.flush()
+        self._seq += 1
+        segment = f"{self._active}.{self._seq}"
+        os.replace(self._active, segment)
+        self._segments.append((segment, self._spool))
+        self._spool = self._open_spool()
+
+    def _drop_segments(self):
+        for path, f in self._segments:
+            os.remove(path)
+            f.close()
+        self._segments.clear()
+
+    async def _write(self, rows: List[dict]):
+        async with AsyncSessionLocal() as db:
+            for i in range(0, len(rows), self.batch_size):
+                await db.execute(insert(models.EventLog), rows[i:i + self.batch_size])
+            await db.commit()
+
+    async def flush(self) -> int:
+        async with self._lock:
+            if not self._rows:
+                return 0
+            rows, self._rows = self._rows, []
+            if self._spool:
+                self._rotate_spool()
+            try:
+                await self._write(rows)
+            except Exception:
+                # keep the rows (and their spool segments) for the next attempt, ahead of anything newer
+                self.stats["failures"] += 1
+                self._rows[:0] = rows
+                logger.exception("event log flush of %d rows failed", len(rows))
+                return 0
+            self._drop_segments()
+            self.stats["written"] += len(rows)
+            self.stats["flushes"] += 1
+            return len(rows)
+
+    async def _replay_spool(self):
+        # files of this spool path that no live process holds (the bare path is the pre-per-process name)
+        rows = []
+        try:
+            for path in sorted({self.spool_path, *glob.glob(glob.escape(self.spool_path) + ".*")}):
+                f = _lock_leftover(path)
+                if f is None:
+                    continue
+                self._segments.append((path, f))
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line from a crash mid-write
+                    row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+                    rows.append(row)
+            if rows:
+                await self._write(rows)
+                self.stats["replayed"] += len(rows)
+                logger.info("replayed %d spooled event log rows", len(rows))
+            self._drop_segments()
+        finally:
+            # not written: unlock and leave the files for the next start
+            for _, f in self._segments:
+                f.close()
+            self._segments.clear()
+
+    async def start(self):
+        if self.spool_path:
+            if fcntl is None:
+                raise RuntimeError("STUDYFLOW_EVENTLOG_SPOOL needs fcntl file locks, which this platform does not have")
+            await self._replay_spool()
+            self._spool = self._open_spool()
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._rows:
+            logger.error("%d event log rows not written at shutdown%s", len(self._rows),
+                         " (kept in spool)" if self._spool else "")
+        if self._spool:
+            if not self._rows:
+                os.remove(self._active)
+            self._spool.close()
+            for _, f in self._segments:  # rows not written: leave the files, unlocked, for the next start
+                f.close()
+            self._segments.clear()
+            self._spool = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+def _same_file(f: IO, path: str) -> bool:
+    try:
+        return os.fstat(f.fileno()).st_ino == os.stat(path).st_ino
+    except FileNotFoundError:
+        return False
+
+def _lock_leftover(path: str) -> Optional[IO]:
+    # the file locked for replay, or None when a live worker holds it (or it is already gone)
+    try:
+        f = open(path, encoding="utf-8")
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    if not _same_file(f, path):  # replayed and deleted by another worker meanwhile
+        f.close()
+        return None
+    return f
+
+event_log = EventLogWriter()
@@ -0,0 +1,290 @@
+import json
+import logging
+from datetime import datetime
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, schemas, crud, summary
+from .livestate import live_state
+from .logic import KST, today_kst_str, tardiness_category, seconds_late, issue_notice, notify
+from .scheduler import scheduler
+from .timeutil import ensure_kst, from_db_time, to_db_time
+from .uow import after_commit, apply_state, commit, publish, rollback, transition
+
+logger = logging.getLogger("studyflow.events")
+
+# Event handlers. Each one only stages its writes, broadcasts and scheduler updates on the session;
+# the caller commits them as a single unit of work with uow.commit().
+
+def _latest_ongoing(model):
+    # id of the student's most recent ongoing outing/sleep request
+    return lambda student_id: select(model.id).filter_by(student_id=student_id, status="ongoing").order_by(model.id.desc()).limit(1).scalar_subquery()
+
+latest_outing = _latest_ongoing(models.OutingRequest)
+latest_sleep = _latest_ongoing(models.SleepRequest)
+
+async def _still_ongoing(db: AsyncSession, model, live_id: Optional[int], ended: Callable[[int], None]) -> bool:
+    # confirms a live-state id before rejecting a transition; only the rejection path pays for this lookup
+    if live_id is None:
+        return False
+    if await db.scalar(select(model.status).where(model.id == live_id)) == "ongoing":
+        return True
+    ended(live_id)  # completed behind the registry's back
+    return False
+
+async def _complete(db: AsyncSession, model, expected_col, latest, student_id: str, live_id: Optional[int], **values):
+    # Completes the ongoing outing/sleep known to live_state with a guarded UPDATE by primary key. Without a live
+    # entry, or when the guard misses because the row changed behind the registry's back, the latest-ongoing query
+    # decides: the request may have started on another worker, whose registry is not this one.
+    stmt = update(model).values(**values).returning(model.id, expected_col).execution_options(synchronize_session=False)
+    if live_id is not None:
+        row = (await db.execute(stmt.where(model.id == live_id, model.status == "ongoing"))).first()
+        if row:
+            return row
+    return (await db.execute(stmt.where(model.id == latest(student_id)))).first()
+
+async def dashboard_start(db: AsyncSession, ev: schemas.DashboardStart) -> dict:
+    now = ev.timestamp or datetime.now(KST)
+    student = await crud.get_student(db, ev.student_id)
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+    crud.record_event(db, ev.student_id, "dashboard_start", now)
+
+    # attendance record (check-in)
+    rec = await crud.check_in(db, ev.student_id, today_kst_str(now), to_db_time(now))
+    after_commit(db, lambda: scheduler.cancel(("checkin", ev.student_id)))
+    transition(db, "checked_in", ev.student_id, today_kst_str(now))
+
+    # evaluate tardiness and issue notice (주의장) on *button press*
+    expected = student.check_in_deadline(now)
+    diff = seconds_late(now, expected)
+    if diff > 0 and rec.check_in_time == to_db_time(now):  # only the day's first check-in counts as late arrival
+        await summary.bump(db, ev.student_id, today_kst_str(now), checkin_late_seconds=diff)
+    sev = tardiness_category(diff)
+    if sev:
+        await issue_notice(db, ev.student_id, severity=sev, reason="등원 지각", source="dashboard_start", date_str=today_kst_str(now))
+
+    return {"ok": True, "attendance": {"date": rec.date, "check_in_time": rec.check_in_time}}
+
+async def logout(db: AsyncSession, ev: schemas.Logout) -> dict:
+    now = ev.timestamp or datetime.now(KST)
+    student = await crud.get_student(db, ev.student_id)
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+    crud.record_event(db, ev.student_id, "logout", now)
+    # attendance check-out
+    await crud.check_out(db, ev.student_id, today_kst_str(now), to_db_time(now))
+    transition(db, "checked_out", ev.student_id, today_kst_str(now))
+    publish(db, ev.student_id, {"type": "logout", "data": {"student_id": ev.student_id, "time": now.isoformat()}})
+    return {"ok": True}
+
+async def outing_request(db: AsyncSession, ev: schemas.OutingRequestIn) -> dict:
+    now = ev.timestamp or datetime.now(KST)
+    state = live_state.view(ev.student_id)
+    if await _still_ongoing(db, models.OutingRequest, state.outing_id, partial(live_state.outing_ended, ev.student_id)):
+        raise HTTPException(status_code=409, detail="Outing already in progress")
+    if await _still_ongoing(db, models.SleepRequest, state.sleep_id, partial(live_state.sleep_ended, ev.student_id)):
+        raise HTTPException(status_code=409, detail="Student is sleeping")
+    crud.record_event(db, ev.student_id, "outing_request", now, payload={"expected_return_time": ev.expected_return_time.isoformat()})
+    outing_id = await db.scalar(insert(models.OutingRequest).values(
+        student_id=ev.student_id, start_time=to_db_time(now), expected_return_time=to_db_time(ev.expected_return_time), status="ongoing"
+    ).returning(models.OutingRequest.id))
+    await summary.bump(db, ev.student_id, today_kst_str(now), outings=1)
+    after_commit(db, lambda: scheduler.schedule_outing(outing_id, ev.student_id, ev.expected_return_time))
+    transition(db, "outing_started", ev.student_id, outing_id, to_db_time(ev.expected_return_time))
+    publish(db, ev.student_id, {"type": "outing_request", "data": {
+        "id": outing_id, "expected_return_time": ev.expected_return_time.isoformat(), "start_time": now.isoformat()
+    }})
+    return {"ok": True, "outing_id": outing_id}
+
+async def outing_return(db: AsyncSession, ev: schemas.OutingReturnIn) -> dict:
+    now = ev.timestamp or datetime.now(KST)
+    state = live_state.view(ev.student_id)
+    row = await _complete(db, models.OutingRequest, models.OutingRequest.expected_return_time, latest_outing, ev.student_id, state.outing_id,
+                          actual_return_time=to_db_time(now), status="completed")
+    if not row:
+        raise HTTPException(status_code=404, detail="No ongoing outing request")
+    outing_id, expected_return_time = row
+    after_commit(db, lambda: scheduler.cancel(("outing", outing_id)))
+    transition(db, "outing_ended", ev.student_id, outing_id)
+    # evaluate tardiness: *issue notice* on return button
+    diff = int((now - from_db_time(expected_return_time)).total_seconds())
+    if diff > 0:
+        await summary.bump(db, ev.student_id, today_kst_str(now), outing_late_seconds=diff)
+        sev = 2 if diff >= 1800 else 1
+        await issue_notice(db, ev.student_id, severity=sev, reason="외출 복귀 지각", source="outing_return", date_str=today_kst_str(now))
+    publish(db, ev.student_id, {"type": "outing_return", "data": {
+        "id": outing_id, "actual_return_time": now.isoformat()
+    }})
+    return {"ok": True}
+
+async def sleep_request(db: AsyncSession, ev: schemas.SleepRequestIn) -> dict:
+    now = ev.timestamp or datetime.now(KST)
+    state = live_state.view(ev.student_id)
+    if await _still_ongoing(db, models.SleepRequest, state.sleep_id, partial(live_state.sleep_ended, ev.student_id)):
+        raise HTTPException(status_code=409, detail="Sleep already in progress")
+    if await _still_ongoing(db, models.OutingRequest, state.outing_id, partial(live_state.outing_ended, ev.student_id)):
+        raise HTTPException(status_code=409, detail="Student is on an outing")
+    crud.record_event(db, ev.student_id, "sleep_request", now, payload={"expected_wake_time": ev.expected_wake_time.isoformat()})
+    sleep_id = await db.scalar(insert(models.SleepRequest).values(
+        student_id=ev.student_id, start_time=to_db_time(now), expected_wake_time=to_db_time(ev.expected_wake_time), status="ongoing"
+    ).returning(models.SleepRequest.id))
+    await summary.bump(db, ev.student_id, today_kst_str(now), sleeps=1)
+    after_commit(db, lambda: scheduler.schedule_sleep(sleep_id, ev.student_id, ev.expected_wake_time))
+    transition(db, "sleep_started", ev.student_id, sleep_id, to_db_time(ev.expected_wake_time))
+    publish(db, ev.student_id, {"type": "sleep_request", "data": {
+        "id": sleep_id, "expected_wake_time": ev.expected_wake_time.isoformat(), "start_time": now.isoformat()
+    }})
+    return {"ok": True, "sleep_id": sleep_id}
+
+async def sleep_return(db: AsyncSession, ev: schemas.SleepReturnIn) -> dict:
+    now = ev.timestamp or datetime.now(KST)
+    state = live_state.view(ev.student_id)
+    row = await _complete(db, models.SleepRequest, models.SleepRequest.expected_wake_time, latest_sleep, ev.student_id, state.sleep_id,
+                          actual_wake_time=to_db_time(now), status="completed")
+    if not row:
+        raise HTTPException(status_code=404, detail="No ongoing sleep request")
+    sleep_id, expected_wake_time = row
+    after_commit(db, lambda: scheduler.cancel(("sleep", sleep_id)))
+    transition(db, "sleep_ended", ev.student_id, sleep_id)
+    # Only notification, no notice
+    diff = int((now - from_db_time(expected_wake_time)).total_seconds())
+    if diff > 0:
+        await summary.bump(db, ev.student_id, today_kst_str(now), sleep_late_seconds=diff)
+        msg = f"[수면 복귀 지연] {diff}초 지연되었습니다."
+        await notify(db, ev.student_id, "late-sleep-wake", msg, dedupe_key=f"sleep-return:{sleep_id}")
+    publish(db, ev.student_id, {"type": "sleep_return", "data": {
+        "id": sleep_id, "actual_wake_time": now.isoformat()
+    }})
+    return {"ok": True}
+
+async def focus_start(db: AsyncSession, ev: schemas.FocusStartIn) -> dict:
+    now = ev.timestamp or datetime.now(KST)
+    state = live_state.view(ev.student_id)
+    if state.focus_id is not None:
+        if await db.scalar(select(models.FocusSession.end_time == None).where(models.FocusSession.id == state.focus_id)):
+            raise HTTPException(status_code=409, detail="Focus session already running")
+        live_state.focus_ended(ev.student_id, state.focus_id)
+    sess_id = await db.scalar(insert(models.FocusSession).values(
+        student_id=ev.student_id, start_time=to_db_time(now), meta_data=ev.meta or {}
+    ).returning(models.FocusSession.id))
+    crud.record_event(db, ev.student_id, "focus_start", now, payload={"focus_session_id": sess_id})
+    transition(db, "focus_started", ev.student_id, sess_id, to_db_time(now))
+    publish(db, ev.student_id, {"type": "focus_start", "data": {"id": sess_id, "start_time": now.isoformat()}})
+    return {"ok": True, "focus_session_id": sess_id}
+
+def _elapsed(now: datetime, start: datetime) -> int:
+    # start is a stored value (naive server-local, like live_state's focus_start), not a naive KST time
+    return max(int((to_db_time(now) - start).total_seconds()), 0)
+
+async def focus_stop(db: AsyncSession, ev: schemas.FocusStopIn) -> dict:
+    now = ev.timestamp or datetime.now(KST)
+    state = live_state.view(ev.student_id)
+    sess_id = None
+    if state.focus_id is not None:
+        duration = _elapsed(now, state.focus_start)
+        sess_id = await db.scalar(update(models.FocusSession).where(models.FocusSession.id == state.focus_id, models.FocusSession.end_time == None)
+            .values(end_time=to_db_time(now), duration_seconds=duration).returning(models.FocusSession.id)
+            .execution_options(synchronize_session=False))
+    if sess_id is None:
+        # no live entry (live_state not loaded yet, or the session started on another worker), or its session was
+        # closed elsewhere: fall back to the student's latest session
+        sess = await db.scalar(select(models.FocusSession).filter_by(student_id=ev.student_id).order_by(models.FocusSession.id.desc()).limit(1))
+        if sess and not sess.end_time:
+            sess.end_time = to_db_time(now)
+            sess.duration_seconds = duration = _elapsed(now, sess.start_time)
+            sess_id = sess.id
+    if sess_id is None:
+        raise HTTPException(status_code=404, detail="No active focus session")
+    transition(db, "focus_ended", ev.student_id, sess_id)
+    await summary.bump(db, ev.student_id, today_kst_str(now), focus_seconds=duration, focus_sessions=1)
+    crud.record_event(db, ev.student_id, "focus_stop", now, payload={"focus_session_id": sess_id, "duration": duration})
+    publish(db, ev.student_id, {"type": "focus_stop", "data": {
+        "id": sess_id, "end_time": now.isoformat(), "duration_seconds": duration
+    }})
+    return {"ok": True, "duration_seconds": duration}
+
+# --- batches: events a kiosk buffered while offline, replayed in one request ---
+
+MAX_BATCH_EVENTS = 1000
+
+# batch item `type` -> (schema, handler); the names are the event log's types
+HANDLERS = {
+    "dashboard_start": (schemas.DashboardStart, dashboard_start),
+    "logout": (schemas.Logout, logout),
+    "outing_request": (schemas.OutingRequestIn, outing_request),
+    "outing_return": (schemas.OutingReturnIn, outing_return),
+    "sleep_request": (schemas.SleepRequestIn, sleep_request),
+    "sleep_return": (schemas.SleepReturnIn, sleep_return),
+    "focus_start": (schemas.FocusStartIn, focus_start),
+    "focus_stop": (schemas.FocusStopIn, focus_stop),
+}
+
+def read_batch(body: bytes, content_type: str = "") -> List[Any]:
+    # a JSON array, or NDJSON (one event per line); raises ValueError on malformed input
+    text = body.decode()
+    if "ndjson" in content_type or not text.lstrip().startswith("["):
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    items = json.loads(text)
+    if not isinstance(items, list):
+        raise ValueError("expected a JSON array of events")
+    return items
+
+def _parse_item(item: Any) -> Union[dict, Tuple[Callable, schemas.EventBase]]:
+    kind = item.get("type") if isinstance(item, dict) else None
+    if kind not in HANDLERS:
+        return {"ok": False, "status": 422, "detail": f"unknown event type {kind!r}"}
+    schema, handler = HANDLERS[kind]
+    try:
+        ev = schema.model_validate(item)
+    except ValidationError as e:
+        return {"ok": False, "status": 422, "detail": [{"loc": err["loc"], "msg": err["msg"]} for err in e.errors()]}
+    if ev.timestamp is None:
+        return {"ok": False, "status": 422, "detail": "timestamp is required in a batch"}
+    ev.timestamp = ensure_kst(ev.timestamp)  # handlers take the KST date and deadlines from it, whatever offset it came with
+    return handler, ev
+
+async def apply_batch(db: AsyncSession, items: List[Any]) -> List[dict]:
+    # Each student's events run in timestamp order (ties keep the submitted order) in one transaction, and each
+    # event's own timestamp is its "now", so tardiness is judged as if it had arrived on time. A rejected event
+    # (404/409) is reported and skipped while the student's other events still commit; an unexpected error rolls
+    # back that student's whole transaction. live_state moves on after every event so the next one sees it.
+    # Results come back in the submitted order.
+    results: List[Optional[dict]] = [None] * len(items)
+    by_student: Dict[str, list] = {}
+    for index, item in enumerate(items):
+        parsed = _parse_item(item)
+        if isinstance(parsed, dict):
+            results[index] = {"index": index, "type": item.get("type") if isinstance(item, dict) else None, **parsed}
+            continue
+        handler, ev = parsed
+        by_student.setdefault(ev.student_id, []).append((ev.timestamp, index, item["type"], handler, ev))
+
+    for student_id, group in by_student.items():
+        group.sort(key=lambda entry: entry[:2])
+        saved = live_state.snapshot(student_id)
+        try:
+            for _, index, kind, handler, ev in group:
+                queued = len(db.info.get("after_commit", ()))
+                try:
+                    result = await handler(db, ev)
+                except HTTPException as e:
+                    # handlers reject before writing anything; drop whatever they queued all the same
+                    del db.info.get("after_commit", [])[queued:]
+                    db.info.pop("on_state", None)
+                    results[index] = {"index": index, "type": kind, "ok": False, "status": e.status_code, "detail": e.detail}
+                    continue
+                apply_state(db)
+                results[index] = {"index": index, "type": kind, **result}
+            await commit(db)
+        except Exception:
+            logger.exception("batch of %d events for %s rolled back", len(group), student_id)
+            await rollback(db)
+            live_state.restore(student_id, saved)
+            for _, index, kind, _, _ in group:
+                if results[index] is None or results[index]["ok"]:
+                    results[index] = {"index": index, "type": kind, "ok": False, "status": 500, "detail": "rolled back"}
+    return results
@@ -0,0 +1,149 @@
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import AsyncIterator, Callable, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models
+from .archive import archived_months, iter_month, load_index, month_bounds, month_of, read_student_month, shift_month
+from .database import AsyncSessionLocal
+from .timeutil import KST, to_db_time
+
+# Streaming exports for reporting. Rows come off the database through a server-side cursor in chunks of
+# EXPORT_CHUNK (yield_per, plain column rows so nothing collects in the session's identity map) and leave as
+# one encoded chunk at a time, so memory stays flat however long the range is. Archived months of event_logs are
+# streamed from their gzip files the same way.
+#
+# The generators open their own session: StreamingResponse iterates them after the endpoint has returned and
+# its request-scoped session is closed.
+
+EXPORT_CHUNK = 1000
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+EVENT_COLUMNS = ("id", "student_id", "type", "timestamp", "payload")
+ATTENDANCE_COLUMNS = ("date", "student_id", "name", "grade", "classroom", "status", "check_in_time", "check_out_time")
+
+def bounds(date_from: str, date_to: str) -> Tuple[datetime, datetime]:
+    # KST dates, both inclusive -> [since, until) in the naive server-local time the DateTime columns hold
+    since = datetime.fromisoformat(date_from).replace(tzinfo=KST)
+    until = datetime.fromisoformat(date_to).replace(tzinfo=KST) + timedelta(days=1)
+    return to_db_time(since), to_db_time(until)
+
+def _value(v):
+    return v.isoformat() if isinstance(v, datetime) else v
+
+def _encode_ndjson(columns: Tuple[str, ...], rows: Iterable[tuple]) -> bytes:
+    return "".join(json.dumps({c: _value(v) for c, v in zip(columns, row)}, ensure_ascii=False) + "\n" for row in rows).encode("utf-8")
+
+def _encode_csv(columns: Tuple[str, ...], rows: Iterable[tuple]) -> bytes:
+    buf = io.StringIO()
+    csv.writer(buf).writerows([json.dumps(v, ensure_ascii=False) if isinstance(v, dict) else _value(v) for v in row] for row in rows)
+    return buf.getvalue().encode("utf-8")
+
+ENCODERS = {"ndjson": _encode_ndjson, "csv": _encode_csv}
+
+async def _encoded(fmt: str, columns: Tuple[str, ...], chunks: AsyncIterator[List[tuple]]) -> AsyncIterator[bytes]:
+    encode = ENCODERS[fmt]
+    if fmt == "csv":
+        yield "\ufeff".encode("utf-8") + encode(columns, [columns])  # BOM, so Excel reads the Korean names as UTF-8
+    async for rows in chunks:
+        if rows:
+            yield encode(columns, rows)
+
+async def _stream(db: AsyncSession, stmt) -> AsyncIterator[List[tuple]]:
+    result = await db.stream(stmt.execution_options(yield_per=EXPORT_CHUNK))
+    async for rows in result.partitions():
+        yield [tuple(row) for row in rows]
+
+async def _student_filter(db: AsyncSession, student_id: Optional[str], classroom: Optional[str]) -> Optional[Set[str]]:
+    # None = every student; the classroom's roster is one column of ids, bounded by the number of students
+    if classroom is None:
+        return None if student_id is None else {student_id}
+    ids = set(await db.scalars(select(models.Student.id).where(models.Student.classroom == classroom)))
+    return ids if student_id is None else ids & {student_id}
+
+def _where_students(stmt, column, students: Optional[Set[str]]):
+    return stmt if students is None else stmt.where(column.in_(students))
+
+# --- event_logs ---
+
+async def _archived_rows(month: str, students: Optional[Set[str]]) -> AsyncIterator[List[tuple]]:
+    # an archived month, student by student; the gzip file is read on a worker thread a chunk at a time
+    as_tuple = lambda r: tuple(r[c] for c in EVENT_COLUMNS)
+    if students is None:
+        rows = iter_month(month)
+        try:
+            while chunk := await asyncio.to_thread(lambda: [as_tuple(r) for r in islice(rows, EXPORT_CHUNK)]):
+                yield chunk
+        finally:
+            rows.close()
+    else:
+        for student_id in sorted(students & load_index(month)["students"].keys()):
+            yield [as_tuple(r) for r in await asyncio.to_thread(read_student_month, month, student_id)]
+
+def _months(since: datetime, until: datetime) -> List[str]:
+    months, month = [], month_of(since)
+    while month_bounds(month)[0] < until:
+        months.append(month)
+        month = shift_month(month, 1)
+    return months
+
+async def event_chunks(date_from: str, date_to: str, student_id: Optional[str] = None, classroom: Optional[str] = None,
+                       types: Optional[List[str]] = None) -> AsyncIterator[List[tuple]]:
+    # Month by month, oldest first. A month still in event_logs comes in (timestamp, id) order; an archived month
+    # comes grouped by student, followed by any of its rows still in the table (arrived late, or left behind by an
+    # interrupted archive run, in which case the archived copy is skipped).
+    since, until = bounds(date_from, date_to)
+    archived = set(archived_months())
+    keep: Callable[[tuple], bool] = lambda r: since <= r[3] < until and (not types or r[2] in types)
+    async with AsyncSessionLocal() as db:
+        students = await _student_filter(db, student_id, classroom)
+        if students is not None and not students:
+            return
+        for month in _months(since, until):
+            start, end = month_bounds(month)
+            stmt = select(*(getattr(models.EventLog, c) for c in EVENT_COLUMNS)).where(
+                models.EventLog.timestamp >= max(start, since), models.EventLog.timestamp < min(end, until))
+            # For a classroom SQLite would pick the student_id index and sort the whole month in a temp b-tree;
+            # filtering on an expression keeps it walking ix_event_logs_timestamp_id, which is already in order.
+            # One student's month is small enough to sort.
+            column = models.EventLog.student_id if students is None or len(students) == 1 else models.EventLog.student_id + ""
+            stmt = _where_students(stmt, column, students)
+            if types:
+                stmt = stmt.where(models.EventLog.type.in_(types))
+            if month in archived:
+                # rows of a closed month left in the table; normally none
+                hot = set(await db.scalars(stmt.with_only_columns(models.EventLog.id)))
+                async for rows in _archived_rows(month, students):
+                    yield [r for r in rows if keep(r) and r[0] not in hot]
+                if not hot:
+                    continue
+            async for rows in _stream(db, stmt.order_by(models.EventLog.timestamp, models.EventLog.id)):
+                yield rows
+
+def export_events(fmt: str, date_from: str, date_to: str, student_id: Optional[str] = None, classroom: Optional[str] = None,
+                  types: Optional[List[str]] = None) -> AsyncIterator[bytes]:
+    return _encoded(fmt, EVENT_COLUMNS, event_chunks(date_from, date_to, student_id, classroom, types))
+
+# --- attendance_records ---
+
+async def attendance_chunks(date_from: str, date_to: str, student_id: Optional[str] = None,
+                            classroom: Optional[str] = None) -> AsyncIterator[List[tuple]]:
+    # by date, then student; name/grade/classroom are the student's current ones
+    A, S = models.AttendanceRecord, models.Student
+    stmt = (select(A.date, A.student_id, S.name, S.grade, S.classroom, A.status, A.check_in_time, A.check_out_time)
+            .join(S, S.id == A.student_id).where(A.date >= date_from, A.date <= date_to).order_by(A.date, A.student_id))
+    if student_id is not None:
+        stmt = stmt.where(A.student_id == student_id)
+    if classroom is not None:
+        stmt = stmt.where(S.classroom == classroom)
+    async with AsyncSessionLocal() as db:
+        async for rows in _stream(db, stmt):
+            yield rows
+
+def export_attendance(fmt: str, date_from: str, date_to: str, student_id: Optional[str] = None,
+                      classroom: Optional[str] = None) -> AsyncIterator[bytes]:
+    return _encoded(fmt, ATTENDANCE_COLUMNS, attendance_chunks(date_from, date_to, student_id, classroom))
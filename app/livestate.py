@@ -0,0 +1,162 @@
+from datetime import datetime
+from typing import Dict, Optional
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models
+from .timeutil import KST, today_kst_str
+
+# What each student is doing right now: today's attendance, the ongoing outing/sleep and the open focus session.
+# Rebuilt from the database at startup and updated by the event handlers after their transaction commits, so
+# the hot paths answer "is there an ongoing X" without an ORDER BY id DESC LIMIT 1 query.
+#
+# The database stays authoritative: handlers write with guarded statements (WHERE id = ? AND status = 'ongoing')
+# and fall back to a query when there is no live entry or the guard misses, e.g. when another worker started or
+# changed the same student's request. With several workers each one also replays the transitions the others
+# committed (uow.transition), so the registries only lag by the broker's delivery time.
+class LiveState:
+    __slots__ = ("student_id", "date", "checked_in", "checked_out",
+                 "outing_id", "outing_expected", "sleep_id", "sleep_expected", "focus_id", "focus_start")
+
+    def __init__(self, student_id: str):
+        self.student_id = student_id
+        self.date: Optional[str] = None  # KST date the attendance flags belong to
+        self.checked_in = False
+        self.checked_out = False
+        self.outing_id: Optional[int] = None
+        self.outing_expected: Optional[datetime] = None
+        self.sleep_id: Optional[int] = None
+        self.sleep_expected: Optional[datetime] = None
+        self.focus_id: Optional[int] = None
+        self.focus_start: Optional[datetime] = None
+
+    def attendance(self, now: Optional[datetime] = None) -> str:
+        if self.date != today_kst_str(now or datetime.now(KST)) or not self.checked_in:
+            return "absent"
+        return "checked_out" if self.checked_out else "present"
+
+    def activity(self) -> str:
+        if self.outing_id is not None:
+            return "outing"
+        if self.sleep_id is not None:
+            return "sleeping"
+        if self.focus_id is not None:
+            return "focusing"
+        return "idle"
+
+    def as_dict(self, now: Optional[datetime] = None) -> dict:
+        return {"student_id": self.student_id, "attendance": self.attendance(now), "activity": self.activity(),
+                "outing_id": self.outing_id, "sleep_id": self.sleep_id, "focus_session_id": self.focus_id}
+
+class LiveStateRegistry:
+    def __init__(self):
+        self._states: Dict[str, LiveState] = {}
+        self.ready = False  # False until rebuild(); callers then query the database instead
+
+    def __len__(self):
+        return len(self._states)
+
+    def peek(self, student_id: str) -> Optional[LiveState]:
+        return self._states.get(student_id)
+
+    def view(self, student_id: str) -> LiveState:
+        # read-only; unknown students share one idle record instead of growing the registry
+        return self._states.get(student_id) or _IDLE
+
+    def get(self, student_id: str) -> LiveState:
+        state = self._states.get(student_id)
+        if state is None:
+            state = self._states[student_id] = LiveState(student_id)
+        return state
+
+    async def rebuild(self, db: AsyncSession, now: Optional[datetime] = None):
+        states: Dict[str, LiveState] = {}
+        get = lambda sid: states.get(sid) or states.setdefault(sid, LiveState(sid))
+        date_str = today_kst_str(now or datetime.now(KST))
+        for sid, check_in, check_out in await db.execute(select(models.AttendanceRecord.student_id, models.AttendanceRecord.check_in_time,
+                models.AttendanceRecord.check_out_time).where(models.AttendanceRecord.date == date_str, models.AttendanceRecord.check_in_time != None)):
+            state = get(sid)
+            state.date, state.checked_in, state.checked_out = date_str, True, check_out is not None
+        # ascending id, so the latest ongoing request of a student wins, as in the old ORDER BY id DESC LIMIT 1
+        for id, sid, expected in await db.execute(select(models.OutingRequest.id, models.OutingRequest.student_id, models.OutingRequest.expected_return_time)
+                                                  .filter_by(status="ongoing").order_by(models.OutingRequest.id)):
+            get(sid).outing_id, get(sid).outing_expected = id, expected
+        for id, sid, expected in await db.execute(select(models.SleepRequest.id, models.SleepRequest.student_id, models.SleepRequest.expected_wake_time)
+                                                  .filter_by(status="ongoing").order_by(models.SleepRequest.id)):
+            get(sid).sleep_id, get(sid).sleep_expected = id, expected
+        latest = select(func.max(models.FocusSession.id)).group_by(models.FocusSession.student_id)
+        for id, sid, start_time in await db.execute(select(models.FocusSession.id, models.FocusSession.student_id, models.FocusSession.start_time)
+                                                    .where(models.FocusSession.id.in_(latest), models.FocusSession.end_time == None)):
+            get(sid).focus_id, get(sid).focus_start = id, start_time
+        self._states = states
+        self.ready = True
+
+    def snapshot(self, student_id: str) -> Optional[LiveState]:
+        state = self._states.get(student_id)
+        if state is None:
+            return None
+        copy = LiveState(student_id)
+        for slot in LiveState.__slots__:
+            setattr(copy, slot, getattr(state, slot))
+        return copy
+
+    def restore(self, student_id: str, saved: Optional[LiveState]):
+        # undoes transitions a batch applied ahead of a commit that then failed
+        if saved is None:
+            self._states.pop(student_id, None)
+        else:
+            self._states[student_id] = saved
+
+    def replay(self, call: str, args: list):
+        # a transition committed on another worker (uow.transition, op "state" in app/websockets.py); the datetime
+        # a *_started transition ends with arrives as an ISO string
+        if call not in TRANSITIONS:
+            raise ValueError(f"unknown live state transition {call!r}")
+        if call.endswith("_started"):
+            args = [*args[:-1], datetime.fromisoformat(args[-1])]
+        getattr(self, call)(*args)
+
+    # transitions, applied after the event's transaction commits (uow.on_state)
+    def checked_in(self, student_id: str, date_str: str):
+        state = self.get(student_id)
+        if state.date != date_str:
+            state.date, state.checked_out = date_str, False
+        state.checked_in = True
+
+    def checked_out(self, student_id: str, date_str: str):
+        state = self.get(student_id)
+        if state.date != date_str:
+            state.date, state.checked_in = date_str, False
+        state.checked_out = True
+
+    def outing_started(self, student_id: str, outing_id: int, expected: datetime):
+        state = self.get(student_id)
+        state.outing_id, state.outing_expected = outing_id, expected
+
+    def outing_ended(self, student_id: str, outing_id: int):
+        state = self.get(student_id)
+        if state.outing_id == outing_id:
+            state.outing_id = state.outing_expected = None
+
+    def sleep_started(self, student_id: str, sleep_id: int, expected: datetime):
+        state = self.get(student_id)
+        state.sleep_id, state.sleep_expected = sleep_id, expected
+
+    def sleep_ended(self, student_id: str, sleep_id: int):
+        state = self.get(student_id)
+        if state.sleep_id == sleep_id:
+            state.sleep_id = state.sleep_expected = None
+
+    def focus_started(self, student_id: str, focus_id: int, start_time: datetime):
+        state = self.get(student_id)
+        state.focus_id, state.focus_start = focus_id, start_time
+
+    def focus_ended(self, student_id: str, focus_id: int):
+        state = self.get(student_id)
+        if state.focus_id == focus_id:
+            state.focus_id = state.focus_start = None
+
+TRANSITIONS = {"checked_in", "checked_out", "outing_started", "outing_ended", "sleep_started", "sleep_ended", "focus_started", "focus_ended"}
+
+_IDLE = LiveState("")
+
+live_state = LiveStateRegistry()
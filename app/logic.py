@@ -1,26 +1,21 @@
+import logging
+import time as clock
 from datetime import datetime, timedelta, date, time
-from zoneinfo import ZoneInfo
-from sqlalchemy.orm import Session
-from typing import Optional
-from . import models
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, List, Optional, Tuple
+from . import models, summary
+from .cache import CachedStudent
+from .crud import dialect_insert, insert_ignore, get_student
+from .livestate import live_state
+from .dispatcher import dispatcher
+from .dedupe import notification_index, notice_index, notice_key
+from .timeutil import KST, today_kst_str, parse_time_str, combine_today_time, ensure_kst, from_db_time, to_db_time
+from .uow import after_commit, bump_versions, commit, publish, publish_admins
+from .versions import NOTICES, NOTIFICATIONS
 from .websockets import ws_manager
 
-KST = ZoneInfo("Asia/Seoul")
-
-def today_kst_str(now: Optional[datetime] = None) -> str:
-    if not now:
-        now = datetime.now(KST)
-    return now.date().isoformat()
-
-def parse_time_str(t: str) -> time:
-    hh, mm, ss = [int(x) for x in t.split(":")]
-    return time(hour=hh, minute=mm, second=ss, tzinfo=None)
-
-def combine_today_time(t: time, now: Optional[datetime] = None) -> datetime:
-    if not now:
-        now = datetime.now(KST)
-    # combine with today's date in KST
-    return datetime(year=now.year, month=now.month, day=now.day, hour=t.hour, minute=t.minute, second=t.second, tzinfo=KST)
+logger = logging.getLogger(__name__)
 
 def tardiness_category(diff_seconds: int) -> Optional[int]:
     if diff_seconds >= 30*60:
@@ -29,128 +24,271 @@ def tardiness_category(diff_seconds: int) -> Optional[int]:
         return 1
     return None
 
-async def notify(db: Session, student_id: str, category: str, message: str, dedupe_key: Optional[str] = None):
-    # de-duplicate by dedupe_key if provided
-    if dedupe_key:
-        existing = db.query(models.Notification).filter(models.Notification.dedupe_key == dedupe_key).first()
-        if existing:
-            return existing
-    notif = models.Notification(
+def notice_frame(notice: models.Notice) -> dict:
+    return {"type": "notice", "data": {
+        "id": notice.id, "student_id": notice.student_id, "type": notice.type, "severity": notice.severity,
+        "reason": notice.reason, "source": notice.source, "date": notice.date, "created_at": notice.created_at.isoformat()
+    }}
+
+def notification_frame(notif: models.Notification) -> dict:
+    return {"type": "notification", "data": {
+        "id": notif.id, "student_id": notif.student_id, "category": notif.category, "message": notif.message, "created_at": notif.created_at.isoformat()
+    }}
+
+# notify() and issue_notice() only stage their row in the caller's transaction; the broadcast and the
+# dedupe index update happen when the caller commits through uow.commit().
+async def notify(db: AsyncSession, student_id: str, category: str, message: str, dedupe_key: Optional[str] = None):
+    # returns None when a notification with the same dedupe_key was already sent
+    values = dict(
         student_id=student_id,
         category=category,
         message=message,
-        created_at=datetime.now(tz=KST).astimezone(None),
+        created_at=to_db_time(datetime.now(KST)),
         acknowledged=False,
         dedupe_key=dedupe_key
     )
-    db.add(notif)
-    db.commit()
-    db.refresh(notif)
-    await ws_manager.send_to_all(student_id, {"type": "notification", "data": {
-        "id": notif.id, "student_id": student_id, "category": category, "message": message, "created_at": notif.created_at.isoformat()
-    }})
+    if dedupe_key:
+        if dedupe_key in notification_index:
+            return None
+        # _notif_dedupe_uc makes the insert itself the existence check
+        notif_id = await db.scalar(insert_ignore(db, models.Notification).values(**values).returning(models.Notification.id))
+        if notif_id is None:
+            notification_index.add(dedupe_key)  # the conflicting row is already committed
+            return None
+        after_commit(db, lambda: notification_index.add(dedupe_key))
+    else:
+        notif_id = await db.scalar(insert(models.Notification).values(**values).returning(models.Notification.id))
+    notif = models.Notification(id=notif_id, **values)
+    bump_versions(db, NOTIFICATIONS, [student_id])
+    publish(db, student_id, notification_frame(notif))
     return notif
 
-async def issue_notice(db: Session, student_id: str, severity: int, reason: str, source: str, date_str: Optional[str] = None):
+async def issue_notice(db: AsyncSession, student_id: str, severity: int, reason: str, source: str, date_str: Optional[str] = None):
     date_str = date_str or today_kst_str()
     # Avoid duplicate notices with same severity & reason & date
-    existing = db.query(models.Notice).filter(
+    key = notice_key(student_id, date_str, reason, severity)
+    if key in notice_index:
+        return None
+    existing = await db.scalar(select(models.Notice.id).where(
         models.Notice.student_id == student_id,
         models.Notice.date == date_str,
         models.Notice.reason == reason,
         models.Notice.severity == severity
-    ).first()
+    ))
     if existing:
-        return existing
-    notice = models.Notice(
+        notice_index.add(key)
+        return None
+    values = dict(
         student_id=student_id, type="주의장", severity=severity, reason=reason, source=source,
-        date=date_str
+        date=date_str, created_at=to_db_time(datetime.now(KST))
     )
-    db.add(notice)
-    db.commit()
-    db.refresh(notice)
-    await ws_manager.send_to_all(student_id, {"type": "notice", "data": {
-        "id": notice.id, "student_id": student_id, "type": notice.type, "severity": severity,
-        "reason": reason, "source": source, "date": date_str, "created_at": notice.created_at.isoformat()
-    }})
+    notice = models.Notice(id=await db.scalar(insert(models.Notice).values(**values).returning(models.Notice.id)), **values)
+    await summary.bump(db, student_id, date_str, notices=1, notice_severity=severity)
+    after_commit(db, lambda: notice_index.add(key))
+    bump_versions(db, NOTICES, [student_id])
+    publish(db, student_id, notice_frame(notice))
     return notice
 
-def get_or_create_today_attendance(db: Session, student_id: str, now: Optional[datetime] = None) -> models.AttendanceRecord:
-    date_str = today_kst_str(now)
-    rec = db.query(models.AttendanceRecord).filter(
-        models.AttendanceRecord.student_id == student_id,
-        models.AttendanceRecord.date == date_str
-    ).first()
-    if not rec:
-        rec = models.AttendanceRecord(student_id=student_id, date=date_str, status="present")
-        db.add(rec)
-        db.commit()
-        db.refresh(rec)
-    return rec
-
-async def evaluate_checkin_notifications(db: Session, student: models.Student, now: Optional[datetime] = None):
+# Each *_alert helper returns (category, message, dedupe_key) when a notification is due, else None.
+# They are shared by the per-student evaluate_* functions and the set-based evaluate_many.
+def checkin_alert(student_id: str, expected: datetime, now: datetime) -> Optional[Tuple[str, str, str]]:
+    if now <= expected:
+        return None  # not late yet
+    diff = int((now - expected).total_seconds())
+    if tardiness_category(diff) is None:
+        return None
+    dedupe_key = f"late-arrival:{student_id}:{today_kst_str(now)}:{1 if diff>=1 and diff<1800 else 2}"
+    msg = f"[등원 지각 알림] 현재 {diff}초 지각 중입니다. 기준시간 {expected.astimezone(KST).time()}"
+    return "late-arrival", msg, dedupe_key
+
+def outing_alert(outing: models.OutingRequest, now: datetime) -> Optional[Tuple[str, str, str]]:
+    expected = from_db_time(outing.expected_return_time)  # stored (or live_state) value: naive server-local
+    if now <= expected:
+        return None
+    diff = int((now - expected).total_seconds())
+    if tardiness_category(diff) is None:
+        return None
+    tier = 1 if diff < 1800 else 2
+    dedupe_key = f"late-outing-return:{outing.student_id}:{outing.id}:{tier}"
+    msg = f"[외출 복귀 지각 알림] 현재 {diff}초 지각 중입니다. 복귀예정 {expected.strftime('%H:%M:%S')}"
+    return "late-outing-return", msg, dedupe_key
+
+def sleep_alert(sleep: models.SleepRequest, now: datetime) -> Optional[Tuple[str, str, str]]:
+    expected = from_db_time(sleep.expected_wake_time)
+    if now <= expected:
+        return None
+    diff = int((now - expected).total_seconds())
+    if diff < 1:
+        return None
+    dedupe_key = f"late-sleep-wake:{sleep.student_id}:{sleep.id}"
+    msg = f"[수면 복귀 지연 알림] 현재 {diff}초 지연 중입니다. 기상예정 {expected.strftime('%H:%M:%S')}"
+    return "late-sleep-wake", msg, dedupe_key
+
+async def evaluate_checkin_notifications(db: AsyncSession, student: CachedStudent, now: Optional[datetime] = None):
     now = now or datetime.now(KST)
-    expected = combine_today_time(parse_time_str(student.expected_check_in), now)
+    expected = student.check_in_deadline(now)
     if now <= expected:
         return  # not late yet
     # if student has already checked in today, do nothing
-    ar = db.query(models.AttendanceRecord).filter_by(student_id=student.id, date=today_kst_str(now)).first()
-    if ar and ar.check_in_time:
-        return
-    diff = int((now - expected).total_seconds())
-    sev = tardiness_category(diff)
-    if sev is None:
-        return
-    dedupe_key = f"late-arrival:{student.id}:{today_kst_str(now)}:{1 if diff>=1 and diff<1800 else 2}"
-    msg = f"[등원 지각 알림] 현재 {diff}초 지각 중입니다. 기준시간 {expected.astimezone(KST).time()}"
-    await notify(db, student.id, "late-arrival", msg, dedupe_key=dedupe_key)
+    if live_state.ready:
+        if live_state.view(student.id).attendance(now) != "absent":
+            return
+    else:
+        ar = await db.scalar(select(models.AttendanceRecord).filter_by(student_id=student.id, date=today_kst_str(now)))
+        if ar and ar.check_in_time:
+            return
+    alert = checkin_alert(student.id, expected, now)
+    if alert:
+        category, msg, dedupe_key = alert
+        await notify(db, student.id, category, msg, dedupe_key=dedupe_key)
 
-async def evaluate_outing_notifications(db: Session, student_id: str, now: Optional[datetime] = None):
+async def evaluate_outing_notifications(db: AsyncSession, student_id: str, now: Optional[datetime] = None):
     now = now or datetime.now(KST)
     # find ongoing outing
-    outing = db.query(models.OutingRequest).filter_by(student_id=student_id, status="ongoing").order_by(models.OutingRequest.id.desc()).first()
+    if live_state.ready:
+        state = live_state.view(student_id)
+        outing = state.outing_id and models.OutingRequest(id=state.outing_id, student_id=student_id, expected_return_time=state.outing_expected)
+    else:
+        outing = await db.scalar(select(models.OutingRequest).filter_by(student_id=student_id, status="ongoing").order_by(models.OutingRequest.id.desc()).limit(1))
     if not outing:
         return
-    if now <= outing.expected_return_time.replace(tzinfo=KST):
-        return
-    diff = int((now - outing.expected_return_time.replace(tzinfo=KST)).total_seconds())
-    sev = tardiness_category(diff)
-    if sev is None:
-        return
-    tier = 1 if diff < 1800 else 2
-    dedupe_key = f"late-outing-return:{student_id}:{outing.id}:{tier}"
-    msg = f"[외출 복귀 지각 알림] 현재 {diff}초 지각 중입니다. 복귀예정 {outing.expected_return_time.astimezone(KST).strftime('%H:%M:%S')}"
-    await notify(db, student_id, "late-outing-return", msg, dedupe_key=dedupe_key)
+    alert = outing_alert(outing, now)
+    if alert:
+        category, msg, dedupe_key = alert
+        await notify(db, student_id, category, msg, dedupe_key=dedupe_key)
 
-async def evaluate_sleep_notifications(db: Session, student_id: str, now: Optional[datetime] = None):
+async def evaluate_sleep_notifications(db: AsyncSession, student_id: str, now: Optional[datetime] = None):
     now = now or datetime.now(KST)
-    sleep = db.query(models.SleepRequest).filter_by(student_id=student_id, status="ongoing").order_by(models.SleepRequest.id.desc()).first()
+    if live_state.ready:
+        state = live_state.view(student_id)
+        sleep = state.sleep_id and models.SleepRequest(id=state.sleep_id, student_id=student_id, expected_wake_time=state.sleep_expected)
+    else:
+        sleep = await db.scalar(select(models.SleepRequest).filter_by(student_id=student_id, status="ongoing").order_by(models.SleepRequest.id.desc()).limit(1))
     if not sleep:
         return
-    if now <= sleep.expected_wake_time.replace(tzinfo=KST):
-        return
-    diff = int((now - sleep.expected_wake_time.replace(tzinfo=KST)).total_seconds())
-    if diff >= 1:
-        dedupe_key = f"late-sleep-wake:{student_id}:{sleep.id}"
-        msg = f"[수면 복귀 지연 알림] 현재 {diff}초 지연 중입니다. 기상예정 {sleep.expected_wake_time.astimezone(KST).strftime('%H:%M:%S')}"
-        await notify(db, student_id, "late-sleep-wake", msg, dedupe_key=dedupe_key)
-
-async def evaluate_all(db: Session, student_id: str):
-    student = db.query(models.Student).filter_by(id=student_id).first()
+    alert = sleep_alert(sleep, now)
+    if alert:
+        category, msg, dedupe_key = alert
+        await notify(db, student_id, category, msg, dedupe_key=dedupe_key)
+
+async def evaluate_all(db: AsyncSession, student_id: str):
+    student = await get_student(db, student_id)
     if not student:
         return
     await evaluate_checkin_notifications(db, student)
     await evaluate_outing_notifications(db, student_id)
     await evaluate_sleep_notifications(db, student_id)
 
-def ensure_kst(dt: Optional[datetime]) -> Optional[datetime]:
-    if dt is None:
-        return None
-    if dt.tzinfo is None:
-        return dt.replace(tzinfo=KST)
-    return dt.astimezone(KST)
+# Set-based variant of evaluate_all: a fixed number of queries regardless of how many students are evaluated.
+# Like sweep_absences it is a bulk job and commits its own unit of work.
+async def evaluate_many(db: AsyncSession, student_ids: Optional[List[str]] = None, now: Optional[datetime] = None) -> Tuple[int, List[models.Notification]]:
+    now = now or datetime.now(KST)
+    date_str = today_kst_str(now)
+    students_q = select(models.Student.id, models.Student.expected_check_in, models.AttendanceRecord.check_in_time).outerjoin(
+        models.AttendanceRecord,
+        (models.AttendanceRecord.student_id == models.Student.id) & (models.AttendanceRecord.date == date_str)
+    ).where(models.Student.ended == False)
+    outings_q = select(models.OutingRequest).join(models.Student, models.Student.id == models.OutingRequest.student_id).where(
+        models.OutingRequest.status == "ongoing", models.Student.ended == False)
+    sleeps_q = select(models.SleepRequest).join(models.Student, models.Student.id == models.SleepRequest.student_id).where(
+        models.SleepRequest.status == "ongoing", models.Student.ended == False)
+    if student_ids is not None:
+        students_q = students_q.where(models.Student.id.in_(student_ids))
+        outings_q = outings_q.where(models.OutingRequest.student_id.in_(student_ids))
+        sleeps_q = sleeps_q.where(models.SleepRequest.student_id.in_(student_ids))
+    students = (await db.execute(students_q)).all()
+
+    # only the latest ongoing outing/sleep per student counts, as in evaluate_outing/sleep_notifications
+    latest_outing: Dict[str, models.OutingRequest] = {}
+    for o in await db.scalars(outings_q.order_by(models.OutingRequest.id.asc())):
+        latest_outing[o.student_id] = o
+    latest_sleep: Dict[str, models.SleepRequest] = {}
+    for sl in await db.scalars(sleeps_q.order_by(models.SleepRequest.id.asc())):
+        latest_sleep[sl.student_id] = sl
+
+    candidates: Dict[str, Tuple[str, str, str]] = {}  # dedupe_key -> (student_id, category, message)
+    for student_id, expected_check_in, check_in_time in students:
+        if expected_check_in and not check_in_time:
+            alert = checkin_alert(student_id, combine_today_time(parse_time_str(expected_check_in), now), now)
+            if alert:
+                candidates[alert[2]] = (student_id, alert[0], alert[1])
+    for o in latest_outing.values():
+        alert = outing_alert(o, now)
+        if alert:
+            candidates[alert[2]] = (o.student_id, alert[0], alert[1])
+    for sl in latest_sleep.values():
+        alert = sleep_alert(sl, now)
+        if alert:
+            candidates[alert[2]] = (sl.student_id, alert[0], alert[1])
+    if not candidates:
+        return len(students), []
+
+    unknown = [k for k in candidates if k not in notification_index]
+    if not unknown:
+        return len(students), []
+    sent = set(await db.scalars(select(models.Notification.dedupe_key).where(models.Notification.dedupe_key.in_(unknown))))
+    created_at = to_db_time(now)
+    rows = [
+        dict(student_id=candidates[key][0], category=candidates[key][1], message=candidates[key][2], created_at=created_at, acknowledged=False, dedupe_key=key)
+        for key in unknown if key not in sent
+    ]
+    for key in sent:
+        notification_index.add(key)
+    if not rows:
+        return len(students), []
+    # RETURNING order is not guaranteed for a batched insert; match rows back up by their unique dedupe_key.
+    # A key inserted concurrently since the lookup above is skipped by the conflict clause and returns no id.
+    ids = {key: id for id, key in await db.execute(insert_ignore(db, models.Notification).returning(models.Notification.id, models.Notification.dedupe_key), rows)}
+    notifs = [models.Notification(id=ids[row["dedupe_key"]], **row) for row in rows if row["dedupe_key"] in ids]
+    frames = [notification_frame(n) for n in notifs]
+    after_commit(db, lambda: [notification_index.add(row["dedupe_key"]) for row in rows])
+    bump_versions(db, NOTIFICATIONS, sorted({n.student_id for n in notifs}))
+    after_commit(db, lambda: dispatcher.submit(lambda: ws_manager.send_many(
+        [(n.student_id, f) for n, f in zip(notifs, frames)], {"type": "notifications", "data": [f["data"] for f in frames]})))
+    await commit(db)
+    return len(students), notifs
 
 def seconds_late(actual: datetime, expected: datetime) -> int:
     actual = ensure_kst(actual)
     expected = ensure_kst(expected)
     return int((actual - expected).total_seconds())
+
+ABSENCE_REASON = "무단결석"
+ABSENCE_SEVERITY = 5
+
+# Day-close sweep: every active student without a check-in for date_str is marked absent and gets the
+# 5-장 notice in bulk. Safe to re-run: the attendance upsert is idempotent and existing notices are skipped.
+async def sweep_absences(db: AsyncSession, date_str: Optional[str] = None, source: str = "day_close_sweep") -> dict:
+    started = clock.perf_counter()
+    date_str = date_str or today_kst_str()
+    absent_ids = list(await db.scalars(select(models.Student.id).outerjoin(
+        models.AttendanceRecord,
+        (models.AttendanceRecord.student_id == models.Student.id) & (models.AttendanceRecord.date == date_str)
+    ).where(models.Student.ended == False, models.AttendanceRecord.check_in_time == None)))
+    stats = {"date": date_str, "absent": len(absent_ids), "notices_issued": 0}
+    if absent_ids:
+        upsert = dialect_insert(db, models.AttendanceRecord)
+        await db.execute(upsert.on_conflict_do_update(index_elements=["student_id", "date"], set_={"status": upsert.excluded.status}),
+                   [dict(student_id=student_id, date=date_str, status="absent") for student_id in absent_ids])
+        unknown = [sid for sid in absent_ids if notice_key(sid, date_str, ABSENCE_REASON, ABSENCE_SEVERITY) not in notice_index]
+        issued = set(await db.scalars(select(models.Notice.student_id).where(
+            models.Notice.date == date_str, models.Notice.reason == ABSENCE_REASON, models.Notice.severity == ABSENCE_SEVERITY,
+            models.Notice.student_id.in_(unknown)))) if unknown else set()
+        created_at = to_db_time(datetime.now(KST))
+        rows = [dict(student_id=sid, type="주의장", severity=ABSENCE_SEVERITY, reason=ABSENCE_REASON, source=source, date=date_str, created_at=created_at)
+                for sid in unknown if sid not in issued]
+        # one absence notice per student, so student_id maps RETURNING rows back to their parameters
+        ids = {sid: id for id, sid in await db.execute(insert(models.Notice).returning(models.Notice.id, models.Notice.student_id), rows)} if rows else {}
+        await summary.bump_many(db, [dict(student_id=row["student_id"], date=date_str, notices=1, notice_severity=ABSENCE_SEVERITY) for row in rows])
+        frames = [notice_frame(models.Notice(id=ids[row["student_id"]], **row)) for row in rows]
+        notices = [frame["data"] for frame in frames]
+        stats["notices_issued"] = len(notices)
+        after_commit(db, lambda: [notice_index.add(notice_key(sid, date_str, ABSENCE_REASON, ABSENCE_SEVERITY)) for sid in unknown])
+        bump_versions(db, NOTICES, [row["student_id"] for row in rows])
+        if notices:
+            publish_admins(db, {"type": "absence_sweep", "data": {"date": date_str, "notices": notices}},
+                           [(row["student_id"], frame) for row, frame in zip(rows, frames)])
+        await commit(db)
+    stats["elapsed_ms"] = round((clock.perf_counter() - started) * 1000, 2)
+    logger.info("absence sweep %s", stats)
+    return stats
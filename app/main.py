@@ -1,16 +1,29 @@
-from fastapi import FastAPI, Depends, WebSocket, WebSocketDisconnect, Header, HTTPException
+from fastapi import FastAPI, Depends, WebSocket, WebSocketDisconnect, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from .database import SessionLocal, engine, Base
-from . import models, schemas, crud
-from .logic import KST, today_kst_str, parse_time_str, combine_today_time, tardiness_category, seconds_late, get_or_create_today_attendance, evaluate_all, issue_notice, notify
-from .websockets import ws_manager
-from datetime import datetime, timedelta
-from typing import Optional
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .database import AsyncSessionLocal, engine
+from . import models, schemas, crud, dedupe, events, export, migrations, summary
+from .crud import dialect_insert
+from .logic import KST, today_kst_str, evaluate_all, evaluate_many, issue_notice, sweep_absences
+from .websockets import ws_manager, ENCODERS, parse_topics
+from .broker import make_broker
+from .dispatcher import dispatcher
+from .scheduler import scheduler
+from .eventlog import event_log
+from .livestate import live_state
+from .archive import archive_closed_months, read_events
+from .uow import after_commit, commit, publish, share
+from .timeutil import to_db_time
+from .versions import versions, STUDENT, NOTICES, NOTIFICATIONS
+from datetime import datetime
+from typing import List, Optional
 
 API_KEY = "studyflow-secret"  # replace in production
 
-Base.metadata.create_all(bind=engine)
+# create missing tables and apply pending schema migrations (app/migrations.py)
+migrations.upgrade(engine)
 
 app = FastAPI(title="StudyFlow Integration API", version="1.0.0")
 
@@ -21,198 +34,260 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
-def get_db():
-    db = SessionLocal()
-    try:
+@app.on_event("startup")
+async def warm_dedupe_index():
+    async with AsyncSessionLocal() as db:
+        await dedupe.warm(db)
+
+@app.on_event("startup")
+async def load_live_state():
+    async with AsyncSessionLocal() as db:
+        await live_state.rebuild(db)
+
+@app.on_event("startup")
+async def start_ws_broker():
+    await ws_manager.start(make_broker())
+
+@app.on_event("startup")
+async def start_dispatcher():
+    await dispatcher.start(on_overflow=ws_manager.resync_all)
+
+@app.on_event("startup")
+async def load_ws_roster():
+    # classroom/grade of every student, for routing admin topic subscriptions
+    async with AsyncSessionLocal() as db:
+        ws_manager.load_roster(await db.execute(select(models.Student.id, models.Student.classroom, models.Student.grade)))
+
+@app.on_event("startup")
+async def start_scheduler():
+    # one worker runs the deadlines; the others forward their schedule changes to it over the broker
+    ws_manager.remote_ops["scheduler"] = scheduler.apply
+    await scheduler.start(forward=share)
+
+@app.on_event("startup")
+async def start_event_log():
+    await event_log.start()
+
+@app.on_event("shutdown")
+async def stop_scheduler():
+    await scheduler.stop()
+
+@app.on_event("shutdown")
+async def stop_event_log():
+    await event_log.stop()
+
+@app.on_event("shutdown")
+async def stop_dispatcher():
+    await dispatcher.stop()  # drain queued broadcasts while the broker is still up
+
+@app.on_event("shutdown")
+async def stop_ws_broker():
+    await ws_manager.stop()
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 def verify_api_key(x_api_key: Optional[str] = Header(None)):
     if x_api_key != API_KEY:
         raise HTTPException(status_code=401, detail="Invalid API key")
 
 @app.post("/students", dependencies=[Depends(verify_api_key)])
-def create_or_update_student(payload: schemas.StudentCreate, db: Session = Depends(get_db)):
-    student = crud.upsert_student(db, payload)
+async def create_or_update_student(payload: schemas.StudentCreate, db: AsyncSession = Depends(get_db)):
+    student = await crud.upsert_student(db, payload)
+    after_commit(db, lambda: dispatcher.submit(lambda: ws_manager.update_student(student.id, student.classroom, student.grade)))
+    rec = await crud.get_today_attendance(db, student.id, today_kst_str())
+    if student.ended or (rec and rec.check_in_time):
+        after_commit(db, lambda: scheduler.cancel(("checkin", student.id)))
+    else:
+        after_commit(db, lambda: scheduler.schedule_checkin(student.id, student.expected_check_in))
     # broadcast to both UIs
-    import asyncio
-    asyncio.create_task(ws_manager.send_to_all(student.id, {"type": "student_updated", "data": {
+    publish(db, student.id, {"type": "student_updated", "data": {
         "id": student.id, "name": student.name, "grade": student.grade, "classroom": student.classroom,
         "expected_check_in": student.expected_check_in, "expected_check_out": student.expected_check_out
-    }}))
+    }})
+    await commit(db)
     return {"ok": True, "student": {"id": student.id, "name": student.name, "grade": student.grade, "classroom": student.classroom,
                                      "expected_check_in": student.expected_check_in, "expected_check_out": student.expected_check_out}}
 
 @app.get("/students/{student_id}", response_model=schemas.StudentOut)
-def get_student(student_id: str, db: Session = Depends(get_db)):
-    s = crud.get_student(db, student_id)
+async def get_student(student_id: str, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    if not_modified := versions.not_modified(request, response, STUDENT, student_id):
+        return not_modified
+    s = await crud.get_student(db, student_id)
     if not s:
         raise HTTPException(status_code=404, detail="Student not found")
     return schemas.StudentOut(id=s.id, name=s.name, grade=s.grade, classroom=s.classroom,
                               expected_check_in=s.expected_check_in, expected_check_out=s.expected_check_out)
 
+# each event is one transaction: events.* stages the writes, commit() makes them durable and then broadcasts
 @app.post("/events/dashboard/start", dependencies=[Depends(verify_api_key)])
-async def dashboard_start(ev: schemas.DashboardStart, db: Session = Depends(get_db)):
-    now = ev.timestamp or datetime.now(KST)
-    student = crud.get_student(db, ev.student_id)
-    if not student:
-        raise HTTPException(status_code=404, detail="Student not found")
-    crud.record_event(db, ev.student_id, "dashboard_start", now)
-
-    # attendance record (check-in)
-    rec = get_or_create_today_attendance(db, ev.student_id, now)
-    if not rec.check_in_time:
-        rec.check_in_time = now.astimezone(None)
-        db.commit()
-
-    # evaluate tardiness and issue notice (주의장) on *button press*
-    expected = combine_today_time(parse_time_str(student.expected_check_in), now)
-    diff = seconds_late(now, expected)
-    sev = tardiness_category(diff)
-    if sev:
-        await issue_notice(db, ev.student_id, severity=sev, reason="등원 지각", source="dashboard_start", date_str=today_kst_str(now))
-
-    return {"ok": True, "attendance": {"date": rec.date, "check_in_time": rec.check_in_time}}
+async def dashboard_start(ev: schemas.DashboardStart, db: AsyncSession = Depends(get_db)):
+    result = await events.dashboard_start(db, ev)
+    await commit(db)
+    return result
 
 @app.post("/events/logout", dependencies=[Depends(verify_api_key)])
-async def dashboard_logout(ev: schemas.Logout, db: Session = Depends(get_db)):
-    now = ev.timestamp or datetime.now(KST)
-    student = crud.get_student(db, ev.student_id)
-    if not student:
-        raise HTTPException(status_code=404, detail="Student not found")
-    crud.record_event(db, ev.student_id, "logout", now)
-    # attendance check-out
-    rec = get_or_create_today_attendance(db, ev.student_id, now)
-    rec.check_out_time = now.astimezone(None)
-    db.commit()
-    # broadcast
-    import asyncio
-    asyncio.create_task(ws_manager.send_to_all(ev.student_id, {"type": "logout", "data": {"student_id": ev.student_id, "time": now.isoformat()}}))
-    return {"ok": True}
+async def dashboard_logout(ev: schemas.Logout, db: AsyncSession = Depends(get_db)):
+    result = await events.logout(db, ev)
+    await commit(db)
+    return result
 
 @app.post("/events/outing/request", dependencies=[Depends(verify_api_key)])
-async def outing_request(ev: schemas.OutingRequestIn, db: Session = Depends(get_db)):
-    now = ev.timestamp or datetime.now(KST)
-    crud.record_event(db, ev.student_id, "outing_request", now, payload={"expected_return_time": ev.expected_return_time.isoformat()})
-    req = models.OutingRequest(
-        student_id=ev.student_id, start_time=now.astimezone(None), expected_return_time=ev.expected_return_time.astimezone(None), status="ongoing"
-    )
-    db.add(req)
-    db.commit()
-    db.refresh(req)
-    # broadcast
-    import asyncio
-    asyncio.create_task(ws_manager.send_to_all(ev.student_id, {"type": "outing_request", "data": {
-        "id": req.id, "expected_return_time": ev.expected_return_time.isoformat(), "start_time": now.isoformat()
-    }}))
-    return {"ok": True, "outing_id": req.id}
+async def outing_request(ev: schemas.OutingRequestIn, db: AsyncSession = Depends(get_db)):
+    result = await events.outing_request(db, ev)
+    await commit(db)
+    return result
 
 @app.post("/events/outing/return", dependencies=[Depends(verify_api_key)])
-async def outing_return(ev: schemas.OutingReturnIn, db: Session = Depends(get_db)):
-    now = ev.timestamp or datetime.now(KST)
-    outing = db.query(models.OutingRequest).filter_by(student_id=ev.student_id, status="ongoing").order_by(models.OutingRequest.id.desc()).first()
-    if not outing:
-        raise HTTPException(status_code=404, detail="No ongoing outing request")
-    outing.actual_return_time = now.astimezone(None)
-    outing.status = "completed"
-    db.commit()
-    # evaluate tardiness: *issue notice* on return button
-    diff = int((now - outing.expected_return_time.replace(tzinfo=KST)).total_seconds())
-    if diff > 0:
-        sev = 2 if diff >= 1800 else 1
-        await issue_notice(db, ev.student_id, severity=sev, reason="외출 복귀 지각", source="outing_return", date_str=today_kst_str(now))
-    # broadcast
-    import asyncio
-    asyncio.create_task(ws_manager.send_to_all(ev.student_id, {"type": "outing_return", "data": {
-        "id": outing.id, "actual_return_time": now.isoformat()
-    }}))
-    return {"ok": True}
+async def outing_return(ev: schemas.OutingReturnIn, db: AsyncSession = Depends(get_db)):
+    result = await events.outing_return(db, ev)
+    await commit(db)
+    return result
 
 @app.post("/events/sleep/request", dependencies=[Depends(verify_api_key)])
-async def sleep_request(ev: schemas.SleepRequestIn, db: Session = Depends(get_db)):
-    now = ev.timestamp or datetime.now(KST)
-    crud.record_event(db, ev.student_id, "sleep_request", now, payload={"expected_wake_time": ev.expected_wake_time.isoformat()})
-    req = models.SleepRequest(
-        student_id=ev.student_id, start_time=now.astimezone(None), expected_wake_time=ev.expected_wake_time.astimezone(None), status="ongoing"
-    )
-    db.add(req)
-    db.commit()
-    db.refresh(req)
-    import asyncio
-    asyncio.create_task(ws_manager.send_to_all(ev.student_id, {"type": "sleep_request", "data": {
-        "id": req.id, "expected_wake_time": ev.expected_wake_time.isoformat(), "start_time": now.isoformat()
-    }}))
-    return {"ok": True, "sleep_id": req.id}
+async def sleep_request(ev: schemas.SleepRequestIn, db: AsyncSession = Depends(get_db)):
+    result = await events.sleep_request(db, ev)
+    await commit(db)
+    return result
 
 @app.post("/events/sleep/return", dependencies=[Depends(verify_api_key)])
-async def sleep_return(ev: schemas.SleepReturnIn, db: Session = Depends(get_db)):
-    now = ev.timestamp or datetime.now(KST)
-    sleep = db.query(models.SleepRequest).filter_by(student_id=ev.student_id, status="ongoing").order_by(models.SleepRequest.id.desc()).first()
-    if not sleep:
-        raise HTTPException(status_code=404, detail="No ongoing sleep request")
-    sleep.actual_wake_time = now.astimezone(None)
-    sleep.status = "completed"
-    db.commit()
-    # Only notification, no notice
-    diff = int((now - sleep.expected_wake_time.replace(tzinfo=KST)).total_seconds())
-    if diff > 0:
-        msg = f"[수면 복귀 지연] {diff}초 지연되었습니다."
-        await notify(db, ev.student_id, "late-sleep-wake", msg, dedupe_key=f"sleep-return:{sleep.id}")
-    import asyncio
-    asyncio.create_task(ws_manager.send_to_all(ev.student_id, {"type": "sleep_return", "data": {
-        "id": sleep.id, "actual_wake_time": now.isoformat()
-    }}))
-    return {"ok": True}
+async def sleep_return(ev: schemas.SleepReturnIn, db: AsyncSession = Depends(get_db)):
+    result = await events.sleep_return(db, ev)
+    await commit(db)
+    return result
 
 @app.post("/events/focus/start", dependencies=[Depends(verify_api_key)])
-async def focus_start(ev: schemas.FocusStartIn, db: Session = Depends(get_db)):
-    now = ev.timestamp or datetime.now(KST)
-    sess = models.FocusSession(student_id=ev.student_id, start_time=now.astimezone(None), metadata=ev.meta or {})
-    db.add(sess)
-    db.commit()
-    db.refresh(sess)
-    crud.record_event(db, ev.student_id, "focus_start", now, payload={"focus_session_id": sess.id})
-    import asyncio
-    asyncio.create_task(ws_manager.send_to_all(ev.student_id, {"type": "focus_start", "data": {"id": sess.id, "start_time": now.isoformat()}}))
-    return {"ok": True, "focus_session_id": sess.id}
+async def focus_start(ev: schemas.FocusStartIn, db: AsyncSession = Depends(get_db)):
+    result = await events.focus_start(db, ev)
+    await commit(db)
+    return result
 
 @app.post("/events/focus/stop", dependencies=[Depends(verify_api_key)])
-async def focus_stop(ev: schemas.FocusStopIn, db: Session = Depends(get_db)):
-    now = ev.timestamp or datetime.now(KST)
-    sess = db.query(models.FocusSession).filter_by(student_id=ev.student_id).order_by(models.FocusSession.id.desc()).first()
-    if not sess or sess.end_time:
-        raise HTTPException(status_code=404, detail="No active focus session")
-    sess.end_time = now.astimezone(None)
-    sess.duration_seconds = int((sess.end_time - sess.start_time).total_seconds())
-    db.commit()
-    crud.record_event(db, ev.student_id, "focus_stop", now, payload={"focus_session_id": sess.id, "duration": sess.duration_seconds})
-    import asyncio
-    asyncio.create_task(ws_manager.send_to_all(ev.student_id, {"type": "focus_stop", "data": {
-        "id": sess.id, "end_time": now.isoformat(), "duration_seconds": sess.duration_seconds
-    }}))
-    return {"ok": True, "duration_seconds": sess.duration_seconds}
+async def focus_stop(ev: schemas.FocusStopIn, db: AsyncSession = Depends(get_db)):
+    result = await events.focus_stop(db, ev)
+    await commit(db)
+    return result
+
+# offline kiosk sync: a JSON array or NDJSON of {"type": "outing_request", "student_id": ..., "timestamp": ..., ...};
+# one transaction per student, results in the submitted order
+@app.post("/events/batch", dependencies=[Depends(verify_api_key)])
+async def events_batch(request: Request, db: AsyncSession = Depends(get_db)):
+    try:
+        items = events.read_batch(await request.body(), request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"malformed batch: {e}")
+    if len(items) > events.MAX_BATCH_EVENTS:
+        raise HTTPException(status_code=413, detail=f"at most {events.MAX_BATCH_EVENTS} events per batch")
+    results = await events.apply_batch(db, items)
+    applied = sum(1 for r in results if r["ok"])
+    return {"applied": applied, "rejected": len(results) - applied, "results": results}
 
 @app.post("/evaluate", dependencies=[Depends(verify_api_key)])
-async def evaluate(payload: schemas.EvaluateIn, db: Session = Depends(get_db)):
+async def evaluate(payload: schemas.EvaluateIn, db: AsyncSession = Depends(get_db)):
     await evaluate_all(db, payload.student_id)
+    await commit(db)
     return {"ok": True}
 
+@app.post("/evaluate/all", dependencies=[Depends(verify_api_key)])
+async def evaluate_everyone(payload: Optional[schemas.EvaluateManyIn] = None, db: AsyncSession = Depends(get_db)):
+    evaluated, created = await evaluate_many(db, payload.student_ids if payload else None)
+    return {"ok": True, "evaluated": evaluated, "notified": len(created)}
+
+@app.get("/students/{student_id}/events", response_model=list[schemas.EventLogOut], dependencies=[Depends(verify_api_key)])
+async def list_student_events(student_id: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                              type: Optional[List[str]] = Query(None), db: AsyncSession = Depends(get_db)):
+    # event log across the hot table and archived months
+    return [schemas.EventLogOut(**row) for row in await read_events(db, student_id, since, until, type)]
+
+@app.get("/students/{student_id}/state")
+async def student_state(student_id: str):
+    # answered from live_state, no query: today's attendance and the ongoing outing/sleep/focus session
+    return live_state.view(student_id).as_dict() | {"student_id": student_id}
+
+@app.get("/students/{student_id}/summary", response_model=schemas.StudentSummaryOut)
+async def student_summary(student_id: str, date_from: Optional[str] = Query(None, alias="from"), date_to: Optional[str] = Query(None, alias="to"),
+                          db: AsyncSession = Depends(get_db)):
+    # reads only daily_student_summary rows; from/to are KST dates (YYYY-MM-DD), both inclusive
+    rows = await summary.read(db, student_id, date_from, date_to)
+    days = [schemas.DailySummaryOut(date=r.date, **{k: getattr(r, k) for k in summary.COUNTERS}) for r in rows]
+    return schemas.StudentSummaryOut(student_id=student_id, days=days,
+                                     totals={k: sum(getattr(r, k) for r in rows) for k in summary.COUNTERS})
+
+@app.post("/students/summary/rebuild", dependencies=[Depends(verify_api_key)])
+async def rebuild_summary(date_from: str = Query(..., alias="from"), date_to: str = Query(..., alias="to"), db: AsyncSession = Depends(get_db)):
+    return {"ok": True, "stats": await summary.rebuild(db, date_from, date_to)}
+
+@app.post("/events/archive", dependencies=[Depends(verify_api_key)])
+async def archive_event_logs():
+    stats = await archive_closed_months()
+    scheduler.archive_history.append(stats)
+    return {"ok": True, "stats": stats}
+
+# reporting exports, streamed (app/export.py); from/to are KST dates (YYYY-MM-DD), both inclusive
+def _export(name: str, fmt: str, date_from: str, date_to: str, body) -> StreamingResponse:
+    if fmt not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {sorted(export.FORMATS)}")
+    try:
+        export.bounds(date_from, date_to)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="from/to must be YYYY-MM-DD")
+    return StreamingResponse(body(fmt), media_type=export.FORMATS[fmt],
+                             headers={"Content-Disposition": f'attachment; filename="{name}-{date_from}-{date_to}.{fmt}"'})
+
+@app.get("/export/events", dependencies=[Depends(verify_api_key)])
+async def export_events(date_from: str = Query(..., alias="from"), date_to: str = Query(..., alias="to"), format: str = "ndjson",
+                        student_id: Optional[str] = None, classroom: Optional[str] = None, type: Optional[List[str]] = Query(None)):
+    # event log across archived months and the hot table
+    return _export("events", format, date_from, date_to,
+                   lambda fmt: export.export_events(fmt, date_from, date_to, student_id, classroom, type))
+
+@app.get("/export/attendance", dependencies=[Depends(verify_api_key)])
+async def export_attendance(date_from: str = Query(..., alias="from"), date_to: str = Query(..., alias="to"), format: str = "ndjson",
+                            student_id: Optional[str] = None, classroom: Optional[str] = None):
+    return _export("attendance", format, date_from, date_to,
+                   lambda fmt: export.export_attendance(fmt, date_from, date_to, student_id, classroom))
+
+def _notice_out(i: models.Notice) -> schemas.NoticeOut:
+    return schemas.NoticeOut(
+        id=i.id, student_id=i.student_id, type=i.type, severity=i.severity, reason=i.reason,
+        source=i.source, date=i.date, created_at=i.created_at
+    )
+
+def _set_cursor(response: Response, next_cursor: Optional[int]):
+    # pass X-Next-Cursor back as ?before= for the next page; absent on the last page
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+
+@app.get("/notices", response_model=list[schemas.NoticeOut], dependencies=[Depends(verify_api_key)])
+async def list_all_notices(response: Response, before: Optional[int] = None, limit: int = Query(crud.PAGE_SIZE, ge=1, le=crud.MAX_PAGE_SIZE),
+                           since: Optional[datetime] = None, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                           severity: Optional[int] = None, student_id: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    items, next_cursor = await crud.list_notices(db, student_id, before, limit, to_db_time(since), date_from, date_to, severity)
+    _set_cursor(response, next_cursor)
+    return [_notice_out(i) for i in items]
+
 @app.get("/notices/{student_id}", response_model=list[schemas.NoticeOut])
-def list_notices(student_id: str, db: Session = Depends(get_db)):
-    items = crud.list_notices(db, student_id)
-    return [
-        schemas.NoticeOut(
-            id=i.id, student_id=i.student_id, type=i.type, severity=i.severity, reason=i.reason,
-            source=i.source, date=i.date, created_at=i.created_at
-        ) for i in items
-    ]
+async def list_notices(student_id: str, request: Request, response: Response, before: Optional[int] = None, limit: int = Query(crud.PAGE_SIZE, ge=1, le=crud.MAX_PAGE_SIZE),
+                       since: Optional[datetime] = None, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                       severity: Optional[int] = None, db: AsyncSession = Depends(get_db)):
+    if not_modified := versions.not_modified(request, response, NOTICES, student_id):
+        return not_modified
+    items, next_cursor = await crud.list_notices(db, student_id, before, limit, to_db_time(since), date_from, date_to, severity)
+    _set_cursor(response, next_cursor)
+    return [_notice_out(i) for i in items]
 
 @app.get("/notifications/{student_id}", response_model=list[schemas.NotificationOut])
-def list_notifications(student_id: str, db: Session = Depends(get_db)):
-    items = crud.list_notifications(db, student_id)
+async def list_notifications(student_id: str, request: Request, response: Response, before: Optional[int] = None, limit: int = Query(crud.PAGE_SIZE, ge=1, le=crud.MAX_PAGE_SIZE),
+                             since: Optional[datetime] = None, category: Optional[str] = None, acknowledged: Optional[bool] = None,
+                             db: AsyncSession = Depends(get_db)):
+    if not_modified := versions.not_modified(request, response, NOTIFICATIONS, student_id):
+        return not_modified
+    items, next_cursor = await crud.list_notifications(db, student_id, before, limit, to_db_time(since), category, acknowledged)
+    _set_cursor(response, next_cursor)
     return [
         schemas.NotificationOut(
             id=i.id, student_id=i.student_id, category=i.category, message=i.message,
@@ -220,37 +295,56 @@ def list_notifications(student_id: str, db: Session = Depends(get_db)):
         ) for i in items
     ]
 
+@app.get("/ws/stats", dependencies=[Depends(verify_api_key)])
+async def websocket_stats():
+    return {"counts": ws_manager.counts(), "stats": ws_manager.stats, "dispatcher": dispatcher.snapshot()}
+
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, student_id: Optional[str] = None, role: Optional[str] = None):
+async def websocket_endpoint(websocket: WebSocket, student_id: Optional[str] = None, role: Optional[str] = None, encoding: str = "json",
+                             topics: Optional[str] = None, batch_ms: int = 0, since: Optional[int] = None, epoch: Optional[str] = None):
     try:
+        try:
+            # admins may subscribe at connect time: ?topics=classroom:3A,type:notice
+            initial_topics = parse_topics(topics.split(",")) if topics else set()
+        except ValueError:
+            initial_topics = None
+        if encoding not in ENCODERS or initial_topics is None:
+            await websocket.accept()
+            await websocket.close(code=4000)
+            return
         if role == "admin":
-            await ws_manager.connect_admin(websocket)
+            await ws_manager.connect_admin(websocket, encoding, initial_topics, batch_ms, since, epoch)
         elif student_id:
-            await ws_manager.connect_student(student_id, websocket)
+            await ws_manager.connect_student(student_id, websocket, encoding, since, epoch)
         else:
             await websocket.accept()
             await websocket.close(code=4000)
             return
 
         while True:
-            # keep alive; echo pings if desired
-            await websocket.receive_text()
+            # pongs and other client messages keep the connection alive; admins also (un)subscribe here
+            ws_manager.handle_message(websocket, await websocket.receive_text())
     except WebSocketDisconnect:
         ws_manager.disconnect(websocket)
 
 
 @app.post("/events/attendance/mark_absent", dependencies=[Depends(verify_api_key)])
-async def mark_absent(student_id: str, date_str: Optional[str] = None, db: Session = Depends(get_db)):
+async def mark_absent(student_id: str, date_str: Optional[str] = None, db: AsyncSession = Depends(get_db)):
     now = datetime.now(KST)
     date_str = date_str or now.date().isoformat()
-    # ensure record exists
-    rec = db.query(models.AttendanceRecord).filter_by(student_id=student_id, date=date_str).first()
-    if not rec:
-        rec = models.AttendanceRecord(student_id=student_id, date=date_str, status="absent")
-        db.add(rec)
-    else:
-        rec.status = "absent"
-    db.commit()
+    upsert = dialect_insert(db, models.AttendanceRecord).values(student_id=student_id, date=date_str, status="absent")
+    await db.execute(upsert.on_conflict_do_update(index_elements=["student_id", "date"], set_={"status": upsert.excluded.status}))
     # issue notice 5장
     await issue_notice(db, student_id, severity=5, reason="무단결석", source="admin_mark_absent", date_str=date_str)
+    await commit(db)
     return {"ok": True, "date": date_str}
+
+@app.post("/events/attendance/sweep", dependencies=[Depends(verify_api_key)])
+async def sweep_absent(date_str: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    stats = await sweep_absences(db, date_str, source="admin_sweep")
+    scheduler.sweep_history.append(stats)
+    return {"ok": True, "stats": stats}
+
+@app.get("/events/attendance/sweep", dependencies=[Depends(verify_api_key)])
+async def sweep_history():
+    return {"runs": list(scheduler.sweep_history)}
@@ -0,0 +1,107 @@
+import logging
+import sys
+from datetime import datetime
+from typing import Callable, List, Tuple
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from . import models
+from .database import Base, engine
+
+logger = logging.getLogger("studyflow.migrations")
+
+# Versioned schema steps for databases created by an older models.py. create_all() only creates missing
+# tables, so every change to an existing table (new column, new index) is also listed here. Steps must be
+# idempotent: on a fresh database create_all() has already done the work and the step only gets recorded.
+
+schema_migrations = Table(
+    "schema_migrations", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+def _add_column(conn: Connection, table: str, ddl: str):
+    name = ddl.split()[0]
+    if name not in {c["name"] for c in inspect(conn).get_columns(table)}:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {ddl}"))
+
+def _create_indexes(*names: str) -> Callable[[Connection], None]:
+    def step(conn: Connection):
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name in names:
+                    index.create(conn, checkfirst=True)
+    return step
+
+def _drop_sqlite_indexes(*names: str) -> Callable[[Connection], None]:
+    # indexes the models now only declare for other backends (Index.ddl_if)
+    def step(conn: Connection):
+        if conn.dialect.name == "sqlite":
+            for name in names:
+                conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    return step
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "students.ended", lambda conn: _add_column(conn, "students", "ended BOOLEAN DEFAULT FALSE")),
+    (2, "hot lookup indexes", _create_indexes(
+        "ix_outing_requests_ongoing", "ix_sleep_requests_ongoing", "ix_focus_sessions_student_latest",
+        "ix_notices_student_date_reason_severity", "ix_notifications_student_latest")),
+    (3, "listing pagination indexes", _create_indexes("ix_notices_student_latest", "ix_notifications_student_acknowledged")),
+    (4, "event log range index", _create_indexes("ix_event_logs_timestamp_id")),
+    (5, "drop redundant focus index on sqlite", _drop_sqlite_indexes("ix_focus_sessions_student_latest")),
+]
+
+def pending(conn: Connection) -> List[Tuple[int, str, Callable[[Connection], None]]]:
+    schema_migrations.create(conn, checkfirst=True)
+    applied = set(conn.scalars(select(schema_migrations.c.version)))
+    return [m for m in MIGRATIONS if m[0] not in applied]
+
+def upgrade(eng: Engine = engine) -> List[int]:
+    # one transaction: create_all for new tables, then every pending step in version order
+    with eng.begin() as conn:
+        Base.metadata.create_all(bind=conn)
+        done = []
+        for version, name, step in pending(conn):
+            step(conn)
+            conn.execute(schema_migrations.insert().values(version=version, name=name, applied_at=datetime.utcnow()))
+            logger.info("applied migration %d: %s", version, name)
+            done.append(version)
+    return done
+
+# EXPLAIN QUERY PLAN for the hot lookups (SQLite only), to check they are served by the indexes above;
+# tests/test_migrations.py fails when one of them falls back to a table scan
+HOT_QUERIES = {
+    "latest ongoing outing": select(models.OutingRequest.id).filter_by(student_id="S", status="ongoing").order_by(models.OutingRequest.id.desc()).limit(1),
+    "latest ongoing sleep": select(models.SleepRequest.id).filter_by(student_id="S", status="ongoing").order_by(models.SleepRequest.id.desc()).limit(1),
+    "latest focus session": select(models.FocusSession.id).filter_by(student_id="S").order_by(models.FocusSession.id.desc()).limit(1),
+    "notice dedupe": select(models.Notice.id).filter_by(student_id="S", date="2024-01-01", reason="등원 지각", severity=1).limit(1),
+    "notifications by student": select(models.Notification.id).filter_by(student_id="S").where(models.Notification.id < 100).order_by(models.Notification.id.desc()).limit(51),
+    "unread notifications": select(models.Notification.id).filter_by(student_id="S", acknowledged=False).order_by(models.Notification.id.desc()).limit(51),
+    "notices by student": select(models.Notice.id).filter_by(student_id="S").where(models.Notice.id < 100).order_by(models.Notice.id.desc()).limit(51),
+    "notices, all students": select(models.Notice.id).where(models.Notice.id < 100).order_by(models.Notice.id.desc()).limit(51),
+    "event log export": select(models.EventLog.id, models.EventLog.payload).where(models.EventLog.timestamp >= datetime(2024, 1, 1),
+        models.EventLog.timestamp < datetime(2024, 2, 1)).order_by(models.EventLog.timestamp, models.EventLog.id),
+}
+
+def explain(eng: Engine = engine) -> dict:
+    plans = {}
+    with eng.connect() as conn:
+        for label, stmt in HOT_QUERIES.items():
+            compiled = stmt.compile(conn)
+            rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", tuple(compiled.params[k] for k in compiled.positiontup))
+            plans[label] = [row[-1] for row in rows]
+    return plans
+
+if __name__ == "__main__":
+    # python -m app.migrations [status|upgrade|explain]
+    logging.basicConfig(level=logging.INFO)
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    if cmd == "status":
+        with engine.begin() as conn:
+            for version, name, _ in pending(conn):
+                print(f"pending {version}: {name}")
+    elif cmd == "explain":
+        for label, plan in explain().items():
+            print(f"{label}: {' / '.join(plan)}")
+    else:
+        print("applied:", upgrade() or "nothing to do")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Time, JSON, UniqueConstraint, Text
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Time, JSON, UniqueConstraint, Text, Index, text
 from sqlalchemy.orm import relationship
 from .database import Base
 from datetime import datetime
@@ -40,6 +40,10 @@ class OutingRequest(Base):
     actual_return_time = Column(DateTime, nullable=True)
     status = Column(String, default="ongoing")  # ongoing/completed/cancelled
 
+    # latest ongoing outing per student. Partial on SQLite so completed rows never enter the index; full on
+    # PostgreSQL, where a generic plan with status bound as a parameter could not prove the predicate.
+    __table_args__ = (Index("ix_outing_requests_ongoing", "student_id", "status", "id", sqlite_where=text("status = 'ongoing'")),)
+
 class SleepRequest(Base):
     __tablename__ = "sleep_requests"
     id = Column(Integer, primary_key=True, index=True)
@@ -49,6 +53,8 @@ class SleepRequest(Base):
     actual_wake_time = Column(DateTime, nullable=True)
     status = Column(String, default="ongoing")  # ongoing/completed/cancelled
 
+    __table_args__ = (Index("ix_sleep_requests_ongoing", "student_id", "status", "id", sqlite_where=text("status = 'ongoing'")),)
+
 class FocusSession(Base):
     __tablename__ = "focus_sessions"
     session_metadata = Column(JSON)
@@ -59,6 +65,10 @@ class FocusSession(Base):
     duration_seconds = Column(Integer, nullable=True)
     meta_data = Column(JSON, nullable=True)
 
+    # latest session per student, for PostgreSQL only: SQLite already gets the id order from the rowid in
+    # ix_focus_sessions_student_id, and its planner keeps using that index
+    __table_args__ = (Index("ix_focus_sessions_student_latest", "student_id", "id").ddl_if(dialect="postgresql"),)
+
 class Notice(Base):
     __tablename__ = "notices"
     id = Column(Integer, primary_key=True, index=True)
@@ -70,6 +80,10 @@ class Notice(Base):
     date = Column(String, index=True)        # YYYY-MM-DD (KST)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    # issue_notice() dedupe lookup, and a student's notices newest first (keyset pagination on id)
+    __table_args__ = (Index("ix_notices_student_date_reason_severity", "student_id", "date", "reason", "severity"),
+                      Index("ix_notices_student_latest", "student_id", "id"))
+
 class Notification(Base):
     __tablename__ = "notifications"
     id = Column(Integer, primary_key=True, index=True)
@@ -80,7 +94,9 @@ class Notification(Base):
     acknowledged = Column(Boolean, default=False)
     # for dedupe
     dedupe_key = Column(String, index=True, nullable=True)
-    __table_args__ = (UniqueConstraint('dedupe_key', name='_notif_dedupe_uc'),)
+    __table_args__ = (UniqueConstraint('dedupe_key', name='_notif_dedupe_uc'),
+                      Index("ix_notifications_student_latest", "student_id", "id"),
+                      Index("ix_notifications_student_acknowledged", "student_id", "acknowledged", "id"))
 
 class EventLog(Base):
     __tablename__ = "event_logs"
@@ -89,3 +105,25 @@ class EventLog(Base):
     type = Column(String, index=True, nullable=False)
     timestamp = Column(DateTime, nullable=False)
     payload = Column(JSON, nullable=True)
+
+    # range scans in timestamp order: exports, monthly archival
+    __table_args__ = (Index("ix_event_logs_timestamp_id", "timestamp", "id"),)
+
+# Per-student, per-KST-day figures maintained incrementally in the same transaction as the events that change
+# them (app/summary.py); `python -m app.summary rebuild` recomputes them from the source tables.
+class DailyStudentSummary(Base):
+    __tablename__ = "daily_student_summary"
+    id = Column(Integer, primary_key=True, index=True)
+    student_id = Column(String, nullable=False)
+    date = Column(String, nullable=False)  # YYYY-MM-DD (KST)
+    focus_seconds = Column(Integer, nullable=False, default=0)
+    focus_sessions = Column(Integer, nullable=False, default=0)
+    outings = Column(Integer, nullable=False, default=0)
+    outing_late_seconds = Column(Integer, nullable=False, default=0)
+    sleeps = Column(Integer, nullable=False, default=0)
+    sleep_late_seconds = Column(Integer, nullable=False, default=0)
+    checkin_late_seconds = Column(Integer, nullable=False, default=0)
+    notices = Column(Integer, nullable=False, default=0)
+    notice_severity = Column(Integer, nullable=False, default=0)  # sum of severities (장 수)
+
+    __table_args__ = (UniqueConstraint('student_id', 'date', name='_summary_student_date_uc'),)
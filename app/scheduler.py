@@ -0,0 +1,243 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+from collections import deque
+from datetime import datetime, timedelta
+from typing import IO, Callable, Dict, Hashable, List, Optional, Tuple
+from sqlalchemy import select
+from . import models
+from .archive import ARCHIVE_DIR, archive_closed_months
+from .cache import student_cache
+from .database import AsyncSessionLocal
+from .logic import evaluate_checkin_notifications, evaluate_outing_notifications, evaluate_sleep_notifications, sweep_absences
+from .timeutil import KST, today_kst_str, parse_time_str, combine_today_time, ensure_kst, from_db_time
+from .uow import commit
+
+logger = logging.getLogger(__name__)
+
+TIER2_SECONDS = 30 * 60
+MAX_SLEEP_SECONDS = 60  # re-check the wall clock at least this often
+# KST time of the automatic day-close sweep (students without a check-in by then are marked absent and get the
+# 5-장 notice), e.g. 23:50:00; empty = no automatic sweep, only POST /events/attendance/sweep
+DAY_CLOSE = os.environ.get("STUDYFLOW_DAY_CLOSE", "")
+# held by the one worker that runs the deadlines; any path all the workers of one deployment share
+SCHEDULER_LOCK = os.environ.get("STUDYFLOW_SCHEDULER_LOCK", os.path.join(ARCHIVE_DIR, "scheduler.lock"))
+
+# Fires lateness notifications when a deadline passes instead of waiting for clients to poll /evaluate.
+# Deadlines sit in a min-heap; rescheduling or cancelling a key bumps its generation so stale
+# heap entries are skipped when they surface rather than searched for and removed.
+#
+# Under several workers only the one holding the scheduler lock runs deadlines, the day-close sweep and the
+# monthly archival; the others keep trying to take the lock over in case that worker goes away. A worker that
+# does not hold it forwards its schedule()/cancel() calls to the one that does (op "scheduler", apply()).
+class DeadlineScheduler:
+    def __init__(self, lock_path: str = SCHEDULER_LOCK, day_close: str = DAY_CLOSE):
+        self._heap: List[Tuple[datetime, int, Hashable, str, str]] = []
+        # key -> (generation, pending entry count)
+        self._live: Dict[Hashable, Tuple[int, int]] = {}
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.sweep_history: deque = deque(maxlen=30)  # stats of recent day-close sweeps
+        self.archive_history: deque = deque(maxlen=12)  # stats of recent monthly event log archivals
+        self.lock_path = lock_path
+        self.day_close = day_close
+        self._lock: Optional[IO] = None
+        self._forward: Optional[Callable[[dict], None]] = None  # set by start()
+
+    def __len__(self):
+        return len(self._live)
+
+    @property
+    def leading(self) -> bool:
+        return self._lock is not None
+
+    def _follow(self, envelope: dict) -> bool:
+        if self._forward is None or self.leading:
+            return False
+        self._forward({"op": "scheduler", **envelope})
+        return True
+
+    def apply(self, envelope: dict):
+        # a schedule change forwarded by another worker; only the leading one keeps it
+        if not self.leading:
+            return
+        key = tuple(envelope["key"])
+        if envelope["call"] == "schedule":
+            self.schedule(key, envelope["kind"], envelope["student_id"], [datetime.fromisoformat(d) for d in envelope["deadlines"]])
+        elif envelope["call"] == "cancel":
+            self.cancel(key)
+        else:
+            logger.warning("unknown scheduler call %r", envelope["call"])
+
+    def schedule(self, key: Hashable, kind: str, student_id: str, deadlines: List[datetime], now: Optional[datetime] = None):
+        if self._follow({"call": "schedule", "key": list(key), "kind": kind, "student_id": student_id,
+                         "deadlines": [ensure_kst(d).isoformat() for d in deadlines]}):
+            return
+        now = now or datetime.now(KST)
+        self.cancel(key)
+        # deadlines already in the past collapse into one immediate evaluation
+        due = sorted({d if d > now else now for d in (ensure_kst(d) for d in deadlines)})
+        if not due:
+            return
+        gen = next(self._seq)
+        self._live[key] = (gen, len(due))
+        for when in due:
+            heapq.heappush(self._heap, (when, gen, key, kind, student_id))
+        if self._wakeup and self._heap[0][1] == gen:
+            self._wakeup.set()
+
+    def cancel(self, key: Hashable):
+        if not self._follow({"call": "cancel", "key": list(key)}):
+            self._live.pop(key, None)
+
+    def schedule_checkin(self, student_id: str, expected_check_in: str, now: Optional[datetime] = None):
+        now = now or datetime.now(KST)
+        expected = combine_today_time(parse_time_str(expected_check_in), now)
+        self.schedule(("checkin", student_id), "checkin", student_id,
+                      [expected + timedelta(seconds=1), expected + timedelta(seconds=TIER2_SECONDS)], now)
+
+    def schedule_outing(self, outing_id: int, student_id: str, expected_return_time: datetime, now: Optional[datetime] = None):
+        expected = ensure_kst(expected_return_time)
+        self.schedule(("outing", outing_id), "outing", student_id,
+                      [expected + timedelta(seconds=1), expected + timedelta(seconds=TIER2_SECONDS)], now)
+
+    def schedule_sleep(self, sleep_id: int, student_id: str, expected_wake_time: datetime, now: Optional[datetime] = None):
+        self.schedule(("sleep", sleep_id), "sleep", student_id, [ensure_kst(expected_wake_time) + timedelta(seconds=1)], now)
+
+    def _schedule_rollover(self, now: datetime):
+        midnight = datetime(now.year, now.month, now.day, tzinfo=KST) + timedelta(days=1)
+        self.schedule(("rollover",), "rollover", "", [midnight], now)
+        if self.day_close:
+            self.schedule(("dayclose",), "dayclose", "", [combine_today_time(parse_time_str(self.day_close), now)], now)
+
+    async def rebuild(self, now: Optional[datetime] = None):
+        now = now or datetime.now(KST)
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(select(models.Student.id, models.Student.expected_check_in, models.AttendanceRecord.check_in_time).outerjoin(
+                models.AttendanceRecord,
+                (models.AttendanceRecord.student_id == models.Student.id) & (models.AttendanceRecord.date == today_kst_str(now))
+            ).where(models.Student.ended == False))).all()
+            outings = (await db.scalars(select(models.OutingRequest).filter_by(status="ongoing"))).all()
+            sleeps = (await db.scalars(select(models.SleepRequest).filter_by(status="ongoing"))).all()
+        # rescheduling a key supersedes its old entries, so nothing scheduled meanwhile by an endpoint is lost
+        for student_id, expected_check_in, check_in_time in rows:
+            if not check_in_time and expected_check_in:
+                self.schedule_checkin(student_id, expected_check_in, now)
+        for o in outings:
+            self.schedule_outing(o.id, o.student_id, from_db_time(o.expected_return_time), now)
+        for s in sleeps:
+            self.schedule_sleep(s.id, s.student_id, from_db_time(s.expected_wake_time), now)
+        self._schedule_rollover(now)
+        if self._wakeup:
+            self._wakeup.set()
+
+    def _take_lock(self) -> bool:
+        # non-blocking; the OS releases the lock when its holder exits, however it exits
+        os.makedirs(os.path.dirname(self.lock_path) or ".", exist_ok=True)
+        f = open(self.lock_path, "a+")
+        try:
+            if os.name == "nt":
+                import msvcrt
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._lock = f
+        return True
+
+    async def start(self, forward: Optional[Callable[[dict], None]] = None):
+        # forward: sends a schedule change to the other workers (for the one holding the lock)
+        if self._task:
+            return
+        self._wakeup = asyncio.Event()
+        self._forward = forward
+        if self._take_lock():
+            await self.rebuild()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if not self._task:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._wakeup = None
+        self._forward = None
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+
+    def _pop_due(self, now: datetime) -> List[Tuple[str, str]]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, gen, key, kind, student_id = heapq.heappop(self._heap)
+            live = self._live.get(key)
+            if not live or live[0] != gen:
+                continue  # cancelled or rescheduled
+            if live[1] <= 1:
+                del self._live[key]
+            else:
+                self._live[key] = (gen, live[1] - 1)
+            due.append((kind, student_id))
+        return due
+
+    async def _fire(self, kind: str, student_id: str, now: datetime):
+        if kind == "rollover":
+            student_cache.roll_over(now)
+            await self.rebuild(now)
+            if now.day == 1:
+                self.archive_history.append(await archive_closed_months(now))
+            return
+        async with AsyncSessionLocal() as db:
+            if kind == "dayclose":
+                self.sweep_history.append(await sweep_absences(db, today_kst_str(now)))
+            elif kind == "checkin":
+                student = await student_cache.get(db, student_id)
+                if student:
+                    await evaluate_checkin_notifications(db, student, now)
+            elif kind == "outing":
+                await evaluate_outing_notifications(db, student_id, now)
+            elif kind == "sleep":
+                await evaluate_sleep_notifications(db, student_id, now)
+            await commit(db)
+
+    async def _run(self):
+        while True:
+            if not self.leading:
+                await asyncio.sleep(MAX_SLEEP_SECONDS)
+                if self._take_lock():
+                    logger.info("scheduler lock %s taken over; running the deadlines here", self.lock_path)
+                    try:
+                        await self.rebuild()
+                    except Exception:
+                        logger.exception("scheduler rebuild failed; releasing %s", self.lock_path)
+                        self._lock.close()
+                        self._lock = None
+                continue
+            now = datetime.now(KST)
+            for kind, student_id in self._pop_due(now):
+                try:
+                    await self._fire(kind, student_id, now)
+                except Exception:
+                    logger.exception("deadline %s for %s failed", kind, student_id)
+            self._wakeup.clear()
+            delay = MAX_SLEEP_SECONDS
+            if self._heap:
+                delay = min(delay, max((self._heap[0][0] - datetime.now(KST)).total_seconds(), 0))
+            if delay <= 0:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+scheduler = DeadlineScheduler()
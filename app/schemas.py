@@ -42,6 +42,30 @@ class NotificationOut(BaseModel):
     created_at: datetime
     acknowledged: bool
 
+class EventLogOut(BaseModel):
+    id: int
+    student_id: str
+    type: str
+    timestamp: datetime
+    payload: Optional[dict]
+
+class DailySummaryOut(BaseModel):
+    date: str
+    focus_seconds: int
+    focus_sessions: int
+    outings: int
+    outing_late_seconds: int
+    sleeps: int
+    sleep_late_seconds: int
+    checkin_late_seconds: int
+    notices: int
+    notice_severity: int
+
+class StudentSummaryOut(BaseModel):
+    student_id: str
+    days: List[DailySummaryOut]
+    totals: dict
+
 class EventBase(BaseModel):
     student_id: str
     timestamp: Optional[datetime] = None
@@ -72,3 +96,6 @@ class FocusStopIn(EventBase):
 
 class EvaluateIn(BaseModel):
     student_id: str
+
+class EvaluateManyIn(BaseModel):
+    student_ids: Optional[List[str]] = None  # None = every active student
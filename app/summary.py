@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import sys
+import time as clock
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import and_, delete, insert, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models
+from .crud import dialect_insert
+from .database import AsyncSessionLocal, async_engine
+from .timeutil import KST, parse_time_str, combine_today_time, from_db_time, to_db_time
+
+logger = logging.getLogger("studyflow.summary")
+
+Summary = models.DailyStudentSummary
+COUNTERS = ("focus_seconds", "focus_sessions", "outings", "outing_late_seconds", "sleeps", "sleep_late_seconds",
+            "checkin_late_seconds", "notices", "notice_severity")
+
+# Incremental maintenance: every write path adds its deltas to the (student_id, date) row with one upsert in the
+# caller's transaction, so the summary commits or rolls back together with the event itself.
+def _upsert(db: AsyncSession, keys):
+    stmt = dialect_insert(db, Summary)
+    return stmt.on_conflict_do_update(index_elements=["student_id", "date"],
+                                      set_={k: getattr(Summary, k) + stmt.excluded[k] for k in keys})
+
+async def bump(db: AsyncSession, student_id: str, date_str: str, **deltas: int):
+    await db.execute(_upsert(db, deltas).values(student_id=student_id, date=date_str, **deltas))
+
+async def bump_many(db: AsyncSession, rows: List[dict]):
+    # rows share one set of counter keys, e.g. the absence sweep's notices
+    if rows:
+        await db.execute(_upsert(db, [k for k in rows[0] if k in COUNTERS]), rows)
+
+# DateTime columns hold naive server-local time (timeutil.to_db_time); days and deadlines are KST
+
+def _day(ts: datetime) -> str:
+    return from_db_time(ts).date().isoformat()
+
+def _late(actual: Optional[datetime], expected: datetime) -> int:
+    # expected: a stored value, or an aware KST deadline
+    return max(int((from_db_time(actual) - from_db_time(expected)).total_seconds()), 0) if actual else 0
+
+async def rebuild(db: AsyncSession, date_from: str, date_to: str) -> dict:
+    # Recomputes [date_from, date_to] from focus_sessions, outing/sleep requests, notices and attendance in one
+    # transaction. Check-in lateness uses each student's current expected_check_in.
+    started = clock.perf_counter()
+    start = to_db_time(datetime.fromisoformat(date_from).replace(tzinfo=KST))
+    end = to_db_time(datetime.fromisoformat(date_to).replace(tzinfo=KST) + timedelta(days=1))
+    within = lambda column: and_(column >= start, column < end)
+    totals: Dict[Tuple[str, str], Dict[str, int]] = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+
+    for sid, end_time, duration in await db.execute(select(models.FocusSession.student_id, models.FocusSession.end_time, models.FocusSession.duration_seconds)
+                                                    .where(within(models.FocusSession.end_time))):
+        row = totals[sid, _day(end_time)]
+        row["focus_seconds"] += duration or 0
+        row["focus_sessions"] += 1
+    for sid, start_time, expected, actual in await db.execute(select(models.OutingRequest.student_id, models.OutingRequest.start_time,
+            models.OutingRequest.expected_return_time, models.OutingRequest.actual_return_time)
+            .where(or_(within(models.OutingRequest.start_time), within(models.OutingRequest.actual_return_time)))):
+        totals[sid, _day(start_time)]["outings"] += 1
+        if actual:
+            totals[sid, _day(actual)]["outing_late_seconds"] += _late(actual, expected)
+    for sid, start_time, expected, actual in await db.execute(select(models.SleepRequest.student_id, models.SleepRequest.start_time,
+            models.SleepRequest.expected_wake_time, models.SleepRequest.actual_wake_time)
+            .where(or_(within(models.SleepRequest.start_time), within(models.SleepRequest.actual_wake_time)))):
+        totals[sid, _day(start_time)]["sleeps"] += 1
+        if actual:
+            totals[sid, _day(actual)]["sleep_late_seconds"] += _late(actual, expected)
+    for sid, date_str, severity in await db.execute(select(models.Notice.student_id, models.Notice.date, models.Notice.severity)
+                                                    .where(models.Notice.date >= date_from, models.Notice.date <= date_to)):
+        totals[sid, date_str]["notices"] += 1
+        totals[sid, date_str]["notice_severity"] += severity or 0
+    for sid, date_str, check_in_time, expected_check_in in await db.execute(select(models.AttendanceRecord.student_id, models.AttendanceRecord.date,
+            models.AttendanceRecord.check_in_time, models.Student.expected_check_in).join(models.Student, models.Student.id == models.AttendanceRecord.student_id)
+            .where(models.AttendanceRecord.date >= date_from, models.AttendanceRecord.date <= date_to, models.AttendanceRecord.check_in_time != None)):
+        totals[sid, date_str]["checkin_late_seconds"] += _late(check_in_time, combine_today_time(parse_time_str(expected_check_in or "09:00:00"), datetime.fromisoformat(date_str)))
+
+    # requests are counted on their start day and late returns on the return day; either can lie outside the range
+    rows = [dict(student_id=sid, date=d, **counters) for (sid, d), counters in totals.items() if date_from <= d <= date_to]
+    await db.execute(delete(Summary).where(Summary.date >= date_from, Summary.date <= date_to))
+    if rows:
+        await db.execute(insert(Summary), rows)
+    await db.commit()
+    stats = {"from": date_from, "to": date_to, "rows": len(rows), "elapsed_ms": round((clock.perf_counter() - started) * 1000, 2)}
+    logger.info("summary rebuild %s", stats)
+    return stats
+
+async def read(db: AsyncSession, student_id: str, date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[models.DailyStudentSummary]:
+    stmt = select(Summary).where(Summary.student_id == student_id)
+    if date_from:
+        stmt = stmt.where(Summary.date >= date_from)
+    if date_to:
+        stmt = stmt.where(Summary.date <= date_to)
+    return (await db.scalars(stmt.order_by(Summary.date))).all()
+
+if __name__ == "__main__":
+    # python -m app.summary rebuild <from YYYY-MM-DD> <to YYYY-MM-DD>
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 4 or sys.argv[1] != "rebuild":
+        sys.exit("usage: python -m app.summary rebuild <from YYYY-MM-DD> <to YYYY-MM-DD>")
+    async def _main():
+        try:
+            async with AsyncSessionLocal() as db:
+                print(await rebuild(db, sys.argv[2], sys.argv[3]))
+        finally:
+            await async_engine.dispose()
+    asyncio.run(_main())
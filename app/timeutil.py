@@ -0,0 +1,39 @@
+from datetime import datetime, time
+from zoneinfo import ZoneInfo
+from typing import Optional
+
+KST = ZoneInfo("Asia/Seoul")
+
+def today_kst_str(now: Optional[datetime] = None) -> str:
+    if not now:
+        now = datetime.now(KST)
+    return now.date().isoformat()
+
+def parse_time_str(t: str) -> time:
+    hh, mm, ss = [int(x) for x in t.split(":")]
+    return time(hour=hh, minute=mm, second=ss, tzinfo=None)
+
+def combine_today_time(t: time, now: Optional[datetime] = None) -> datetime:
+    if not now:
+        now = datetime.now(KST)
+    # combine with today's date in KST
+    return datetime(year=now.year, month=now.month, day=now.day, hour=t.hour, minute=t.minute, second=t.second, tzinfo=KST)
+
+def ensure_kst(dt: Optional[datetime]) -> Optional[datetime]:
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=KST)
+    return dt.astimezone(KST)
+
+def to_db_time(dt: Optional[datetime]) -> Optional[datetime]:
+    # DateTime columns hold naive server-local time (values are written as .astimezone(None)); naive input is KST
+    if dt is None:
+        return None
+    return ensure_kst(dt).astimezone(None).replace(tzinfo=None)
+
+def from_db_time(dt: Optional[datetime]) -> Optional[datetime]:
+    # inverse of to_db_time: a stored naive server-local value as an aware KST datetime
+    if dt is None:
+        return None
+    return dt.astimezone(KST)
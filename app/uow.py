@@ -0,0 +1,59 @@
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from .dispatcher import dispatcher
+from .livestate import live_state
+from .versions import versions
+from .websockets import ws_manager
+
+# One request = one transaction. Work that must only happen once the transaction is durable
+# (WebSocket broadcasts, scheduler and in-memory index updates) is queued on the session and
+# run by commit(); a rollback or an unhandled error simply drops the queue with the session.
+
+def after_commit(db: AsyncSession, fn: Callable[[], None]):
+    db.info.setdefault("after_commit", []).append(fn)
+
+def on_state(db: AsyncSession, fn: Callable[[], None]):
+    # live_state transitions; commit() runs them, or apply_state() right after each event when a batch
+    # applies several events of a student in one transaction and the next event must see the previous one's state
+    db.info.setdefault("on_state", []).append(fn)
+
+def transition(db: AsyncSession, name: str, *args):
+    # a live_state transition (on_state) that the other workers replay once the transaction commits
+    on_state(db, lambda: getattr(live_state, name)(*args))
+    after_commit(db, lambda: share({"op": "state", "call": name, "args": [a.isoformat() if isinstance(a, datetime) else a for a in args]}))
+
+def apply_state(db: AsyncSession):
+    for fn in db.info.pop("on_state", []):
+        fn()
+
+def publish(db: AsyncSession, student_id: str, message: dict):
+    after_commit(db, lambda: dispatcher.submit(lambda: ws_manager.send_to_all(student_id, message)))
+
+def publish_admins(db: AsyncSession, message: dict, items: Optional[List[Tuple[str, dict]]] = None):
+    # items: the per-student frames a combined message is made of, for admins subscribed to topics
+    after_commit(db, lambda: dispatcher.submit(lambda: ws_manager.send_to_admins(message, items)))
+
+def share(envelope: dict):
+    # state another worker needs (app/websockets.py delivers it there); nothing to do with a single process
+    if ws_manager.broker.shared:
+        dispatcher.submit(lambda: ws_manager.share(envelope))
+
+def bump_versions(db: AsyncSession, resource: str, keys: List[str]):
+    # this worker's stamps move at commit; the other workers' once the broker delivers the bump
+    def bump():
+        if keys:
+            versions.bump_many(resource, keys)
+            share({"op": "versions", "resource": resource, "keys": keys})
+    after_commit(db, bump)
+
+async def commit(db: AsyncSession):
+    await db.commit()
+    apply_state(db)
+    for fn in db.info.pop("after_commit", []):
+        fn()
+
+async def rollback(db: AsyncSession):
+    db.info.pop("after_commit", None)
+    db.info.pop("on_state", None)
+    await db.rollback()
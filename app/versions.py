@@ -0,0 +1,83 @@
+import itertools
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Hashable, Iterable, Optional, Tuple
+from fastapi import Request, Response
+
+# Version stamps for conditional GET. Every write to a student-scoped resource bumps its stamp once the
+# transaction commits (uow.after_commit); read endpoints expose the stamp as ETag/Last-Modified and answer
+# a matching If-None-Match / If-Modified-Since with 304 before running their query.
+#
+# Stamps live in process memory, like the dedupe index and student_cache. The ETag carries a per-process
+# boot token so tags handed out before a restart never match, and resources not written since boot report
+# the boot time as Last-Modified, which is never earlier than their real last change.
+#
+# With several workers, a write on one of them must move the stamp on all of them, or another worker would
+# answer 304 for a copy that is already stale: uow.bump_versions bumps locally and sends the bump to the other
+# workers over the broker (op "versions" in app/websockets.py). When a worker may have missed bumps (dropped
+# broadcasts, a lost broker subscription) it calls reset(), after which no earlier ETag or date matches.
+STUDENT = "student"
+NOTICES = "notices"
+NOTIFICATIONS = "notifications"
+
+CACHE_CONTROL = "private, no-cache"  # clients may keep the body but must revalidate every time
+
+class ResourceVersions:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # forget every stamp: a new token, and "now" as the Last-Modified of everything
+        self.boot = datetime.now(timezone.utc).replace(microsecond=0)
+        self._token = format(time.time_ns(), "x")
+        self._counter = itertools.count(1)
+        self._stamps: Dict[Tuple[str, Hashable], Tuple[int, datetime]] = {}
+
+    def __len__(self):
+        return len(self._stamps)
+
+    def bump(self, resource: str, key: Hashable):
+        # Last-Modified has one-second resolution, so each bump moves it forward by at least a second;
+        # otherwise two writes within the same second (or a write in the second of boot/reset) would share a date
+        # and If-Modified-Since would miss the second one
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        _, prev = self._stamps.get((resource, key), (0, self.boot))
+        if now <= prev:
+            now = prev + timedelta(seconds=1)
+        self._stamps[(resource, key)] = (next(self._counter), now)
+
+    def bump_many(self, resource: str, keys: Iterable[Hashable]):
+        for key in keys:
+            self.bump(resource, key)
+
+    def stamp(self, resource: str, key: Hashable) -> Tuple[str, datetime]:
+        version, modified = self._stamps.get((resource, key), (0, self.boot))
+        return f'"{self._token}.{version}"', modified
+
+    def not_modified(self, request: Request, response: Response, resource: str, key: Hashable) -> Optional[Response]:
+        # Sets the validators on `response`; returns a 304 to send instead when the client's copy is current
+        etag, modified = self.stamp(resource, key)
+        headers = {"ETag": etag, "Last-Modified": format_datetime(modified, usegmt=True), "Cache-Control": CACHE_CONTROL}
+        response.headers.update(headers)
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            # If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.2.2); weak comparison for GET
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            fresh = "*" in tags or etag in tags
+        else:
+            fresh = _not_modified_since(request.headers.get("if-modified-since"), modified)
+        return Response(status_code=304, headers=headers) if fresh else None
+
+def _not_modified_since(value: Optional[str], modified: datetime) -> bool:
+    if not value:
+        return False
+    try:
+        since = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return modified <= since
+
+versions = ResourceVersions()
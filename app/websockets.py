@@ -1,51 +1,567 @@
-from typing import Dict, List, Set
+import asyncio
+import json
+import logging
+import os
+import time
+import zlib
+from collections import deque
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple, Union
 from fastapi import WebSocket
 from collections import defaultdict
+from .broker import Broker, LocalBroker
+from .cache import student_cache
+from .livestate import live_state
+from .versions import versions
 
+try:
+    import msgpack
+except ImportError:  # optional: only needed for clients that connect with ?encoding=msgpack
+    msgpack = None
+
+logger = logging.getLogger("studyflow.websockets")
+
+WS_SEND_QUEUE = int(os.environ.get("STUDYFLOW_WS_SEND_QUEUE", 256))  # frames a connection may have pending before it is evicted
+WS_REPLAY_SIZE = int(os.environ.get("STUDYFLOW_WS_REPLAY_SIZE", 64))                # frames kept per student stream
+WS_ADMIN_REPLAY_SIZE = int(os.environ.get("STUDYFLOW_WS_ADMIN_REPLAY_SIZE", 1024))  # frames kept for the admin stream
+WS_HEARTBEAT_SECONDS = float(os.environ.get("STUDYFLOW_WS_HEARTBEAT_SECONDS", 25))  # ping sockets silent this long
+# reap sockets silent this long, 0 = never. Off by default: the dashboards only receive and do not answer pings
+# yet, and uvicorn's protocol-level ping/pong (--ws-ping-interval/--ws-ping-timeout) already drops dead peers
+WS_IDLE_TIMEOUT_SECONDS = float(os.environ.get("STUDYFLOW_WS_IDLE_TIMEOUT_SECONDS", 0))
+WS_BATCH_MIN_MS = 20
+WS_BATCH_MAX_MS = 1000
+
+# Admin event types that describe a student's current state; in a batch a later one replaces an earlier one of
+# the same group for the same student. Everything else (notices, notifications, ...) is always kept.
+STATE_GROUPS = {
+    "dashboard_start": "attendance", "logout": "attendance",
+    "outing_request": "outing", "outing_return": "outing",
+    "sleep_request": "sleep", "sleep_return": "sleep",
+    "focus_start": "focus", "focus_stop": "focus",
+    "student_updated": "student",
+}
+
+ADMIN = "admin"
+STUDENT = "student"
+
+# Wire encodings a client can pick in the /ws handshake (?encoding=). json goes out as text frames, the others
+# as binary frames: msgpack is the compact form, deflate is the JSON text zlib-compressed.
+ENCODERS: Dict[str, Callable[[dict], Union[str, bytes]]] = {
+    "json": lambda message: json.dumps(message, ensure_ascii=False, separators=(",", ":")),
+    "deflate": lambda message: zlib.compress(json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode()),
+}
+if msgpack is not None:
+    ENCODERS["msgpack"] = lambda message: msgpack.packb(message, use_bin_type=True)
+
+# A broadcast message, encoded at most once per encoding no matter how many sockets it goes to
+class Frame:
+    __slots__ = ("message", "_encoded")
+
+    def __init__(self, message: dict):
+        self.message = message
+        self._encoded: Dict[str, Union[str, bytes]] = {}
+
+    def encoded(self, encoding: str) -> Union[str, bytes]:
+        data = self._encoded.get(encoding)
+        if data is None:
+            data = self._encoded[encoding] = ENCODERS[encoding](self.message)
+        return data
+
+# Admin subscriptions are "kind:value" topics. classroom/grade/student topics narrow which students an admin
+# hears about, type topics narrow which message types; within a kind topics are alternatives. An admin without
+# any topic receives everything, as before.
+SCOPE_KINDS = ("classroom", "grade", "student")
+TOPIC_KINDS = SCOPE_KINDS + ("type",)
+
+def parse_topics(topics: Iterable[str]) -> Set[str]:
+    parsed = set()
+    for topic in topics:
+        kind, sep, value = topic.strip().partition(":")
+        if not sep or kind not in TOPIC_KINDS or not value:
+            raise ValueError(f"invalid topic {topic!r}; expected one of {', '.join(k + ':<value>' for k in TOPIC_KINDS)}")
+        parsed.add(f"{kind}:{value}")
+    return parsed
+
+# How an admin-stream frame was routed, so a replay can apply the same rules to the reconnecting admin
+PER_STUDENT = "student"  # one student's event: unscoped admins and that student's subscribers
+COMBINED = "combined"    # many students in one frame: admins without subscriptions
+ITEM = "item"            # one student's part of a COMBINED frame: admins with subscriptions
+GLOBAL = "global"        # not about a student: every admin whose type filter allows it
+
+# A stream numbers its frames and keeps the last `size` of them for resuming clients. Every frame sent on it
+# carries "seq"; a client reconnecting with ?since=<last seq seen> is sent what it missed, or a
+# resync_required frame when those frames have already left the buffer.
+class Stream:
+    __slots__ = ("seq", "frames")
+
+    def __init__(self, size: int):
+        self.seq = 0
+        self.frames: "deque[Tuple[int, Optional[str], Optional[str], Frame]]" = deque(maxlen=size)
+
+    def stamp(self, message: dict, student_id: Optional[str] = None, kind: Optional[str] = None) -> Frame:
+        self.seq += 1
+        frame = Frame({**message, "seq": self.seq})
+        self.frames.append((self.seq, student_id, kind, frame))
+        return frame
+
+    def since(self, seq: int) -> Optional[list]:
+        # the buffered entries after seq, or None when the gap can no longer be filled
+        if seq > self.seq:
+            return None  # numbered by another stream (server restart or another worker)
+        oldest = self.frames[0][0] if self.frames else self.seq + 1
+        if seq + 1 < oldest:
+            return None
+        return [entry for entry in self.frames if entry[0] > seq]
+
+# Pending frames of an admin connection in batching mode, flushed as one {"type": "batch", "data": [...]} frame
+# once per window. Entries are keyed so that superseded state updates collapse into the latest one.
+class Batch:
+    __slots__ = ("window", "entries", "timer", "seq")
+
+    def __init__(self, window: float):
+        self.window = window
+        self.entries: Dict[Hashable, dict] = {}
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.seq = 0
+
+    def add(self, student_id: Optional[str], message: dict) -> bool:
+        # returns True when the entry replaced a pending one
+        group = STATE_GROUPS.get(message.get("type"))
+        if group is not None and student_id is not None:
+            key = (student_id, group)
+        else:
+            self.seq += 1
+            key = self.seq
+        replaced = self.entries.pop(key, None) is not None
+        self.entries[key] = {**message, "student_id": student_id} if student_id is not None else message
+        return replaced
+
+    def take(self) -> List[dict]:
+        entries, self.entries = list(self.entries.values()), {}
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        return entries
+
+class Connection:
+    __slots__ = ("ws", "student_id", "role", "encoding", "queue", "writer", "scopes", "types", "batch", "last_seen")
+
+    def __init__(self, ws: WebSocket, student_id: Optional[str], role: str, encoding: str, max_queued: int):
+        self.ws = ws
+        self.student_id = student_id
+        self.role = role
+        self.encoding = encoding
+        self.queue: "asyncio.Queue[Frame]" = asyncio.Queue(max_queued)
+        self.writer: Optional[asyncio.Task] = None
+        self.scopes: Set[str] = set()  # classroom:/grade:/student: topics
+        self.types: Set[str] = set()   # message types, without the "type:" prefix
+        self.batch: Optional[Batch] = None
+        self.last_seen = time.monotonic()  # last message received from the client
+
+    @property
+    def filtered(self) -> bool:
+        return bool(self.scopes or self.types)
+
+    def wants(self, type: Optional[str]) -> bool:
+        return not self.types or type in self.types
+
+# Broadcasts never await a socket: they put the frame on each recipient's bounded queue and return. One writer
+# task per connection drains its queue, so a slow browser only delays itself. A connection whose queue is full
+# has fallen too far behind and is closed; the client reconnects and refetches over REST.
 class WSManager:
-    def __init__(self):
+    def __init__(self, max_queued: int = WS_SEND_QUEUE):
+        self.max_queued = max_queued
         # Map student_id to set of websockets
         self.student_connections: Dict[str, Set[WebSocket]] = defaultdict(set)
         # Admin channel for all-students broadcasts
         self.admin_connections: Set[WebSocket] = set()
+        # reverse index: socket -> its registration, for O(1) disconnect
+        self._connections: Dict[WebSocket, Connection] = {}
+        # admin routing: scope topic -> subscribed admins, plus the admins without a scope (every student)
+        self._topic_index: Dict[str, Set[WebSocket]] = defaultdict(set)
+        self._unscoped_admins: Set[WebSocket] = set()
+        # student_id -> its classroom/grade topics, kept in step with the students table (load_roster, set_student)
+        self._student_scopes: Dict[str, Tuple[str, ...]] = {}
+        self.stats = {"sent": 0, "evicted": 0, "reaped": 0, "failed": 0, "batches": 0, "coalesced": 0, "replayed": 0, "resyncs": 0}
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._closing: Set[asyncio.Task] = set()  # close handshakes of evicted/reaped sockets, awaited by stop()
+        # resumable streams; the epoch tells clients whether their last seq belongs to this process's numbering
+        self.epoch = format(time.time_ns(), "x")
+        self._student_streams: Dict[str, Stream] = {}
+        self._admin_stream = Stream(WS_ADMIN_REPLAY_SIZE)
+        self.broker: Broker = LocalBroker()  # replaced by start(); see app/broker.py
+        # envelope op -> handler, for state owned by modules that cannot be imported here (the scheduler)
+        self.remote_ops: Dict[str, Callable[[dict], None]] = {}
 
-    async def connect_student(self, student_id: str, websocket: WebSocket):
+    def __len__(self):
+        return len(self._connections)
+
+    async def connect_student(self, student_id: str, websocket: WebSocket, encoding: str = "json",
+                              since: Optional[int] = None, epoch: Optional[str] = None):
         await websocket.accept()
+        conn = Connection(websocket, student_id, STUDENT, encoding, self.max_queued)
+        self._register(conn)
         self.student_connections[student_id].add(websocket)
+        self._resume(conn, self._student_stream(student_id), since, epoch)
 
-    async def connect_admin(self, websocket: WebSocket):
+    async def connect_admin(self, websocket: WebSocket, encoding: str = "json", topics: Iterable[str] = (), batch_ms: int = 0,
+                            since: Optional[int] = None, epoch: Optional[str] = None):
+        # batch_ms > 0 switches the connection to batching mode with that window (clamped to 20..1000 ms)
         await websocket.accept()
+        conn = Connection(websocket, None, ADMIN, encoding, self.max_queued)
+        if batch_ms > 0:
+            conn.batch = Batch(min(max(batch_ms, WS_BATCH_MIN_MS), WS_BATCH_MAX_MS) / 1000)
+        self._register(conn)
         self.admin_connections.add(websocket)
+        self._unscoped_admins.add(websocket)
+        self.subscribe(websocket, topics)
+        self._resume(conn, self._admin_stream, since, epoch)
+
+    def _student_stream(self, student_id: str) -> Stream:
+        stream = self._student_streams.get(student_id)
+        if stream is None:
+            stream = self._student_streams[student_id] = Stream(WS_REPLAY_SIZE)
+        return stream
+
+    def _resume(self, conn: Connection, stream: Stream, since: Optional[int], epoch: Optional[str]):
+        # runs right after registration with no await in between, so nothing is missed or sent twice
+        self._enqueue(conn.ws, Frame({"type": "hello", "data": {"epoch": self.epoch, "seq": stream.seq}}))
+        if since is None:
+            return
+        entries = stream.since(since) if epoch in (None, self.epoch) else None
+        if entries is not None and conn.role == ADMIN:
+            entries = [e for e in entries if self._admin_receives(conn, e[1], e[2], e[3].message.get("type"))]
+        if entries is None or len(entries) >= self.max_queued:
+            self.stats["resyncs"] += 1
+            self._enqueue(conn.ws, Frame({"type": "resync_required", "data": {"epoch": self.epoch, "seq": stream.seq}}))
+            return
+        for entry in entries:
+            self._enqueue(conn.ws, entry[3])
+        self.stats["replayed"] += len(entries)
+
+    def _admin_receives(self, conn: Connection, student_id: Optional[str], kind: Optional[str], type: Optional[str]) -> bool:
+        # the routing rules of _to_admins/_route_admins, for one admin-stream entry
+        if kind == COMBINED:
+            return not conn.filtered
+        if kind == GLOBAL:
+            return not conn.filtered or conn.wants(type)
+        if (kind == ITEM and not conn.filtered) or not conn.wants(type):
+            return False
+        return not conn.scopes or not conn.scopes.isdisjoint((f"student:{student_id}", *self._student_scopes.get(student_id, ())))
+
+    def subscribe(self, websocket: WebSocket, topics: Iterable[str]) -> Set[str]:
+        # topics must already be valid (parse_topics); returns the connection's subscriptions
+        conn = self._connections[websocket]
+        for topic in topics:
+            kind, _, value = topic.partition(":")
+            if kind == "type":
+                conn.types.add(value)
+            elif topic not in conn.scopes:
+                conn.scopes.add(topic)
+                self._topic_index[topic].add(websocket)
+        if conn.scopes:
+            self._unscoped_admins.discard(websocket)
+        return subscriptions(conn)
+
+    def unsubscribe(self, websocket: WebSocket, topics: Iterable[str]) -> Set[str]:
+        conn = self._connections[websocket]
+        for topic in topics:
+            kind, _, value = topic.partition(":")
+            if kind == "type":
+                conn.types.discard(value)
+            elif topic in conn.scopes:
+                conn.scopes.discard(topic)
+                self._unindex(topic, websocket)
+        if not conn.scopes:
+            self._unscoped_admins.add(websocket)
+        return subscriptions(conn)
+
+    def _unindex(self, topic: str, websocket: WebSocket):
+        subscribers = self._topic_index.get(topic)
+        if subscribers is not None:
+            subscribers.discard(websocket)
+            if not subscribers:
+                del self._topic_index[topic]
+
+    def handle_message(self, websocket: WebSocket, text: str):
+        # Any message from a client proves it is alive; {"action": "pong"} answers a heartbeat ping and does nothing else.
+        # Admin control messages: {"action": "subscribe" | "unsubscribe", "topics": ["classroom:3A", "type:notice"]}.
+        # Anything else is ignored.
+        conn = self._connections.get(websocket)
+        if conn is None:
+            return
+        conn.last_seen = time.monotonic()
+        if conn.role != ADMIN:
+            return
+        try:
+            request = json.loads(text)
+        except ValueError:
+            return
+        if not isinstance(request, dict) or request.get("action") not in ("subscribe", "unsubscribe"):
+            return
+        try:
+            topics = parse_topics(request.get("topics") or [])
+        except (ValueError, AttributeError, TypeError) as e:
+            self._enqueue(websocket, Frame({"type": "error", "data": {"detail": str(e)}}))
+            return
+        current = (self.subscribe if request["action"] == "subscribe" else self.unsubscribe)(websocket, topics)
+        self._enqueue(websocket, Frame({"type": "subscriptions", "data": {"topics": sorted(current)}}))
+
+    def set_student(self, student_id: str, classroom: Optional[str], grade: Optional[str]):
+        self._student_scopes[student_id] = tuple(f"{kind}:{value}" for kind, value in (("classroom", classroom), ("grade", grade)) if value)
+
+    def load_roster(self, rows: Iterable[Tuple[str, Optional[str], Optional[str]]]):
+        self._student_scopes = {}
+        for student_id, classroom, grade in rows:
+            self.set_student(student_id, classroom, grade)
+
+    def _admins_for(self, student_id: str) -> Set[WebSocket]:
+        admins = set(self._unscoped_admins)
+        for topic in (f"student:{student_id}", *self._student_scopes.get(student_id, ())):
+            admins |= self._topic_index.get(topic, set())
+        return admins
+
+    def _register(self, conn: Connection):
+        conn.writer = asyncio.create_task(self._drain(conn))
+        self._connections[conn.ws] = conn
 
     def disconnect(self, websocket: WebSocket):
-        for s, conns in list(self.student_connections.items()):
-            if websocket in conns:
-                conns.remove(websocket)
-        if websocket in self.admin_connections:
-            self.admin_connections.remove(websocket)
+        conn = self._connections.pop(websocket, None)
+        if conn is None:
+            return  # already removed, e.g. evicted before the receive loop noticed
+        if conn.role == ADMIN:
+            self.admin_connections.discard(websocket)
+            self._unscoped_admins.discard(websocket)
+            for topic in conn.scopes:
+                self._unindex(topic, websocket)
+        else:
+            conns = self.student_connections.get(conn.student_id)
+            if conns is not None:
+                conns.discard(websocket)
+                if not conns:
+                    del self.student_connections[conn.student_id]
+        if conn.batch is not None:
+            conn.batch.take()
+        if conn.writer is not None and conn.writer is not asyncio.current_task():
+            conn.writer.cancel()
 
-    async def send_to_student(self, student_id: str, message: dict):
-        dead = []
-        for ws in list(self.student_connections.get(student_id, [])):
+    async def _drain(self, conn: Connection):
+        try:
+            while True:
+                data = (await conn.queue.get()).encoded(conn.encoding)
+                if isinstance(data, str):
+                    await conn.ws.send_text(data)
+                else:
+                    await conn.ws.send_bytes(data)
+                self.stats["sent"] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.stats["failed"] += 1
+            self.disconnect(conn.ws)
+
+    def _enqueue(self, websocket: WebSocket, frame: Frame):
+        conn = self._connections.get(websocket)
+        if conn is None:
+            return
+        try:
+            conn.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self._evict(conn)
+
+    def _to_admin(self, conn: Connection, student_id: Optional[str], frame: Frame):
+        batch = conn.batch
+        if batch is None:
+            self._enqueue(conn.ws, frame)
+            return
+        if batch.add(student_id, frame.message):
+            self.stats["coalesced"] += 1
+        if len(batch.entries) >= self.max_queued:
+            self._flush_batch(conn)
+        elif batch.timer is None:
+            batch.timer = asyncio.get_running_loop().call_later(batch.window, self._flush_batch, conn)
+
+    def _flush_batch(self, conn: Connection):
+        entries = conn.batch.take()
+        if entries and conn.ws in self._connections:
+            self.stats["batches"] += 1
+            self._enqueue(conn.ws, Frame({"type": "batch", "data": entries}))
+
+    def _evict(self, conn: Connection):
+        self.stats["evicted"] += 1
+        logger.warning("evicting slow %s websocket (student=%s): %d frames pending", conn.role, conn.student_id, conn.queue.qsize())
+        self.disconnect(conn.ws)
+        self._close(conn.ws, 1013)  # try again later
+
+    def _close(self, websocket: WebSocket, code: int):
+        async def close():
             try:
-                await ws.send_json(message)
+                await websocket.close(code=code)
             except Exception:
-                dead.append(ws)
-        for ws in dead:
-            self.disconnect(ws)
+                pass
+        task = asyncio.get_running_loop().create_task(close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
 
-    async def send_to_admins(self, message: dict):
-        dead = []
-        for ws in list(self.admin_connections):
+    # Heartbeat and reaper: every interval, sockets that have been silent for `interval` get a ping frame
+    # ({"type": "ping"}, answered with {"action": "pong"}), which also keeps proxies from closing idle sockets.
+    # With a timeout, sockets silent that long are dropped: a half-open connection (sleeping laptop, lost Wi-Fi)
+    # never answers, so it leaves the registry within timeout + interval instead of lingering until a send fails.
+    # Only enable it once every client answers pings; until then uvicorn's protocol-level pings find dead peers.
+    def reap(self, interval: float = WS_HEARTBEAT_SECONDS, timeout: float = WS_IDLE_TIMEOUT_SECONDS, now: Optional[float] = None) -> int:
+        now = time.monotonic() if now is None else now
+        ping = None
+        reaped = 0
+        for conn in list(self._connections.values()):
+            idle = now - conn.last_seen
+            if timeout > 0 and idle >= timeout:
+                reaped += 1
+                self.disconnect(conn.ws)
+                self._close(conn.ws, 1001)  # going away
+            elif idle >= interval:
+                ping = ping or Frame({"type": "ping", "data": {"epoch": self.epoch}})
+                self._enqueue(conn.ws, ping)
+        if reaped:
+            self.stats["reaped"] += reaped
+            logger.info("reaped %d idle websockets", reaped)
+        return reaped
+
+    async def _run_heartbeat(self, interval: float, timeout: float):
+        while True:
+            await asyncio.sleep(interval)
             try:
-                await ws.send_json(message)
+                self.reap(interval, timeout)
             except Exception:
-                dead.append(ws)
-        for ws in dead:
-            self.disconnect(ws)
+                logger.exception("websocket heartbeat failed")
+
+    def counts(self) -> dict:
+        # live registry sizes; all of them shrink again as sockets disconnect or are reaped
+        return {
+            "connections": len(self._connections),
+            "student_sockets": sum(len(conns) for conns in self.student_connections.values()),
+            "students_online": len(self.student_connections),
+            "admin_sockets": len(self.admin_connections),
+            "topics": len(self._topic_index),
+            "frames_pending": sum(conn.queue.qsize() for conn in self._connections.values()),
+            "replay_streams": len(self._student_streams),
+        }
+
+    # Local delivery: routes an envelope to the sockets of this worker. The send_* methods below deliver here and
+    # publish the same envelope through the broker so the other workers deliver it to their sockets.
+    def deliver(self, envelope: dict):
+        op = envelope["op"]
+        # Each frame is stamped on its stream (the student's, or the shared admin stream) and encoded once for all
+        # the sockets of that stream
+        admins = self._admin_stream
+        if op == "student":
+            self._to_student(envelope["student_id"], envelope["message"])
+        elif op == "all":
+            student_id = envelope["student_id"]
+            self._to_student(student_id, envelope["message"])
+            self._route_admins(student_id, admins.stamp(envelope["message"], student_id, PER_STUDENT))
+        elif op == "admins":
+            items = envelope.get("items")
+            frame = admins.stamp(envelope["message"], None, COMBINED if items else GLOBAL)
+            self._to_admins(frame, [(sid, admins.stamp(m, sid, ITEM)) for sid, m in items] if items else None)
+        elif op == "many":
+            for student_id, message in envelope["items"]:
+                self._to_student(student_id, message)
+            frame = admins.stamp(envelope["message"], None, COMBINED)
+            self._to_admins(frame, [(sid, admins.stamp(m, sid, ITEM)) for sid, m in envelope["items"]])
+        elif op == "resync":
+            self._resync()
+            versions.reset()  # the dropped broadcasts may have included version bumps
+        elif op == "versions":
+            versions.bump_many(envelope["resource"], envelope["keys"])
+        elif op == "roster":
+            self.set_student(envelope["student_id"], envelope["classroom"], envelope["grade"])
+            student_cache.invalidate(envelope["student_id"])  # expected times may have changed too
+        elif op == "state":
+            live_state.replay(envelope["call"], envelope["args"])
+        elif op in self.remote_ops:
+            self.remote_ops[op](envelope)
+        else:
+            logger.warning("unknown websocket envelope op %r", op)
+
+    def _resync(self):
+        # broadcasts were dropped before they were numbered; every socket is told to refetch over REST
+        frames: Dict[int, Frame] = {}
+        for conn in list(self._connections.values()):
+            stream = self._admin_stream if conn.role == ADMIN else self._student_stream(conn.student_id)
+            frame = frames.get(id(stream)) or frames.setdefault(id(stream), Frame({"type": "resync_required", "data": {"epoch": self.epoch, "seq": stream.seq}}))
+            self._enqueue(conn.ws, frame)
+        self.stats["resyncs"] += len(frames)
+
+    def _to_student(self, student_id: str, message: dict):
+        frame = self._student_stream(student_id).stamp(message)
+        for ws in list(self.student_connections.get(student_id, ())):
+            self._enqueue(ws, frame)
+
+    def _to_admins(self, frame: Frame, items: Optional[List[Tuple[str, Frame]]] = None):
+        # A combined admin frame covers many students. Admins without subscriptions get it as is; admins with
+        # subscriptions get the per-student `items` that match them instead. Without items, a frame that is not
+        # about one student reaches every admin whose type filter allows it.
+        for ws in list(self.admin_connections):
+            conn = self._connections.get(ws)
+            if conn is not None and (not conn.filtered or (items is None and conn.wants(frame.message.get("type")))):
+                self._to_admin(conn, None, frame)
+        for student_id, item in items or ():
+            self._route_admins(student_id, item, filtered_only=True)
+
+    def _route_admins(self, student_id: str, frame: Frame, filtered_only: bool = False):
+        type = frame.message.get("type")
+        for ws in self._admins_for(student_id):
+            conn = self._connections.get(ws)
+            if conn is not None and conn.wants(type) and (conn.filtered or not filtered_only):
+                self._to_admin(conn, student_id, frame)
+
+    async def _publish(self, envelope: dict):
+        self.deliver(envelope)
+        await self.broker.publish(envelope)
+
+    async def start(self, broker: Broker, heartbeat: float = WS_HEARTBEAT_SECONDS, timeout: float = WS_IDLE_TIMEOUT_SECONDS):
+        self.broker = broker
+        await broker.start(self.deliver)
+        if heartbeat > 0 and self._heartbeat is None:
+            self._heartbeat = asyncio.get_running_loop().create_task(self._run_heartbeat(heartbeat, timeout))
+
+    async def stop(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            try:
+                await self._heartbeat
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat = None
+        if self._closing:
+            await asyncio.wait(set(self._closing), timeout=5)
+        await self.broker.stop()
+
+    async def send_to_student(self, student_id: str, message: dict):
+        await self._publish({"op": "student", "student_id": student_id, "message": message})
+
+    async def send_to_admins(self, message: dict, items: Optional[List[Tuple[str, dict]]] = None):
+        await self._publish({"op": "admins", "message": message, "items": items})
 
     async def send_to_all(self, student_id: str, message: dict):
-        await self.send_to_student(student_id, message)
-        await self.send_to_admins(message)
+        await self._publish({"op": "all", "student_id": student_id, "message": message})
+
+    # one frame per student socket plus a single combined frame for the admin channel
+    async def send_many(self, items: List[Tuple[str, dict]], admin_message: dict):
+        await self._publish({"op": "many", "items": items, "message": admin_message})
+
+    # the broadcast dispatcher dropped frames; every worker resyncs its sockets, as none of them got those frames
+    async def resync_all(self):
+        await self._publish({"op": "resync"})
+
+    # state this worker has already applied for itself (uow.share): only the other workers deliver it
+    async def share(self, envelope: dict):
+        await self.broker.publish(envelope)
+
+    # a student's classroom/grade changed; every worker updates its admin routing
+    async def update_student(self, student_id: str, classroom: Optional[str], grade: Optional[str]):
+        await self._publish({"op": "roster", "student_id": student_id, "classroom": classroom, "grade": grade})
+
+def subscriptions(conn: Connection) -> Set[str]:
+    return conn.scopes | {f"type:{t}" for t in conn.types}
 
 ws_manager = WSManager()
@@ -0,0 +1,63 @@
+# Check-in rush: many threads doing the dashboard-start write pattern at once
+# (event log + attendance + notice, one commit each) against a throwaway SQLite file,
+# once with SQLite defaults and once with the tuning from app/database.py.
+#
+#   python -m bench.checkin_rush [--students 400] [--threads 16]
+import argparse
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from app import models
+from app.database import Base, make_engine
+
+def check_in(Session, student_id: str, date_str: str, errors: list, lock: threading.Lock):
+    db = Session()
+    try:
+        now = datetime.now()
+        db.add(models.EventLog(student_id=student_id, type="dashboard_start", timestamp=now, payload={}))
+        db.commit()
+        db.add(models.AttendanceRecord(student_id=student_id, date=date_str, check_in_time=now, status="present"))
+        db.commit()
+        db.add(models.Notice(student_id=student_id, severity=1, reason="등원 지각", source="dashboard_start", date=date_str))
+        db.commit()
+    except OperationalError as e:  # "database is locked"
+        db.rollback()
+        with lock:
+            errors.append(str(e.orig))
+    finally:
+        db.close()
+
+def run(tuned: bool, students: int, threads: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        eng = make_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}", sqlite_tuning=tuned)
+        Base.metadata.create_all(bind=eng)
+        Session = sessionmaker(autocommit=False, autoflush=False, bind=eng)
+        db = Session()
+        db.add_all([models.Student(id=f"STU{i:05d}", name=f"student {i}") for i in range(students)])
+        db.commit()
+        db.close()
+        errors, lock = [], threading.Lock()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            for i in range(students):
+                pool.submit(check_in, Session, f"STU{i:05d}", "2025-09-01", errors, lock)
+        elapsed = time.perf_counter() - started
+        eng.dispose()
+    return {"tuned": tuned, "check_ins": students, "seconds": round(elapsed, 3),
+            "check_ins_per_sec": round(students / elapsed, 1), "locked_errors": len(errors)}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--students", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=16)
+    args = parser.parse_args()
+    for tuned in (False, True):
+        print(run(tuned, args.students, args.threads))
+
+if __name__ == "__main__":
+    main()
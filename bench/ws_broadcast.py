@@ -0,0 +1,79 @@
+# Broadcast fanout: CPU time per send_to_all as the number of admin sockets grows, once with the old
+# per-socket send_json (one json.dumps per recipient) and once through ws_manager's shared Frame, which
+# encodes each broadcast once per encoding. Sockets are in-process fakes, so only the server-side cost is measured.
+#
+#   python -m bench.ws_broadcast [--broadcasts 2000] [--admins 1,10,50,200] [--encoding json]
+import argparse
+import asyncio
+import json
+import time
+from app.websockets import ENCODERS, WSManager
+
+MESSAGE = {"type": "notice", "data": {
+    "id": 12345, "student_id": "STU00042", "type": "주의장", "severity": 2, "reason": "외출 복귀 지각",
+    "source": "outing_return", "date": "2025-09-01", "created_at": "2025-09-01T15:42:07.123456",
+}}
+
+class FakeSocket:
+    async def accept(self):
+        pass
+
+    async def send_json(self, data):
+        # what Starlette's WebSocket.send_json does before writing the text frame
+        json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+    async def send_text(self, data):
+        pass
+
+    async def send_bytes(self, data):
+        pass
+
+    async def close(self, code=1000):
+        pass
+
+def _as_bytes(data) -> bytes:
+    return data.encode() if isinstance(data, str) else data
+
+async def per_socket(admins: int, broadcasts: int) -> float:
+    student, sockets = FakeSocket(), [FakeSocket() for _ in range(admins)]
+    started = time.process_time()
+    for i in range(broadcasts):
+        message = {**MESSAGE, "data": {**MESSAGE["data"], "id": i}}
+        await student.send_json(message)
+        for ws in sockets:
+            await ws.send_json(message)
+    return time.process_time() - started
+
+async def shared_frame(admins: int, broadcasts: int, encoding: str) -> float:
+    manager = WSManager(max_queued=broadcasts + 1)
+    student, sockets = FakeSocket(), [FakeSocket() for _ in range(admins)]
+    await manager.connect_student("STU00042", student, encoding)
+    for ws in sockets:
+        await manager.connect_admin(ws, encoding)
+    started = time.process_time()
+    for i in range(broadcasts):
+        await manager.send_to_all("STU00042", {**MESSAGE, "data": {**MESSAGE["data"], "id": i}})
+    while manager.stats["sent"] < (broadcasts + 1) * (admins + 1):  # + one hello frame per socket
+        await asyncio.sleep(0)
+    elapsed = time.process_time() - started
+    for ws in [student, *sockets]:
+        manager.disconnect(ws)
+    await asyncio.sleep(0)  # let the cancelled writer tasks finish
+    return elapsed
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--broadcasts", type=int, default=2000)
+    parser.add_argument("--admins", default="1,10,50,200")
+    parser.add_argument("--encoding", default="json", choices=sorted(ENCODERS))
+    args = parser.parse_args()
+    for admins in map(int, args.admins.split(",")):
+        old = await per_socket(admins, args.broadcasts)
+        new = await shared_frame(admins, args.broadcasts, args.encoding)
+        print({"admins": admins, "encoding": args.encoding,
+               "per_socket_us_per_broadcast": round(old / args.broadcasts * 1e6, 1),
+               "shared_frame_us_per_broadcast": round(new / args.broadcasts * 1e6, 1),
+               "frame_bytes": len(_as_bytes(ENCODERS[args.encoding](MESSAGE)))})
+
+if __name__ == "__main__":
+    asyncio.run(main())
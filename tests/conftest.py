@@ -0,0 +1,38 @@
+import asyncio
+import os
+import tempfile
+import time
+
+import pytest
+
+# point the app at a throwaway database before anything imports app.database
+_tmp = tempfile.mkdtemp(prefix="studyflow-tests-")
+os.environ["STUDYFLOW_DATABASE_URL"] = f"sqlite:///{_tmp}/studyflow.db"
+os.environ["STUDYFLOW_ARCHIVE_DIR"] = os.path.join(_tmp, "archive")
+
+from app import migrations  # noqa: E402
+from app.database import async_engine  # noqa: E402
+
+migrations.upgrade()
+
+def run(coro):
+    # each test gets its own event loop; pooled aiosqlite connections must not outlive it
+    async def _main():
+        try:
+            return await coro
+        finally:
+            await async_engine.dispose()
+    return asyncio.run(_main())
+
+@pytest.fixture
+def utc_host():
+    # a server whose local time is UTC, so naive server-local values differ from naive KST ones
+    previous = os.environ.get("TZ")
+    os.environ["TZ"] = "UTC"
+    time.tzset()
+    yield
+    if previous is None:
+        del os.environ["TZ"]
+    else:
+        os.environ["TZ"] = previous
+    time.tzset()
@@ -0,0 +1,60 @@
+from sqlalchemy import select
+
+from app import events, models, schemas
+from app.database import AsyncSessionLocal
+from app.livestate import live_state
+from app.uow import commit
+from conftest import run
+
+async def _batch(items, *students):
+    async with AsyncSessionLocal() as db:
+        for student_id in students:
+            db.add(models.Student(id=student_id, name=student_id, expected_check_in="09:00:00"))
+        await commit(db)
+        return await events.apply_batch(db, items)
+
+async def _rows(model, student_id):
+    async with AsyncSessionLocal() as db:
+        return (await db.scalars(select(model).filter_by(student_id=student_id))).all()
+
+def _brief(results):
+    return [(r["index"], r["type"], r["ok"], r.get("status")) for r in results]
+
+def test_events_run_in_timestamp_order_and_results_keep_the_submitted_order():
+    results = run(_batch([
+        {"type": "focus_stop", "student_id": "B1", "timestamp": "2024-05-07T10:00:30+09:00"},
+        {"type": "focus_start", "student_id": "B1", "timestamp": "2024-05-07T10:00:00+09:00"},
+        {"type": "focus_start", "student_id": "B1"},
+    ], "B1"))
+    assert _brief(results) == [(0, "focus_stop", True, None), (1, "focus_start", True, None), (2, "focus_start", False, 422)]
+    assert results[0]["duration_seconds"] == 30
+
+def test_utc_timestamps_are_judged_on_the_kst_day():
+    # 23:50 UTC is 08:50 KST the next day: on time for a 09:00 check-in
+    results = run(_batch([{"type": "dashboard_start", "student_id": "B2", "timestamp": "2024-05-06T23:50:00Z"}], "B2"))
+    assert results[0]["attendance"]["date"] == "2024-05-07"
+    assert run(_rows(models.Notice, "B2")) == []
+
+def test_rejected_events_are_skipped_and_the_rest_commit():
+    results = run(_batch([
+        {"type": "outing_return", "student_id": "B3", "timestamp": "2024-05-07T13:00:00+09:00"},
+        {"type": "outing_request", "student_id": "B3", "timestamp": "2024-05-07T13:01:00+09:00", "expected_return_time": "2024-05-07T14:00:00+09:00"},
+        {"type": "outing_request", "student_id": "B3", "timestamp": "2024-05-07T13:02:00+09:00", "expected_return_time": "2024-05-07T14:00:00+09:00"},
+        {"type": "outing_return", "student_id": "B3", "timestamp": "2024-05-07T13:30:00+09:00"},
+    ], "B3"))
+    assert _brief(results) == [(0, "outing_return", False, 404), (1, "outing_request", True, None),
+                               (2, "outing_request", False, 409), (3, "outing_return", True, None)]
+    assert [o.status for o in run(_rows(models.OutingRequest, "B3"))] == ["completed"]
+
+def test_an_unexpected_error_rolls_back_the_student_and_restores_live_state(monkeypatch):
+    async def boom(db, ev):
+        raise RuntimeError("disk full")
+    monkeypatch.setitem(events.HANDLERS, "logout", (schemas.Logout, boom))
+    results = run(_batch([
+        {"type": "focus_start", "student_id": "B4", "timestamp": "2024-05-07T10:00:00+09:00"},
+        {"type": "logout", "student_id": "B4", "timestamp": "2024-05-07T11:00:00+09:00"},
+        {"type": "focus_start", "student_id": "B5", "timestamp": "2024-05-07T10:00:00+09:00"},
+    ], "B4", "B5"))
+    assert _brief(results) == [(0, "focus_start", False, 500), (1, "logout", False, 500), (2, "focus_start", True, None)]
+    assert live_state.peek("B4") is None and run(_rows(models.FocusSession, "B4")) == []
+    assert live_state.peek("B5").focus_id == results[2]["focus_session_id"]
@@ -0,0 +1,89 @@
+import asyncio
+import json
+from datetime import datetime
+
+from app import models
+from app.cache import student_cache
+from app.database import AsyncSessionLocal
+from app.dispatcher import BroadcastDispatcher
+from app.livestate import live_state
+from app.uow import commit
+from app.websockets import WSManager
+from conftest import run
+
+class FakeSocket:
+    def __init__(self):
+        self.sent, self.closed = [], None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data):
+        self.sent.append(json.loads(data))
+
+    async def close(self, code=1000):
+        await asyncio.sleep(0)
+        self.closed = code
+
+async def _overflow():
+    ran, calls = [], []
+    dispatcher = BroadcastDispatcher(workers=1, max_queued=2, overflow="drop_oldest")
+    for i in range(5):
+        dispatcher.submit(lambda i=i: asyncio.sleep(0, ran.append(i)))
+
+    async def on_overflow():
+        calls.append(list(ran))
+    await dispatcher.start(on_overflow)
+    await dispatcher.stop()
+    return ran, calls, dispatcher.stats["dropped"]
+
+def test_dropped_broadcasts_trigger_one_overflow_call_before_the_next_job():
+    assert asyncio.run(_overflow()) == ([3, 4], [[]], 3)
+
+async def _resync():
+    manager = WSManager()
+    student, admin = FakeSocket(), FakeSocket()
+    await manager.connect_student("S1", student)
+    await manager.connect_admin(admin)
+    await manager.send_to_all("S1", {"type": "focus_start", "data": {}})
+    await manager.resync_all()
+    await asyncio.sleep(0.01)
+    for ws in (student, admin):
+        manager.disconnect(ws)
+    return [m["type"] for m in student.sent], admin.sent[-1]
+
+def test_resync_tells_every_stream_its_current_seq():
+    student, admin_last = asyncio.run(_resync())
+    assert student == ["hello", "focus_start", "resync_required"]
+    assert admin_last["type"] == "resync_required" and admin_last["data"]["seq"] == 1
+
+async def _evict_then_stop():
+    manager = WSManager(max_queued=1)
+    ws = FakeSocket()
+    await manager.connect_student("S2", ws)  # the hello frame fills the queue
+    await manager.send_to_student("S2", {"type": "logout", "data": {}})
+    pending = len(manager._closing)
+    await manager.stop()
+    return pending, len(manager._closing), ws.closed
+
+def test_evicted_sockets_are_closed_by_tracked_tasks_drained_on_stop():
+    assert asyncio.run(_evict_then_stop()) == (1, 0, 1013)
+
+async def _roster_from_another_worker():
+    async with AsyncSessionLocal() as db:
+        db.add(models.Student(id="S3", name="S3", expected_check_in="09:00:00"))
+        await commit(db)
+        await student_cache.get(db, "S3")
+    WSManager().deliver({"op": "roster", "student_id": "S3", "classroom": "A", "grade": "1"})
+    return student_cache.peek("S3")
+
+def test_roster_envelope_drops_the_cached_student():
+    assert run(_roster_from_another_worker()) is None
+
+def test_state_envelope_replays_a_transition_committed_elsewhere():
+    expected = datetime(2024, 3, 6, 15, 0)
+    WSManager().deliver({"op": "state", "call": "outing_started", "args": ["S4", 7, expected.isoformat()]})
+    state = live_state.peek("S4")
+    assert (state.outing_id, state.outing_expected) == (7, expected)
+    WSManager().deliver({"op": "state", "call": "outing_ended", "args": ["S4", 7]})
+    assert live_state.view("S4").activity() == "idle"
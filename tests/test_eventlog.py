@@ -0,0 +1,69 @@
+import asyncio
+import glob
+import json
+import os
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, select
+
+from app import eventlog, models
+from app.database import AsyncSessionLocal
+from app.eventlog import EventLogWriter
+from conftest import run
+
+def _writer(spool: str, suffix: str = "") -> EventLogWriter:
+    writer = EventLogWriter(flush_ms=3_600_000, spool_path=spool)
+    if suffix:
+        writer._active = f"{spool}.{suffix}"  # a second worker process
+    return writer
+
+async def _count(student_id: str) -> int:
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(func.count()).select_from(models.EventLog).filter_by(student_id=student_id))
+
+async def _two_workers(spool: str):
+    first, second = _writer(spool), _writer(spool, "other")
+    await first.start()
+    first.record("spool-shared", "focus_start", datetime(2024, 1, 1, 9, 0))
+    await second.start()  # must not replay the first worker's in-flight row
+    second.record("spool-shared", "focus_stop", datetime(2024, 1, 1, 10, 0))
+    await first.flush()  # rotates only its own spool
+    assert os.path.exists(second._active)
+    await second.flush()
+    await first.stop()
+    await second.stop()
+    return await _count("spool-shared"), second.stats["replayed"]
+
+def test_workers_sharing_a_spool_path_keep_their_own_files(tmp_path):
+    spool = str(tmp_path / "eventlog.spool")
+    assert run(_two_workers(spool)) == (2, 0)
+    assert glob.glob(spool + "*") == []
+
+async def _restart(spool: str):
+    writer = _writer(spool)
+    await writer.start()
+    await writer.stop()
+    return await _count("spool-crashed"), writer.stats["replayed"]
+
+def test_leftovers_of_a_dead_worker_are_replayed(tmp_path):
+    spool = str(tmp_path / "eventlog.spool")
+    row = {"student_id": "spool-crashed", "type": "logout", "timestamp": "2024-01-01T18:00:00", "payload": {}}
+    for path in (f"{spool}.99999", f"{spool}.99999.3"):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(row) + "\n" + '{"torn')
+    assert run(_restart(spool)) == (2, 2)
+    assert glob.glob(spool + "*") == []
+
+def test_spool_is_refused_without_fcntl_and_the_buffer_still_starts(tmp_path, monkeypatch):
+    # as on Windows, where importing fcntl fails
+    monkeypatch.setattr(eventlog, "fcntl", None)
+    with pytest.raises(RuntimeError, match="STUDYFLOW_EVENTLOG_SPOOL"):
+        asyncio.run(_writer(str(tmp_path / "spool.jsonl")).start())
+
+    async def unspooled():
+        writer = EventLogWriter(flush_ms=3_600_000)
+        await writer.start()
+        await writer.stop()
+        return writer.stats["failures"]
+    assert asyncio.run(unspooled()) == 0
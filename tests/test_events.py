@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from app import events, models, logic, schemas
+from app.database import AsyncSessionLocal, async_engine
+from app.timeutil import KST
+from app.uow import commit
+from conftest import run
+
+DAY = datetime(2024, 5, 8, 9, 40, tzinfo=KST)
+
+def _aware(clauseelement, multiparams, params):
+    # the values as bound to the statement, before the dialect turns them into strings
+    rows = [clauseelement.compile().params] if hasattr(clauseelement, "compile") else []
+    rows += [*multiparams, params]
+    return [v for row in rows if isinstance(row, dict) for v in row.values() if isinstance(v, datetime) and v.tzinfo is not None]
+
+async def _day(student_id: str) -> list:
+    # asyncpg rejects timezone-aware values for the naive DateTime columns; nothing may bind one
+    bound = []
+    listener = lambda conn, clauseelement, multiparams, params, options: bound.extend(_aware(clauseelement, multiparams, params))
+    event.listen(async_engine.sync_engine, "before_execute", listener)
+    try:
+        async with AsyncSessionLocal() as db:
+            db.add(models.Student(id=student_id, name=student_id, expected_check_in="09:00:00"))
+            await commit(db)
+            at = lambda minutes: DAY + timedelta(minutes=minutes)
+            for handler, ev in [
+                (events.dashboard_start, schemas.DashboardStart(student_id=student_id, timestamp=at(0))),
+                (events.outing_request, schemas.OutingRequestIn(student_id=student_id, timestamp=at(10), expected_return_time=at(20))),
+                (events.outing_return, schemas.OutingReturnIn(student_id=student_id, timestamp=at(30))),
+                (events.sleep_request, schemas.SleepRequestIn(student_id=student_id, timestamp=at(40), expected_wake_time=at(50))),
+                (events.sleep_return, schemas.SleepReturnIn(student_id=student_id, timestamp=at(60))),
+                (events.focus_start, schemas.FocusStartIn(student_id=student_id, timestamp=at(70))),
+                (events.focus_stop, schemas.FocusStopIn(student_id=student_id, timestamp=at(80))),
+                (events.logout, schemas.Logout(student_id=student_id, timestamp=at(90))),
+            ]:
+                await handler(db, ev)
+                await commit(db)
+            await logic.sweep_absences(db, "2024-05-08")
+    finally:
+        event.remove(async_engine.sync_engine, "before_execute", listener)
+    return bound
+
+def test_handlers_bind_only_naive_datetimes():
+    assert run(_day("naive-day")) == []
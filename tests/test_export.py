@@ -0,0 +1,43 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+import pytest
+
+from sqlalchemy import insert
+
+from app import export, models
+from app.database import AsyncSessionLocal
+from conftest import run
+
+@pytest.fixture(scope="module", autouse=True)
+def seeded():
+    run(_seed())
+
+async def _seed():
+    async with AsyncSessionLocal() as db:
+        db.add_all([models.Student(id="export-a", name="가", classroom="3A"), models.Student(id="export-b", name="나", classroom="3A"),
+                    models.Student(id="export-c", name="다", classroom="3B")])
+        await db.execute(insert(models.EventLog), [
+            {"student_id": sid, "type": "focus_start", "timestamp": datetime(2023, 6, day, 12), "payload": {"n": day}}
+            for day in (1, 2, 30) for sid in ("export-a", "export-b", "export-c")])
+        await db.execute(insert(models.AttendanceRecord), [
+            {"student_id": sid, "date": f"2023-06-0{day}", "status": "present", "check_in_time": datetime(2023, 6, day, 9)}
+            for day in (1, 2) for sid in ("export-a", "export-c")])
+        await db.commit()
+
+async def _collect(body) -> bytes:
+    return b"".join([chunk async for chunk in body])
+
+def test_event_export_streams_a_classroom_in_time_order():
+    body = run(_collect(export.export_events("ndjson", "2023-06-02", "2023-06-30", classroom="3A")))
+    rows = [json.loads(line) for line in body.decode().splitlines()]
+    assert [(r["student_id"], r["payload"]["n"]) for r in rows] == [("export-a", 2), ("export-b", 2), ("export-a", 30), ("export-b", 30)]
+
+def test_attendance_export_as_csv():
+    body = run(_collect(export.export_attendance("csv", "2023-06-01", "2023-06-01")))
+    assert body.startswith("\ufeff".encode())
+    rows = list(csv.reader(io.StringIO(body.decode("utf-8-sig"))))
+    assert rows[0] == list(export.ATTENDANCE_COLUMNS)
+    assert [r[:5] for r in rows[1:]] == [["2023-06-01", "export-a", "가", "", "3A"], ["2023-06-01", "export-c", "다", "", "3B"]]
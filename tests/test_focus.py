@@ -0,0 +1,35 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from app import events, models, schemas
+from app.database import AsyncSessionLocal
+from app.livestate import live_state
+from app.timeutil import KST
+from app.uow import commit
+from conftest import run
+
+START = datetime(2024, 3, 4, 20, 0, tzinfo=KST)
+
+async def _focus(student_id: str, seconds: int) -> dict:
+    async with AsyncSessionLocal() as db:
+        db.add(models.Student(id=student_id, name=student_id))
+        await commit(db)
+        await events.focus_start(db, schemas.FocusStartIn(student_id=student_id, timestamp=START))
+        await commit(db)
+        result = await events.focus_stop(db, schemas.FocusStopIn(student_id=student_id, timestamp=START + timedelta(seconds=seconds)))
+        await commit(db)
+        stored = await db.scalar(select(models.FocusSession.duration_seconds).filter_by(student_id=student_id))
+        focus_seconds = await db.scalar(select(models.DailyStudentSummary.focus_seconds).filter_by(student_id=student_id))
+        return {"result": result["duration_seconds"], "stored": stored, "summary": focus_seconds}
+
+def test_focus_duration_from_live_state_on_utc_host(utc_host):
+    live_state.ready = True
+    try:
+        assert run(_focus("focus-live", 5)) == {"result": 5, "stored": 5, "summary": 5}
+    finally:
+        live_state.ready = False
+
+def test_focus_duration_from_fallback_query_on_utc_host(utc_host):
+    assert not live_state.ready  # focus_stop falls back to the student's latest session row
+    assert run(_focus("focus-fallback", 7)) == {"result": 7, "stored": 7, "summary": 7}
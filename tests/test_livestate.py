@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from app import events, models, schemas
+from app.database import AsyncSessionLocal
+from app.livestate import live_state
+from app.timeutil import KST
+from app.uow import commit
+from conftest import run
+
+START = datetime(2024, 3, 5, 14, 0, tzinfo=KST)
+
+@pytest.fixture
+def loaded():
+    live_state.ready = True
+    yield
+    live_state.ready = False
+
+async def _on(db, handler, ev):
+    result = await handler(db, ev)
+    await commit(db)
+    return result
+
+async def _other_worker(student_id: str) -> list:
+    # the requests start on worker A; this registry (worker B) never saw them
+    async with AsyncSessionLocal() as db:
+        db.add(models.Student(id=student_id, name=student_id))
+        await commit(db)
+        await _on(db, events.outing_request, schemas.OutingRequestIn(student_id=student_id, timestamp=START, expected_return_time=START + timedelta(hours=1)))
+        await _on(db, events.focus_start, schemas.FocusStartIn(student_id=student_id, timestamp=START))
+        live_state.restore(student_id, None)
+        returned = await _on(db, events.outing_return, schemas.OutingReturnIn(student_id=student_id, timestamp=START + timedelta(minutes=30)))
+        stopped = await _on(db, events.focus_stop, schemas.FocusStopIn(student_id=student_id, timestamp=START + timedelta(minutes=40)))
+        try:
+            await _on(db, events.outing_return, schemas.OutingReturnIn(student_id=student_id, timestamp=START + timedelta(minutes=50)))
+        except HTTPException as e:
+            again = e.status_code
+        return [returned, stopped, again]
+
+def test_requests_started_on_another_worker_complete_from_the_database(loaded):
+    assert run(_other_worker("live-other")) == [{"ok": True}, {"ok": True, "duration_seconds": 2400}, 404]
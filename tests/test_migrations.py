@@ -0,0 +1,25 @@
+from sqlalchemy import inspect
+
+from app import migrations
+from app.database import make_engine
+
+def _fresh(tmp_path):
+    eng = make_engine(f"sqlite:///{tmp_path}/plans.db")
+    assert migrations.upgrade(eng) == [version for version, _, _ in migrations.MIGRATIONS]
+    return eng
+
+def test_hot_queries_are_served_by_indexes(tmp_path):
+    eng = _fresh(tmp_path)
+    for label, plan in migrations.explain(eng).items():
+        assert plan, label
+        for step in plan:
+            assert "USING INDEX" in step or "USING COVERING INDEX" in step, f"{label}: {step}"
+            assert "TEMP B-TREE" not in step, f"{label}: {step}"
+    eng.dispose()
+
+def test_upgrade_is_idempotent_and_skips_postgres_only_indexes(tmp_path):
+    eng = _fresh(tmp_path)
+    assert migrations.upgrade(eng) == []
+    indexes = {ix["name"] for ix in inspect(eng).get_indexes("focus_sessions")}
+    assert "ix_focus_sessions_student_latest" not in indexes
+    eng.dispose()
@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from app import models
+from app.database import AsyncSessionLocal
+from app.dedupe import notice_index
+from app.logic import outing_alert, sleep_alert, sweep_absences
+from app.scheduler import DeadlineScheduler
+from app.timeutil import KST, to_db_time
+from app.uow import commit
+from conftest import run
+
+KEY = ("outing", 99)
+
+async def _two_workers(lock_path: str):
+    forwarded = []
+    leader, follower = DeadlineScheduler(lock_path), DeadlineScheduler(lock_path)
+    await leader.start(forward=forwarded.append)
+    await follower.start(forward=forwarded.append)
+    try:
+        steps = [(leader.leading, follower.leading)]
+        follower.schedule(KEY, "outing", "S9", [datetime(2030, 1, 1, 9, 0, tzinfo=KST)])
+        follower.cancel(KEY)
+        schedule, cancel = forwarded
+        follower.apply(schedule)  # not the leading worker: ignored
+        leader.apply(schedule)
+        steps.append((KEY in follower._live, KEY in leader._live))
+        leader.apply(cancel)
+        steps.append(KEY in leader._live)
+        return steps
+    finally:
+        await follower.stop()
+        await leader.stop()
+
+def test_one_worker_runs_the_deadlines_and_the_others_forward_to_it(tmp_path):
+    assert run(_two_workers(str(tmp_path / "scheduler.lock"))) == [(True, False), (False, True), False]
+
+def test_alerts_read_stored_times_as_server_local_on_utc_host(utc_host):
+    now = datetime(2024, 5, 7, 14, 0, tzinfo=KST)
+    outing = models.OutingRequest(id=1, student_id="S1", expected_return_time=to_db_time(now + timedelta(hours=1)))
+    sleep = models.SleepRequest(id=1, student_id="S1", expected_wake_time=to_db_time(now + timedelta(hours=1)))
+    assert outing_alert(outing, now) is None and sleep_alert(sleep, now) is None
+    later = now + timedelta(hours=1, seconds=10)
+    assert outing_alert(outing, later)[1] == "[외출 복귀 지각 알림] 현재 10초 지각 중입니다. 복귀예정 15:00:00"
+    assert sleep_alert(sleep, later)[1] == "[수면 복귀 지연 알림] 현재 10초 지연 중입니다. 기상예정 15:00:00"
+
+async def _rebuilt_deadlines(lock_path: str, expected: datetime):
+    async with AsyncSessionLocal() as db:
+        db.add(models.OutingRequest(student_id="SCH", start_time=to_db_time(expected - timedelta(hours=1)),
+                                    expected_return_time=to_db_time(expected), status="ongoing"))
+        await commit(db)
+    scheduler = DeadlineScheduler(lock_path)
+    await scheduler.rebuild()
+    return sorted(when for when, _, _, kind, student_id in scheduler._heap if kind == "outing" and student_id == "SCH")
+
+def test_rebuild_schedules_ongoing_outings_at_their_real_deadline_on_utc_host(utc_host, tmp_path):
+    expected = (datetime.now(KST) + timedelta(hours=2)).replace(microsecond=0)
+    assert run(_rebuilt_deadlines(str(tmp_path / "scheduler.lock"), expected)) == [
+        expected + timedelta(seconds=1), expected + timedelta(minutes=30)]
+
+async def _sweep_twice(date_str: str):
+    async with AsyncSessionLocal() as db:
+        for student_id in ("SW1", "SW2"):
+            db.add(models.Student(id=student_id, name=student_id))
+        await commit(db)
+        first = await sweep_absences(db, date_str)
+        second = await sweep_absences(db, date_str)
+        notice_index.clear()  # as after a restart: the notices are only found in the database
+        third = await sweep_absences(db, date_str)
+        notices = await db.scalar(select(func.count()).select_from(models.Notice).where(
+            models.Notice.date == date_str, models.Notice.student_id.in_(["SW1", "SW2"])))
+        return first["notices_issued"] >= 2, second["notices_issued"], third["notices_issued"], notices
+
+def test_sweeping_a_day_twice_issues_no_duplicate_notices():
+    assert run(_sweep_twice("2024-05-09")) == (True, 0, 0, 2)
+
+async def _planned(day_close: str, lock_path: str):
+    scheduler = DeadlineScheduler(lock_path, day_close=day_close)
+    await scheduler.rebuild()
+    return ("dayclose",) in scheduler._live
+
+def test_the_automatic_sweep_is_opt_in(tmp_path):
+    lock_path = str(tmp_path / "scheduler.lock")
+    assert run(_planned("", lock_path)) is False
+    assert run(_planned("23:50:00", lock_path)) is True
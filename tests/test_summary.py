@@ -0,0 +1,42 @@
+from datetime import datetime
+
+from sqlalchemy import select
+
+from app import events, models, schemas, summary
+from app.database import AsyncSessionLocal
+from app.timeutil import KST
+from app.uow import commit
+from conftest import run
+
+DAY = datetime(2024, 5, 7, tzinfo=KST)
+at = lambda hh, mm, ss=0: DAY.replace(hour=hh, minute=mm, second=ss)
+
+async def _live_then_rebuilt(student_id: str):
+    # one KST day through the event handlers (early morning included), then the same day rebuilt from the source tables
+    async with AsyncSessionLocal() as db:
+        db.add(models.Student(id=student_id, name=student_id, expected_check_in="07:00:00"))
+        await commit(db)
+        steps = [
+            (events.dashboard_start, schemas.DashboardStart(student_id=student_id, timestamp=at(7, 10))),
+            (events.focus_start, schemas.FocusStartIn(student_id=student_id, timestamp=at(7, 20))),
+            (events.focus_stop, schemas.FocusStopIn(student_id=student_id, timestamp=at(8, 20))),
+            (events.outing_request, schemas.OutingRequestIn(student_id=student_id, timestamp=at(8, 30), expected_return_time=at(8, 40))),
+            (events.outing_return, schemas.OutingReturnIn(student_id=student_id, timestamp=at(8, 45))),
+            (events.sleep_request, schemas.SleepRequestIn(student_id=student_id, timestamp=at(13, 0), expected_wake_time=at(13, 20))),
+            (events.sleep_return, schemas.SleepReturnIn(student_id=student_id, timestamp=at(13, 21, 30))),
+        ]
+        for handler, ev in steps:
+            await handler(db, ev)
+            await commit(db)
+        read = lambda: db.execute(select(models.DailyStudentSummary.date, *(getattr(models.DailyStudentSummary, k) for k in summary.COUNTERS))
+                                  .filter_by(student_id=student_id))
+        live = [tuple(r) for r in await read()]
+        day = DAY.date().isoformat()
+        await summary.rebuild(db, day, day)
+        db.expire_all()
+        return live, [tuple(r) for r in await read()]
+
+def test_rebuild_matches_live_summary_on_utc_host(utc_host):
+    live, rebuilt = run(_live_then_rebuilt("summary-utc"))
+    assert live == [("2024-05-07", 3600, 1, 1, 300, 1, 90, 600, 2, 2)]
+    assert rebuilt == live
@@ -0,0 +1,40 @@
+import asyncio
+import os
+
+from app.broker import RedisBroker, serve
+from app.versions import NOTICES, versions
+from app.websockets import WSManager
+
+async def _until(predicate, timeout=2.0):
+    for _ in range(int(timeout / 0.01)):
+        if predicate():
+            return True
+        await asyncio.sleep(0.01)
+    return False
+
+async def _remote_bump(tmp_path):
+    # two workers on one broker: `other` commits a notice, `here` must stop treating its stamp as current
+    path = f"{tmp_path}/broker.sock"
+    server = asyncio.get_running_loop().create_task(serve(path))
+    await _until(lambda: os.path.exists(path))
+    here, other = WSManager(), WSManager()
+    await here.start(RedisBroker(f"unix://{path}"), heartbeat=0)
+    await other.start(RedisBroker(f"unix://{path}"), heartbeat=0)
+    await asyncio.sleep(0.05)  # both subscriptions are up
+    before = versions.stamp(NOTICES, "S1")
+    await other.share({"op": "versions", "resource": NOTICES, "keys": ["S1"]})
+    moved = await _until(lambda: versions.stamp(NOTICES, "S1") != before)
+    await here.stop()
+    await other.stop()
+    server.cancel()
+    return moved, before[1] < versions.stamp(NOTICES, "S1")[1]
+
+def test_a_bump_on_another_worker_moves_the_stamp_here(tmp_path):
+    assert asyncio.run(_remote_bump(tmp_path)) == (True, True)
+
+def test_resync_forgets_every_stamp():
+    versions.bump(NOTICES, "S2")
+    etag, modified = versions.stamp(NOTICES, "S2")
+    WSManager().deliver({"op": "resync"})
+    assert versions.stamp(NOTICES, "S2")[0] != etag
+    assert len(versions) == 0